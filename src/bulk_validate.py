@@ -0,0 +1,188 @@
+"""
+Command line gate that runs read_dicom_file + validate_dicom over every file in a folder tree
+across a process pool and writes one JSON line per file to a report.
+
+Paths are walked lazily and handed to the workers in chunks, with only a few chunks in flight
+at a time, and each worker returns a small dict rather than the dataset, so memory stays flat
+however large the archive is.
+
+Usage: python -m src.bulk_validate <directory> [--report report.jsonl] [--workers N]
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass
+from itertools import islice
+
+from src.dicom_scanner import iter_dicom_paths
+from src.dicom_utils import validate_dicom
+from src.read_dicom_file import read_dicom_header, tag_union
+
+logger = logging.getLogger(__name__)  # Start logger
+
+# the only tags validate_dicom looks at
+VALIDATE_TAGS = tag_union(validate_dicom)
+
+# report status of each file
+VALID = "valid"
+INVALID = "invalid"
+UNREADABLE = "unreadable"
+
+@dataclass
+class ValidationSummary:
+    """
+    This class stores the totals of a bulk validation run.
+    """
+    valid: int = 0
+    invalid: int = 0
+    unreadable: int = 0
+    elapsed: float = 0.0  # seconds
+
+    @property
+    def total(self) -> int:
+        """:return: number of files checked"""
+        return self.valid + self.invalid + self.unreadable
+
+    @property
+    def files_per_second(self) -> float:
+        """:return: aggregate throughput of the run"""
+        return self.total / self.elapsed if self.elapsed > 0 else 0.0
+
+    def add(self, status):
+        """Counts one report entry"""
+        setattr(self, status, getattr(self, status) + 1)
+
+def validate_file(file_path) -> dict:
+    """
+    Reads the header of one file and runs validate_dicom on it.
+    :param file_path: path to the file
+    :return: report entry with the path, status and rejection reason (None if valid)
+    """
+    ds = read_dicom_header(file_path, specific_tags=VALIDATE_TAGS)
+    if ds is None:
+        return {"path": str(file_path), "status": UNREADABLE, "reason": "Not a readable DICOM file"}
+    try:
+        validate_dicom(ds)
+    except (ValueError, TypeError) as e:
+        return {"path": str(file_path), "status": INVALID, "reason": str(e)}
+    return {"path": str(file_path), "status": VALID, "reason": None}
+
+def _validate_chunk(paths):
+    """Worker process entry point, validates a chunk of paths"""
+    return [validate_file(path) for path in paths]
+
+def iter_chunk_results(chunk_function, items, *args, max_workers=None, chunksize=64):
+    """
+    Runs chunk_function over chunks of items across a process pool, yielding its results as
+    chunks complete, with only a few chunks in flight so items are read lazily.
+    Results are not in the order of items.
+    :param chunk_function: picklable function of (chunk, *args) returning a list of results
+    :param items: iterable of picklable items, consumed lazily
+    :param args: picklable arguments passed to every call after the chunk
+    :param max_workers: number of worker processes, defaults to the CPU count
+    :param chunksize: number of items sent to a worker at a time
+    :return: generator of the results of every chunk
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    # two chunks per worker keeps every worker busy without reading the whole tree ahead
+    max_pending = max_workers * 2
+    items = iter(items)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        pending = set()
+        while True:
+            while len(pending) < max_pending and (chunk := list(islice(items, chunksize))):
+                pending.add(executor.submit(chunk_function, chunk, *args))
+            if not pending:
+                return
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from future.result()
+
+def iter_validation_results(paths, max_workers=None, chunksize=64):
+    """
+    Validates files across a process pool, yielding report entries as chunks complete.
+    Entries are not in the order of paths.
+    :param paths: iterable of file paths, consumed lazily
+    :param max_workers: number of worker processes, defaults to the CPU count
+    :param chunksize: number of files sent to a worker at a time
+    :return: generator of report entries, see validate_file()
+    """
+    return iter_chunk_results(
+        _validate_chunk, paths, max_workers=max_workers, chunksize=chunksize
+    )
+
+def validate_directory(directory, report, max_workers=None, chunksize=64, progress_every=1000):
+    """
+    Validates every file under directory and writes a JSON line per file to report.
+    :param directory: root of the folder tree
+    :param report: writable text file for the JSON-lines report
+    :param max_workers: number of worker processes
+    :param chunksize: number of files sent to a worker at a time
+    :param progress_every: log the running throughput after this many files
+    :return: the ValidationSummary of the run
+    """
+    summary = ValidationSummary()
+    start = time.perf_counter()
+    results = iter_validation_results(iter_dicom_paths(directory), max_workers, chunksize)
+    for entry in results:
+        report.write(json.dumps(entry) + "\n")
+        summary.add(entry["status"])
+        if progress_every and summary.total % progress_every == 0:
+            summary.elapsed = time.perf_counter() - start
+            logger.info("%d files, %.1f files/s", summary.total, summary.files_per_second)
+    summary.elapsed = time.perf_counter() - start
+    return summary
+
+def configure_logging(name):
+    """
+    Logging of a command line run to stderr. Only warnings are shown from other modules, which
+    the worker processes inherit, so read_dicom_file's line per file does not bury the summary.
+    :param name: logger of the command, its progress is shown at INFO
+    """
+    logging.basicConfig(level=logging.WARNING, format="%(message)s", stream=sys.stderr)
+    logging.getLogger(name).setLevel(logging.INFO)
+
+def main(argv=None):
+    """
+    Command line entry point.
+    :param argv: arguments, defaults to sys.argv
+    :raises SystemExit: on bad arguments
+    :return: exit code, 0 if every file is valid, 1 if any was rejected
+    """
+    parser = argparse.ArgumentParser(
+        description="Validate every DICOM file in a folder tree before ingest."
+    )
+    parser.add_argument("directory", help="root of the folder tree to validate")
+    parser.add_argument(
+        "--report", default="-", help="JSON-lines report to write, '-' for stdout (default)"
+    )
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes")
+    parser.add_argument(
+        "--chunksize", type=int, default=64, help="files sent to a worker at a time"
+    )
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.directory):
+        parser.error(f"{args.directory} is not a directory")
+
+    configure_logging(__name__)
+    if args.report == "-":
+        summary = validate_directory(args.directory, sys.stdout, args.workers, args.chunksize)
+    else:
+        with open(args.report, "w", encoding="utf-8") as report:
+            summary = validate_directory(args.directory, report, args.workers, args.chunksize)
+
+    print(
+        f"{summary.total} files in {summary.elapsed:.1f}s ({summary.files_per_second:.1f} files/s): "
+        f"{summary.valid} valid, {summary.invalid} invalid, {summary.unreadable} unreadable",
+        file=sys.stderr,
+    )
+    return 0 if summary.valid == summary.total else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,157 @@
+"""
+Volume kept in the stored dtype of its slices (int16/uint16 for CT and MR) instead of
+normalized float32, which halves its memory. The modality rescale is kept per slice and only
+applied when a slice is rendered, e.g. through WindowedFrame's lookup table.
+
+All slices live in one preallocated contiguous (slices, rows, columns) array, so the volume can
+be reformatted as strided views of it (see mpr.py). With a memory cap smaller than the volume
+the array is a memory mapped scratch file instead, and the OS keeps the recently used slices
+of it in RAM.
+"""
+
+import logging
+import tempfile
+
+import numpy as np
+
+from src.dicom_volume import DicomVolume
+from src.window_level import Rescale
+
+logger = logging.getLogger(__name__)  # Start logger
+
+class CompactVolume(DicomVolume):
+    """
+    Slices in their stored dtype, filled in with set_frame() as they are decoded.
+    Frames are views of the volume's array, treat them as read-only.
+    """
+    def __init__(self, length, frame_shape, dtype, rescale=Rescale(), max_bytes=None,
+                 scratch_dir=None, paths=None):
+        """
+        :param length: number of slices
+        :param frame_shape: (rows, columns) of every slice
+        :param dtype: stored dtype of the slices
+        :param rescale: modality rescale of slices that were set without their own
+        :param max_bytes: volume size kept in RAM at most, in bytes, None for no limit
+        :param scratch_dir: folder for the scratch file, defaults to the system temp folder
+        :param paths: file of each slice, used by frame_source()
+        """
+        self.length = length
+        self._frame_shape = tuple(frame_shape)
+        self.dtype = np.dtype(dtype)
+        self.max_bytes = max_bytes
+        self.scratch_dir = scratch_dir
+        self.paths = paths
+        # modality rescale of each slice, as vectors a renderer can apply per row
+        self.slopes = np.full(length, rescale.slope, dtype=np.float64)
+        self.intercepts = np.full(length, rescale.intercept, dtype=np.float64)
+        self._loaded = np.zeros(length, dtype=bool)
+        self._scratch_file = None
+        if max_bytes is not None and self.nbytes > max_bytes:
+            self.array = self._scratch_array()
+        else:
+            # pages of slices that are never set are never touched, so take no RAM
+            self.array = np.empty(self.shape, dtype=self.dtype)
+
+    def __len__(self) -> int:
+        return self.length
+
+    @property
+    def frame_shape(self) -> tuple[int, ...]:
+        return self._frame_shape
+
+    @property
+    def frame_nbytes(self) -> int:
+        """:return: size of one slice in bytes"""
+        return int(np.prod(self._frame_shape)) * self.dtype.itemsize
+
+    @property
+    def nbytes(self) -> int:
+        """:return: size of the whole volume in bytes"""
+        return self.length * self.frame_nbytes
+
+    @property
+    def spilled(self) -> bool:
+        """:return: True if the array is a memory mapped scratch file"""
+        return isinstance(self.array, np.memmap)
+
+    @property
+    def nbytes_in_memory(self) -> int:
+        """:return: bytes of slices held in RAM, a spilled volume is paged by the OS"""
+        return 0 if self.spilled else int(self._loaded.sum()) * self.frame_nbytes
+
+    def frame_source(self, index: int) -> tuple[str | None, int]:
+        index = self._check_index(index)
+        return (self.paths[index], 0) if self.paths is not None else (None, index)
+
+    def rescale(self, index: int) -> Rescale:
+        """:return: the modality rescale of a slice"""
+        index = self._check_index(index)
+        return Rescale(float(self.slopes[index]), float(self.intercepts[index]))
+
+    def set_frame(self, index: int, pixels, rescale=None):
+        """
+        Copies a decoded slice into its place in the volume's array.
+        :param index: slice index
+        :param pixels: stored values of the slice
+        :param rescale: modality rescale of this slice, defaults to the volume's
+        :raises ValueError: if the slice is not frame_shape, or its values may not fit dtype
+            (e.g. int16 slices in a uint16 volume, which would wrap around)
+        """
+        index = self._check_index(index)
+        if pixels.shape != self._frame_shape:
+            raise ValueError(f"Slice {index} is {pixels.shape}, expected {self._frame_shape}")
+        if not np.can_cast(pixels.dtype, self.dtype):
+            raise ValueError(f"Slice {index} is {pixels.dtype}, expected {self.dtype}")
+        if rescale is not None:
+            self.slopes[index] = rescale.slope
+            self.intercepts[index] = rescale.intercept
+        self.array[index] = pixels
+        self._loaded[index] = True
+
+    def get_frame(self, index: int) -> np.ndarray:
+        index = self._check_index(index)
+        if not self._loaded[index]:
+            raise LookupError(f"Slice {index} has not been loaded")
+        return self.array[index]
+
+    def get_rescaled_frame(self, index: int) -> np.ndarray:
+        """
+        :param index: slice index
+        :return: the slice in modality units (e.g. HU) as float32, made on each call
+        """
+        rescale = self.rescale(index)
+        pixels = self.get_frame(index).astype(np.float32)
+        if rescale.slope != 1.0:
+            pixels *= rescale.slope
+        if rescale.intercept != 0.0:
+            pixels += rescale.intercept
+        return pixels
+
+    def set_max_bytes(self, max_bytes):
+        """
+        Changes the memory cap, moving the array to a scratch file straight away if the volume
+        no longer fits. The array attribute is replaced, views taken before stay in RAM.
+        :param max_bytes: new cap in bytes, None for no limit
+        """
+        self.max_bytes = max_bytes
+        if max_bytes is not None and self.nbytes > max_bytes and not self.spilled:
+            scratch = self._scratch_array()
+            scratch[self._loaded] = self.array[self._loaded]
+            self.array = scratch
+
+    def close(self):
+        """Releases the scratch file, slices of a spilled volume can no longer be read"""
+        if self.spilled:
+            self.array = np.empty((0, *self._frame_shape), dtype=self.dtype)
+            self._loaded[:] = False
+        if self._scratch_file is not None:
+            self._scratch_file.close()
+            self._scratch_file = None
+
+    def _scratch_array(self):
+        """The memory mapped array of the whole volume"""
+        # an anonymous temporary file, removed by the OS when it is closed, and sparse so
+        # only the slices that are set take up disk space
+        self._scratch_file = tempfile.TemporaryFile(dir=self.scratch_dir)
+        logger.info("Keeping a %s volume in a scratch file", self.shape)
+        return np.memmap(self._scratch_file, dtype=self.dtype, mode="w+", shape=self.shape)
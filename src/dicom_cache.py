@@ -0,0 +1,163 @@
+"""
+A shared, thread safe LRU cache for decoded datasets and pixel arrays. Entries are keyed by
+file path + mtime (so an edited file is never served stale) and evicted in least recently used
+order once the total size goes over a configurable limit in bytes.
+"""
+
+import logging
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+
+logger = logging.getLogger(__name__)  # Start logger
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024  # 512 MB
+
+@dataclass
+class CacheStats:
+    """
+    This class is a snapshot of the cache counters.
+    """
+    hits: int
+    misses: int
+    evictions: int
+    size_bytes: int
+    entries: int
+
+class DicomCache:
+    """
+    LRU cache of decoded datasets and arrays, bounded by the total size of its entries in bytes.
+    """
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        :param max_bytes: memory limit in bytes, least recently used entries are evicted above it
+        """
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (value, nbytes)
+        self._size_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        Looks up a cached value and marks it as most recently used.
+        :param key: cache key from file_cache_key()
+        :return: the cached value, or None on a miss
+        """
+        if key is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, nbytes=None):
+        """
+        Adds a value to the cache, evicting least recently used entries to stay under max_bytes.
+        Values bigger than max_bytes on their own are not cached.
+        :param key: cache key from file_cache_key()
+        :param value: dataset or array to cache
+        :param nbytes: size of the value in bytes, estimated when not given
+        """
+        if key is None:
+            return
+        if nbytes is None:
+            nbytes = estimate_nbytes(value)
+        if nbytes > self.max_bytes:
+            logger.debug("Not caching %s, %d bytes is over the limit", key, nbytes)
+            return
+        if isinstance(value, np.ndarray):
+            # cached arrays are shared between callers so must not be changed in place
+            value.flags.writeable = False
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size_bytes -= old[1]
+            self._entries[key] = (value, nbytes)
+            self._size_bytes += nbytes
+            self._evict()
+
+    def set_max_bytes(self, max_bytes):
+        """
+        Changes the memory limit, evicting entries straight away if it went down.
+        :param max_bytes: new memory limit in bytes
+        """
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        """Removes every entry, the counters are kept"""
+        with self._lock:
+            self._entries.clear()
+            self._size_bytes = 0
+
+    def stats(self) -> CacheStats:
+        """
+        :return: a CacheStats snapshot of the hit/miss/eviction counters and current size
+        """
+        with self._lock:
+            return CacheStats(
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                size_bytes=self._size_bytes,
+                entries=len(self._entries),
+            )
+
+    def _evict(self):
+        """Drops least recently used entries until the cache fits, lock must be held"""
+        while self._size_bytes > self.max_bytes and self._entries:
+            key, (_, nbytes) = self._entries.popitem(last=False)
+            self._size_bytes -= nbytes
+            self.evictions += 1
+            logger.debug("Evicted %s from the DICOM cache", key)
+
+def file_cache_key(file_path, *variant):
+    """
+    Builds a cache key from the file's absolute path and mtime, so a changed file misses.
+    :param file_path: path to the file the cached value came from
+    :param variant: anything else the cached value depends on (read mode, frame, ...)
+    :return: the key, or None if the file can not be found
+    """
+    try:
+        mtime_ns = os.stat(file_path).st_mtime_ns
+    except (OSError, TypeError, ValueError):
+        return None
+    return (os.path.abspath(file_path), mtime_ns, *variant)
+
+def estimate_nbytes(value):
+    """
+    Estimates how much memory a cached value holds. Arrays use nbytes (0 for memory
+    mapped arrays, the OS pages those in and out), datasets add up the size of their
+    loaded element values without reading any deferred ones.
+    """
+    if isinstance(value, np.memmap) and value.filename is not None:
+        return 0
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+
+    nbytes = 0
+    items = getattr(value, "items", None)
+    if items is None:
+        return nbytes
+    for _, elem in items():
+        elem_value = getattr(elem, "value", None)
+        if isinstance(elem_value, (bytes, str)):
+            nbytes += len(elem_value)
+        else:
+            nbytes += 64  # nominal size of a small element
+    return nbytes
+
+# Shared cache used by the viewer
+DICOM_CACHE = DicomCache()
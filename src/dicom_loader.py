@@ -0,0 +1,345 @@
+"""
+Background loading for the viewer. The read/validate/decode/normalize/QImage pipeline runs on a
+QThreadPool worker and the results are delivered back to the GUI thread through Qt signals, so
+the window never blocks on file I/O or decoding.
+Large uncompressed images get a strided preview straight after the header has been parsed,
+which is replaced by the full image once it has been decoded.
+Each load carries a CancellationToken that is checked between the pipeline stages, so a load
+that has been superseded by a newer one stops at the next stage instead of finishing its decode.
+Compressed multi-frame files are decoded across a process pool into the cache while they load,
+with progress reported after each chunk of frames.
+"""
+
+import logging
+import multiprocessing
+import threading
+import traceback
+from contextlib import closing
+from dataclasses import dataclass
+
+import numpy as np
+
+from PySide6.QtCore import QObject, QRunnable, Signal
+from PySide6.QtGui import QImage
+
+from src.dicom_cache import file_cache_key
+from src.dicom_scanner import scan_directory
+from src.dicom_utils import PatientInfo, extract_patient_info, numpy_to_qimage, validate_dicom
+from src.inputs_and_outputs import get_normalized_pixel_array
+from src.parallel_decode import frame_layout, is_compressed, stream_decoded_frames
+from src.pixel_memmap import get_pixel_memmap
+from src.read_dicom_file import load_pixel_data, read_dicom_header
+from src.window_level import (
+    WindowedFrame, apply_window, auto_window, pixel_histogram, rescale_from_dataset,
+    window_from_dataset,
+)
+
+logger = logging.getLogger(__name__)  # Start logger
+
+# longest side of the preview, in pixels
+PREVIEW_SIZE = 256
+
+class LoadCancelled(Exception):
+    """Raised inside a pipeline when its CancellationToken has been cancelled"""
+
+class CancellationToken:
+    """
+    Thread-safe flag shared between the GUI thread and one background load.
+    The GUI cancels it when a newer load supersedes this one, the pipeline checks it
+    between stages.
+    """
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        """Marks the load as no longer wanted"""
+        self._event.set()
+
+    def is_cancelled(self) -> bool:
+        """:return: True once cancel() has been called"""
+        return self._event.is_set()
+
+    def check(self):
+        """
+        :raises LoadCancelled: if the token has been cancelled
+        """
+        if self._event.is_set():
+            raise LoadCancelled()
+
+def _start_stage(stage, progress=None, token=None):
+    """Checks the token before a pipeline stage starts, then reports the stage"""
+    if token is not None:
+        token.check()
+    if progress is not None:
+        progress(stage)
+
+@dataclass
+class LoadResult:
+    """
+    This class stores everything the viewer needs to show a file once it has been loaded.
+    """
+    path: str
+    ds: object
+    metadata: PatientInfo
+    number_of_frames: int
+    image: QImage | None = None
+    image_error: str | None = None  # why the image could not be shown, if it could not
+    frame: WindowedFrame | None = None  # first frame, kept for window/level changes
+
+@dataclass
+class RenderedFrame:
+    """
+    This class stores one rendered frame and, for grayscale data, the decoded pixels
+    so it can be windowed again without decoding.
+    """
+    image: QImage  # valid while frame (and its RenderTarget) is not rendered again
+    frame: WindowedFrame | None = None
+
+def load_dicom(
+        path, cache=None, progress=None, token=None, display_size=None, preview=None
+) -> LoadResult:
+    """
+    Reads, validates and decodes a DICOM file and renders its first frame.
+    Safe to run off the GUI thread.
+    :param path: path to the DICOM file
+    :param cache: optional DicomCache for datasets and pixel arrays
+    :param progress: optional callable given the name of each stage as it starts
+    :param token: optional CancellationToken checked before each stage
+    :param display_size: optional (width, height) the image is shown at, see decode_frame()
+    :param preview: optional callable given a QImage preview of the first frame before it is
+        decoded, only called for images that are large and uncompressed, see preview_frame(),
+        or compressed multi-frame images whose first frame is decoded, see decode_all_frames()
+    :raises ValueError: if the file can not be read or fails validate_dicom
+    :raises LoadCancelled: if the token is cancelled before the load is complete
+    :return: the LoadResult
+    """
+    _start_stage("Reading header", progress, token)
+    # Only the header is read here so rejected files never pay for the pixel data
+    ds = read_dicom_header(path, cache=cache)
+    if ds is None:
+        raise ValueError(f"Could not read DICOM file {path}")
+
+    _start_stage("Validating", progress, token)
+    #Adds the validation needed for AXIAL files and "StudyID+StudyDescription"
+    validate_dicom(ds)
+
+    _start_stage("Loading pixel data", progress, token)
+    # falls back to the header if the pixel data can not be re-read
+    ds = load_pixel_data(ds, cache=cache) or ds
+    result = LoadResult(
+        path=str(path),
+        ds=ds,
+        metadata=extract_patient_info(ds),
+        number_of_frames=int(ds.get("NumberOfFrames", 1) or 1),
+    )
+
+    # Check for pixel data, and render it if available
+    if "PixelData" not in ds:
+        result.image_error = "No Image Data Found"
+        return result
+
+    try:
+        if preview is not None:
+            _start_stage("Previewing", progress, token)
+            if (image := preview_frame(ds)) is not None:
+                preview(image)
+        decode_all_frames(ds, cache, progress, token, preview)
+        rendered = decode_frame(
+            ds, 0, cache=cache, progress=progress, token=token, display_size=display_size
+        )
+        result.image, result.frame = rendered.image, rendered.frame
+    except LoadCancelled:
+        raise
+    except Exception as e:
+        logger.error("Error displaying image: %s", e)
+        result.image_error = "Error Displaying Image"
+    return result
+
+def decode_all_frames(
+        ds, cache, progress=None, token=None, preview=None, max_workers=None
+) -> bool:
+    """
+    Decodes every frame of a compressed multi-frame dataset across a process pool into the
+    cache, so paging through its frames afterwards does not decode them one at a time.
+    Safe to run off the GUI thread.
+    :param ds: dataset with pixel data, read from a file
+    :param cache: DicomCache the frames are put in, under the keys MultiFrameVolume looks up
+    :param progress: optional callable given the number of frames decoded after each chunk
+    :param token: optional CancellationToken checked after each chunk
+    :param preview: optional callable given a QImage of the first frame once it is decoded
+    :param max_workers: number of worker processes, defaults to the CPU count
+    :raises LoadCancelled: if the token is cancelled before every frame is decoded
+    :return: False if the frames are left to be decoded when they are shown, because there is no
+        cache, the data is not compressed, there is one frame, or the frames do not fit the cache
+    """
+    number_of_frames = int(ds.get("NumberOfFrames", 1) or 1)
+    if cache is None or number_of_frames < 2 or not is_compressed(ds):
+        return False
+    filename = getattr(ds, "filename", None)
+    frame_shape, dtype = frame_layout(ds)
+    # frames decoded into a cache too small for them would evict each other before being shown
+    if (file_cache_key(filename) is None
+            or number_of_frames * int(np.prod(frame_shape)) * dtype.itemsize > cache.max_bytes):
+        return False
+
+    _start_stage(f"Decoding {number_of_frames} frames", progress, token)
+    # spawned workers, forking a process pool from a process running Qt threads is not safe
+    stream = stream_decoded_frames(
+        ds, max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")
+    )
+    # closing the stream on cancel stops the chunks that are still queued
+    with closing(stream):
+        for frames, decoded, total, positions in stream:
+            for position in positions:
+                # views of the one decoded array, together they count all of its bytes
+                cache.put(file_cache_key(filename, "frame", position), frames[position])
+            if preview is not None and 0 in positions:
+                preview(render_frame(ds, 0, cache=cache))
+            _start_stage(f"Decoded {decoded} of {total} frames", progress, token)
+    return True
+
+def index_directory(directory, metadata_index, progress=None, token=None) -> int:
+    """
+    Scans the headers of a folder into the metadata index, so its studies can be found with
+    MetadataIndexModel.find_studies(). Safe to run off the GUI thread.
+    :param directory: root of the folder tree
+    :param metadata_index: the MetadataIndexModel to fill in
+    :param progress: optional callable given the name of each stage as it starts
+    :param token: optional CancellationToken checked before the scan starts
+    :return: number of studies found under the folder
+    """
+    _start_stage("Indexing", progress, token)
+    # a thread pool, forking a process pool from a process running Qt threads is not safe
+    series_index = scan_directory(directory, use_processes=False, metadata_index=metadata_index)
+    return sum(len(studies) for studies in series_index.values())
+
+def preview_frame(ds, frame=0, max_size=PREVIEW_SIZE) -> QImage | None:
+    """
+    Renders every n-th row and column of a frame straight from the memory mapped file, so only
+    a fraction of the pixel data is read, e.g. over a network share.
+    :param ds: dataset with pixel data, e.g. from load_pixel_data()
+    :param frame: index of the frame
+    :param max_size: longest side of the preview
+    :return: the QImage, which owns its pixels, or None if the frame is compressed, colour,
+        or already small enough to be shown in full without a preview
+    """
+    if int(ds.get("SamplesPerPixel", 1)) != 1:
+        return None
+    if (mapped := get_pixel_memmap(ds)) is None:
+        return None
+    pixels = mapped[frame] if int(ds.get("NumberOfFrames", 1) or 1) > 1 else mapped
+    step = -(-max(pixels.shape) // max_size)  # ceiling division
+    if step < 2:
+        return None
+    pixels = pixels[::step, ::step]
+    rescale = rescale_from_dataset(ds)
+    window = window_from_dataset(ds) or auto_window(pixel_histogram(pixels), rescale)
+    invert = ds.get("PhotometricInterpretation", "") == "MONOCHROME1"
+    return numpy_to_qimage(apply_window(pixels, window, rescale, invert))
+
+def render_frame(ds, frame, cache=None, progress=None, token=None, window=None) -> QImage:
+    """
+    Decodes, windows and converts one frame of a loaded dataset to a QImage, see decode_frame().
+    Safe to run off the GUI thread.
+    :param ds: dataset with pixel data
+    :param frame: index of the frame
+    :param cache: optional DicomCache for the decoded frame
+    :param progress: optional callable given the name of each stage as it starts
+    :param token: optional CancellationToken checked before each stage
+    :param window: optional WindowLevel, defaults to the window stored in the dataset
+    :return: the QImage of the frame, which owns its pixels
+    """
+    return decode_frame(ds, frame, cache, progress, token, window).image.copy()
+
+def decode_frame(
+        ds, frame, cache=None, progress=None, token=None, window=None, target=None,
+        display_size=None
+) -> RenderedFrame:
+    """
+    Decodes, windows and converts one frame of a loaded dataset to a QImage.
+    Grayscale frames go through the window/level lookup table and are kept as a WindowedFrame,
+    anything else is normalized.
+    Safe to run off the GUI thread.
+    :param ds: dataset with pixel data
+    :param frame: index of the frame
+    :param cache: optional DicomCache for the decoded frame
+    :param progress: optional callable given the name of each stage as it starts
+    :param token: optional CancellationToken checked before each stage
+    :param window: optional WindowLevel, defaults to the window stored in the dataset
+    :param target: optional RenderTarget to render into, which must not be in use by another
+        thread. The image is only valid while the target is not rendered into again
+    :param display_size: optional (width, height) the image is shown at, grayscale frames are
+        rendered from the matching pyramid level rather than at full resolution
+    :raises ValueError: if the frame can not be decoded or converted
+    :raises LoadCancelled: if the token is cancelled before the frame is rendered
+    :return: the RenderedFrame
+    """
+    # the window is applied as part of decoding, it is a single gather from the decoded frame
+    _start_stage("Decoding", progress, token)
+    windowed = None
+    try:
+        if int(ds.get("SamplesPerPixel", 1)) == 1:
+            windowed = WindowedFrame.from_dataset(ds, cache=cache, frame=frame, target=target)
+            level = windowed.level_for_size(*display_size) if display_size else 0
+            pixels = windowed.render(window, level)
+        else:
+            pixels = get_normalized_pixel_array(ds, cache=cache, frame=frame)
+    except AttributeError as e:
+        raise ValueError("DICOM file is missing pixel data") from e
+
+    _start_stage("Rendering", progress, token)
+    if windowed is not None:
+        # already written into the target by the window lookup
+        return RenderedFrame(windowed.target.image(pixels.shape), windowed)
+    if qimage := numpy_to_qimage(pixels, target):
+        return RenderedFrame(qimage, windowed)
+    raise ValueError("Failed to convert image to QImage")
+
+class WorkerSignals(QObject):
+    """
+    Signals a Worker uses to hand results back to the GUI thread
+    """
+    progress = Signal(str)  # name of the stage that just started
+    finished = Signal(object)  # return value of the function
+    failed = Signal(str)  # error message
+    cancelled = Signal()  # the token was cancelled, nothing else is emitted
+    preview = Signal(object)  # QImage to show until the result is finished
+
+class Worker(QRunnable):
+    """
+    Runs a pipeline function on a QThreadPool. The function is given progress and token
+    keyword arguments and its return value is emitted through signals.finished,
+    any exception through signals.failed.
+    If the token is cancelled, whether before the worker starts or while it runs, only
+    signals.cancelled is emitted.
+    With preview=True the function is also given a preview keyword argument, which emits
+    signals.preview.
+    """
+    def __init__(self, function, *args, token=None, preview=False, **kwargs):
+        super().__init__()
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.token = token if token is not None else CancellationToken()
+        self.signals = WorkerSignals()
+        if preview:
+            self.kwargs["preview"] = self.signals.preview.emit
+
+    def run(self):
+        """Runs the function on the worker thread"""
+        try:
+            # a load superseded while it was still queued never starts
+            self.token.check()
+            result = self.function(
+                *self.args, progress=self.signals.progress.emit, token=self.token, **self.kwargs
+            )
+            # nor is a result delivered if it was superseded on the last stage
+            self.token.check()
+        except LoadCancelled:
+            logger.debug("Cancelled %s", getattr(self.function, "__name__", self.function))
+            self.signals.cancelled.emit()
+        except Exception as e:
+            logger.debug(traceback.format_exc())
+            self.signals.failed.emit(str(e))
+        else:
+            self.signals.finished.emit(result)
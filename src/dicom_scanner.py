@@ -0,0 +1,295 @@
+"""
+Walks a folder tree, reads the header of every file in parallel and builds a
+Patient -> Study -> Series -> Instance index of the DICOM files that were found.
+Instances inside a series are sorted by their position along the slice normal,
+falling back to InstanceNumber.
+
+When a MetadataIndexModel is given the parsed headers are cached on disk keyed by
+path, size and mtime, so reopening a folder only parses new or changed files.
+"""
+
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, fields
+from datetime import date
+
+from src.dicom_utils import extract_patient_info, share_fields, validate_dicom
+from src.read_dicom_file import read_dicom_header, tag_union
+
+logger = logging.getLogger(__name__)  # Start logger
+
+# Only these tags are parsed when scanning, everything else in the header is skipped
+SCAN_TAGS = tag_union(
+    [
+        "SOPClassUID",
+        "SOPInstanceUID",
+        "PatientID",
+        "StudyInstanceUID",
+        "SeriesInstanceUID",
+        "InstanceNumber",
+        "ImagePositionPatient",
+        "ImageOrientationPatient",
+        "PixelSpacing",
+        "SliceThickness",
+        "Rows",
+        "Columns",
+        "StudyID",
+        "StudyDescription",
+    ],
+    extract_patient_info,
+    validate_dicom,
+)
+
+# fields that repeat across the instances of a series, study or patient, kept as one shared
+# copy each (see dicom_utils.share_value) so a large index does not hold them per instance
+SHARED_FIELDS = [
+    "patient_id",
+    "study_instance_uid",
+    "series_instance_uid",
+    "image_orientation",
+    "pixel_spacing",
+    "given_name",
+    "family_name",
+    "sex",
+    "birth_date",
+    "modality",
+    "study_id",
+    "study_description",
+    "invalid_reason",
+]
+
+@dataclass(slots=True)
+class InstanceRecord:
+    """
+    This class stores the header fields of one DICOM file needed to place it in the index.
+    Records are slotted and their repeated fields shared, an index of a large archive holds
+    hundreds of thousands of them.
+    """
+    path: str
+    patient_id: str
+    study_instance_uid: str
+    series_instance_uid: str
+    sop_instance_uid: str
+    instance_number: int | None = None
+    image_position: tuple[float, ...] | None = None
+    image_orientation: tuple[float, ...] | None = None
+    pixel_spacing: tuple[float, ...] | None = None
+    slice_thickness: float | None = None
+    rows: int | None = None
+    columns: int | None = None
+    # PatientInfo fields from extract_patient_info
+    given_name: str = "Unknown"
+    family_name: str = "Unknown"
+    sex: str = "Unknown"
+    birth_date: date | None = None
+    modality: str = "Unknown"
+    # validate_dicom outcome, invalid_reason is the ValueError message
+    study_id: str | None = None
+    study_description: str | None = None
+    is_valid: bool = False
+    invalid_reason: str | None = None
+    # file stat the record was parsed from
+    file_size: int = 0
+    mtime_ns: int = 0
+
+    def __post_init__(self):
+        share_fields(self, SHARED_FIELDS)
+
+    def __reduce__(self):
+        # rebuilt through __init__ when unpickled from a scan worker, so the fields are
+        # shared in this process too
+        return self.__class__, tuple(getattr(self, field.name) for field in fields(self))
+
+# patient_id -> study_instance_uid -> series_instance_uid -> sorted instances
+SeriesIndex = dict[str, dict[str, dict[str, list[InstanceRecord]]]]
+
+def iter_dicom_paths(directory):
+    """
+    Walks the folder tree and yields the path of every file in it. DICOM files often
+    have no extension so nothing is filtered here, non-DICOM files are rejected when read.
+    :param directory: root of the folder tree
+    :return: generator of file paths
+    """
+    for root, _, files in os.walk(directory):
+        for name in files:
+            yield os.path.join(root, name)
+
+def read_instance_record(file_path):
+    """
+    Reads the header of a single file and converts it to an InstanceRecord.
+    :param file_path: path to the file
+    :return: the InstanceRecord, or None if the file is not a readable DICOM file
+    """
+    ds = read_dicom_header(file_path, specific_tags=SCAN_TAGS)
+    if ds is None:
+        return None
+
+    try:
+        is_valid = validate_dicom(ds)
+        invalid_reason = None
+    except ValueError as e:
+        is_valid = False
+        invalid_reason = str(e)
+
+    patient_info = extract_patient_info(ds)
+    study_id = ds.get("StudyID", None)
+    study_description = ds.get("StudyDescription", None)
+    thickness = _to_floats([ds.get("SliceThickness", None)])
+
+    return InstanceRecord(
+        path=str(file_path),
+        patient_id=str(ds.get("PatientID", "Unknown")),
+        study_instance_uid=str(ds.get("StudyInstanceUID", "Unknown")),
+        series_instance_uid=str(ds.get("SeriesInstanceUID", "Unknown")),
+        sop_instance_uid=str(ds.get("SOPInstanceUID", "Unknown")),
+        instance_number=_to_int(ds.get("InstanceNumber", None)),
+        image_position=_to_floats(ds.get("ImagePositionPatient", None)),
+        image_orientation=_to_floats(ds.get("ImageOrientationPatient", None)),
+        pixel_spacing=_to_floats(ds.get("PixelSpacing", None)),
+        slice_thickness=thickness[0] if thickness else None,
+        rows=_to_int(ds.get("Rows", None)),
+        columns=_to_int(ds.get("Columns", None)),
+        given_name=str(patient_info.given_name),
+        family_name=str(patient_info.family_name),
+        sex=patient_info.sex,
+        birth_date=patient_info.birth_date,
+        modality=patient_info.modality,
+        study_id=str(study_id) if study_id is not None else None,
+        study_description=str(study_description) if study_description is not None else None,
+        is_valid=is_valid,
+        invalid_reason=invalid_reason,
+    )
+
+def scan_directory(
+        directory,
+        max_workers=None,
+        use_processes=True,
+        metadata_index=None
+) -> SeriesIndex:
+    """
+    Reads the header of every file under directory across a worker pool and
+    builds the series index.
+    :param directory: root of the folder tree
+    :param max_workers: number of workers, defaults to the executor's default
+    :param use_processes: use a process pool (default) instead of a thread pool
+    :param metadata_index: optional MetadataIndexModel, files whose path, size and
+        mtime match the index are not parsed again
+    :return: the SeriesIndex of all DICOM files found
+    """
+    directory = os.path.abspath(directory)
+    file_stats = {}
+    for path in iter_dicom_paths(directory):
+        try:
+            stat = os.stat(path)
+        except OSError as e:
+            logger.warning("Could not stat %s: %s", path, str(e))
+            continue
+        file_stats[path] = (stat.st_size, stat.st_mtime_ns)
+
+    cached = metadata_index.get_records(directory) if metadata_index is not None else {}
+    records = []
+    to_parse = []
+    for path, (size, mtime_ns) in file_stats.items():
+        entry = cached.get(path)
+        if entry is not None and entry[0] == size and entry[1] == mtime_ns:
+            if entry[2] is not None:
+                records.append(entry[2])
+        else:
+            to_parse.append(path)
+    logger.info(
+        "Scanning %d files in %s, %d from the index",
+        len(file_stats), directory, len(file_stats) - len(to_parse)
+    )
+
+    parsed = _read_instance_records(to_parse, max_workers, use_processes)
+    for path, record in zip(to_parse, parsed):
+        if record is not None:
+            record.file_size, record.mtime_ns = file_stats[path]
+            records.append(record)
+
+    if metadata_index is not None:
+        metadata_index.update_records(
+            [(path, *file_stats[path], record) for path, record in zip(to_parse, parsed)]
+        )
+        metadata_index.delete_missing(directory, file_stats.keys())
+
+    return build_series_index(records)
+
+def _read_instance_records(paths, max_workers, use_processes):
+    """Runs read_instance_record over paths in a worker pool, keeping the order of paths"""
+    if not paths:
+        return []
+    if use_processes:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(read_instance_record, paths, chunksize=64))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(read_instance_record, paths))
+
+def build_series_index(records) -> SeriesIndex:
+    """
+    Groups InstanceRecords into Patient -> Study -> Series and sorts each series.
+    :param records: iterable of InstanceRecord
+    :return: the SeriesIndex
+    """
+    index: SeriesIndex = {}
+    for record in records:
+        studies = index.setdefault(record.patient_id, {})
+        series = studies.setdefault(record.study_instance_uid, {})
+        series.setdefault(record.series_instance_uid, []).append(record)
+
+    for studies in index.values():
+        for series in studies.values():
+            for instances in series.values():
+                instances.sort(key=_instance_sort_key)
+    return index
+
+def _instance_sort_key(record):
+    """
+    Sort key for instances in a series. Instances with a position are sorted by
+    their distance along the slice normal and come before any without one.
+    """
+    instance_number = record.instance_number if record.instance_number is not None else 0
+    distance = slice_position(record)
+    if distance is None:
+        return (1, 0.0, instance_number, record.path)
+    return (0, distance, instance_number, record.path)
+
+def slice_position(record) -> float | None:
+    """
+    Position of an instance along its slice normal, used to sort slices and measure the
+    spacing between them.
+    :param record: InstanceRecord
+    :return: distance in mm, or None if the record has no ImagePositionPatient
+    """
+    if record.image_position is None:
+        return None
+
+    position = record.image_position
+    orientation = record.image_orientation
+    if orientation is not None and len(orientation) == 6:
+        # slice normal is the cross product of the row and column direction cosines
+        row, col = orientation[:3], orientation[3:]
+        normal = (
+            row[1] * col[2] - row[2] * col[1],
+            row[2] * col[0] - row[0] * col[2],
+            row[0] * col[1] - row[1] * col[0],
+        )
+        return sum(p * n for p, n in zip(position, normal))
+    return position[2] if len(position) > 2 else 0.0
+
+def _to_int(value):
+    """Converts a DICOM IS value to an int, None if missing or invalid"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def _to_floats(value):
+    """Converts a multi-valued DICOM DS value to a tuple of floats, None if missing or invalid"""
+    if value is None:
+        return None
+    try:
+        return tuple(float(v) for v in value)
+    except (TypeError, ValueError):
+        return None
@@ -3,20 +3,26 @@ This file is intended to be the utility file that converts the Images to be disp
 and extract the patients data into the GUI
 """
 
-import numpy as np
+import pandas as pd
 import pydicom
+import sys
 import uuid
 from datetime import datetime
 from pydicom.multival import MultiValue
-from PySide6.QtGui import QImage
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
+from src.read_dicom_file import requires_tags
+from src.render_target import RenderTarget
 
-def numpy_to_qimage(array):
+def numpy_to_qimage(array, target=None):
     """
     This function converts a NumPy array representing a grayscale image to a QImage,
     suitable for display in Qt-based GUIs.
     It normalizes the array to 0-255, then creates a QImage with the grayscale format.
-    :param array: 2D NumPy array
+    uint8 arrays, e.g. from window_level.apply_window, are already display values and are used as is.
+    :param array: 2D NumPy array, normalized to [0, 1] or uint8
+    :param target: optional RenderTarget, the frame is written into its reusable buffer and its
+        QImage is returned, which is only valid until the next render into the target.
+        Without one the QImage owns a copy of the pixels.
     :return: QImage object in grayscale format using the normalized array data and dimensions.
     """
     if array is None:
@@ -25,23 +31,55 @@ def numpy_to_qimage(array):
     if array.ndim != 2:
         raise ValueError("Array must be 2D")
 
-    norm_array = (255 * array).clip(0, 255).astype(np.uint8)
-    height, width = norm_array.shape
-    bytes_per_line = width * norm_array.itemsize
+    if target is None:
+        # a one off target, the copy means the QImage does not depend on its buffer
+        return RenderTarget(max_sizes=1).render(array).copy()
+    return target.render(array)
 
-    return QImage(
-        norm_array.data,
-        width,
-        height,
-        bytes_per_line,
-        QImage.Format_Grayscale8,
-    )
+# one copy of each repeated non-string value (dates, orientation tuples) shared by all records,
+# emptied when it reaches MAX_SHARED_VALUES so values of records that are gone do not pile up
+MAX_SHARED_VALUES = 1 << 16
+_SHARED_VALUES = {}
+
+def share_value(value):
+    """
+    Returns a single shared copy of a value that repeats across many records, so an index of
+    a large archive holds each modality, UID or birth date once rather than once per instance.
+    Strings are interned, other hashable values are kept in a module level table of at most
+    MAX_SHARED_VALUES values, anything else (and None) is returned as is. Once the table is
+    full it is emptied, records keep the copies they have and new records share new copies.
+    :param value: field value
+    :return: the shared copy, equal to value
+    """
+    if type(value) is str:  # pylint: disable=unidiomatic-typecheck
+        return sys.intern(value)
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    try:
+        shared = _SHARED_VALUES.get(value)
+    except TypeError:  # unhashable
+        return value
+    if shared is None:
+        if len(_SHARED_VALUES) >= MAX_SHARED_VALUES:
+            _SHARED_VALUES.clear()
+        shared = _SHARED_VALUES[value] = value
+    return shared
 
-@dataclass
+def share_fields(record, names):
+    """
+    Replaces fields of a record with their shared copies, see share_value().
+    :param record: dataclass instance
+    :param names: names of the fields that repeat across records
+    """
+    for name in names:
+        object.__setattr__(record, name, share_value(getattr(record, name)))
+
+@dataclass(slots=True)
 class PatientInfo:
     """
     This class stores patient information extracted from a DICOM file.
     It includes the patient's name, ID, sex, birthdate, and modality.
+    Every field repeats across the instances of a patient, so they are all shared.
     """
     given_name: str
     family_name: str
@@ -50,6 +88,10 @@ class PatientInfo:
     birth_date: datetime.date
     modality: str
 
+    def __post_init__(self):
+        share_fields(self, [field.name for field in fields(self)])
+
+@requires_tags("PatientName", "PatientID", "PatientSex", "PatientBirthDate", "Modality")
 def extract_patient_info(ds) -> PatientInfo:
     """
         Extracts patient information from a DICOM dataset and returns a PatientInfo
@@ -97,6 +139,77 @@ def extract_patient_info(ds) -> PatientInfo:
         modality=str(ds.get("Modality", "Unknown"))
     )
 
+# columns of extract_patient_table, the PatientInfo fields plus whether the name was a UUID
+PATIENT_TABLE_COLUMNS = [
+    "given_name",
+    "family_name",
+    "patient_id",
+    "sex",
+    "birth_date",
+    "modality",
+    "anonymized",
+]
+
+# what uuid.UUID accepts: optional "urn:"/"uuid:" prefixes and braces, 32 hex digits and hyphens
+_UUID_PATTERN = r"(?:urn:)?(?:uuid:)?\{?(?:-*[0-9a-fA-F]){32}-*\}?"
+
+# PersonName: the alphabetic group before any "=", split into family^given^...
+_NAME_PATTERN = r"^(?P<family_name>[^=^]*)(?:\^(?P<given_name>[^=^]*))?"
+
+def extract_patient_table(datasets) -> pd.DataFrame:
+    """
+    Batch version of extract_patient_info for cohort work. The header values are gathered
+    in one pass and everything else (UUID detection, name splitting, date parsing) is done
+    on whole columns, rather than building one PatientInfo per dataset.
+
+    :param datasets: iterable of DICOM datasets (e.g. from read_dicom_header) or header dicts
+        keyed by keyword, a PatientName given as text is split as DICOM "family^given"
+    :return: DataFrame with one row per dataset and the PATIENT_TABLE_COLUMNS, birth_date
+        is datetime64 with NaT where it is missing or invalid
+    """
+    keywords = ["PatientName", "PatientID", "PatientSex", "PatientBirthDate", "Modality"]
+    raw = pd.DataFrame(
+        [[ds.get(keyword, None) for keyword in keywords] for ds in datasets],
+        columns=keywords,
+        dtype=object,
+    )
+    names = raw["PatientName"].map(_name_text, na_action="ignore")
+    missing_name = names.isna()
+    anonymized = names.str.fullmatch(_UUID_PATTERN, na=False).astype(bool)
+    components = names.str.extract(_NAME_PATTERN)
+
+    table = pd.DataFrame({
+        "given_name": components["given_name"].fillna("").mask(missing_name, "Unknown"),
+        "family_name": components["family_name"].fillna("").mask(missing_name, "Unknown"),
+        "patient_id": _text_column(raw["PatientID"]),
+        "sex": _text_column(raw["PatientSex"]),
+        "birth_date": pd.to_datetime(
+            raw["PatientBirthDate"], format="%Y%m%d", errors="coerce"
+        ),
+        "modality": _text_column(raw["Modality"]),
+        "anonymized": anonymized,
+    })
+    for column in ["given_name", "family_name", "patient_id", "sex"]:
+        table[column] = table[column].mask(anonymized, "Anonymous")
+    return table
+
+def _name_text(patient_name):
+    """
+    PatientName as DICOM PN text, "family^given", so names can be split as a column.
+    PersonName and str are used as is, other objects with name attributes are joined.
+    """
+    if isinstance(patient_name, str):
+        return patient_name
+    if isinstance(patient_name, pydicom.valuerep.PersonName):
+        return str(patient_name)
+    family = getattr(patient_name, "family_name", "Unknown")
+    given = getattr(patient_name, "given_name", "Unknown")
+    return f"{family}^{given}"
+
+def _text_column(values):
+    """A header column as strings, 'Unknown' where the element is missing"""
+    return values.map(str, na_action="ignore").fillna("Unknown")
+
 def _is_uuid(patient_name):
     """
         Checks if a given string is a valid UUID.
@@ -112,6 +225,7 @@ def _is_uuid(patient_name):
     except (ValueError, AttributeError, TypeError):
         return False
 
+@requires_tags("StudyID", "StudyDescription", "ImageType", "Modality")
 def validate_dicom(ds):
     """
    Checks if the DICOM dataset contains required fields and handles specific image types.
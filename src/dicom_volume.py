@@ -0,0 +1,246 @@
+"""
+Volume abstraction over multi-frame DICOM objects (NM, US, enhanced CT/MR) and series assembled
+from single-frame files. Frames are only decoded when they are asked for, so viewing frame 200 of
+a 1,000-frame file decodes one frame rather than all of them.
+"""
+
+import logging
+from abc import ABC, abstractmethod
+
+import numpy as np
+from pydicom.dataset import Dataset
+from pydicom.encaps import encapsulate, generate_pixel_data_frame
+from pydicom.pixel_data_handlers.util import pixel_dtype
+
+from src.dicom_cache import file_cache_key
+from src.pixel_memmap import get_pixel_memmap, read_dicom_file_mapped
+
+logger = logging.getLogger(__name__)  # Start logger
+
+# Elements a pixel data handler needs to decode a single frame
+IMAGE_PIXEL_KEYWORDS = [
+    "SamplesPerPixel",
+    "PhotometricInterpretation",
+    "PlanarConfiguration",
+    "Rows",
+    "Columns",
+    "BitsAllocated",
+    "BitsStored",
+    "HighBit",
+    "PixelRepresentation",
+]
+
+
+class DicomVolume(ABC):
+    """
+    Abstract class for a stack of 2D frames that are decoded on demand
+    """
+    @abstractmethod
+    def __len__(self) -> int:
+        """ Number of frames in the volume """
+
+    @abstractmethod
+    def get_frame(self, index: int) -> np.ndarray:
+        """
+        Decodes a single frame
+        :param index: frame index, 0 based
+        :return: the stored pixel values of the frame (not normalized)
+        """
+
+    @property
+    @abstractmethod
+    def frame_shape(self) -> tuple[int, ...]:
+        """ Shape of a single frame, (rows, columns[, samples]) """
+
+    @abstractmethod
+    def frame_source(self, index: int) -> tuple[str | None, int]:
+        """
+        Where a frame is stored, used to cache things computed from it
+        :param index: frame index, 0 based
+        :return: (file path, index of the frame in that file)
+        """
+
+    @property
+    def shape(self) -> tuple[int, ...]:
+        """ Shape of the whole volume, (frames, rows, columns[, samples]) """
+        return (len(self), *self.frame_shape)
+
+    def _check_index(self, index: int) -> int:
+        """ Checks a frame index is in range, negative indexes count from the end """
+        if not -len(self) <= index < len(self):
+            raise IndexError(f"Frame {index} out of range for {len(self)} frames")
+        return index % len(self)
+
+
+class MultiFrameVolume(DicomVolume):
+    """
+    Frames of a single (possibly multi-frame) DICOM dataset. Uncompressed little endian data
+    is memory mapped so a frame is just a view, encapsulated data is split into frames and
+    only the requested frame is decoded.
+    """
+    def __init__(self, ds, cache=None):
+        """
+        :param ds: dataset with pixel data, ideally from read_dicom_file_mapped()
+        :param cache: optional DicomCache for decoded frames
+        """
+        if "PixelData" not in ds:
+            raise AttributeError("Dataset has no pixel data")
+        self.ds = ds
+        self.cache = cache
+        self.number_of_frames = int(ds.get("NumberOfFrames", 1) or 1)
+        samples = int(ds.get("SamplesPerPixel", 1))
+        self._frame_shape = (int(ds.Rows), int(ds.Columns), *((samples,) if samples > 1 else ()))
+        self._mapped = get_pixel_memmap(ds)
+        self._encapsulated_frames = None  # split lazily on first compressed frame
+
+    def __len__(self) -> int:
+        return self.number_of_frames
+
+    @property
+    def frame_shape(self) -> tuple[int, ...]:
+        return self._frame_shape
+
+    def frame_source(self, index: int) -> tuple[str | None, int]:
+        return getattr(self.ds, "filename", None), self._check_index(index)
+
+    def get_frame(self, index: int) -> np.ndarray:
+        index = self._check_index(index)
+        if self._mapped is not None:
+            return self._mapped[index] if self.number_of_frames > 1 else self._mapped
+
+        key = file_cache_key(getattr(self.ds, "filename", None), "frame", index)
+        if self.cache is not None and (cached := self.cache.get(key)) is not None:
+            return cached
+
+        file_meta = getattr(self.ds, "file_meta", None)
+        transfer_syntax = file_meta.get("TransferSyntaxUID", None) if file_meta else None
+        if transfer_syntax is not None and transfer_syntax.is_compressed:
+            frame = self._decode_encapsulated_frame(index)
+        elif (frame := self._read_uncompressed_frame(index)) is None:
+            return self._pixel_array_frame(index)
+
+        if self.cache is not None:
+            self.cache.put(key, frame)
+        return frame
+
+    def _read_uncompressed_frame(self, index: int) -> np.ndarray | None:
+        """
+        Copies one frame of uncompressed pixel data that can not be mapped (big endian, or
+        already in memory) out of its byte range of PixelData, the other frames are not read.
+        :return: the frame in native byte order, None if its bytes are not a plain array
+        """
+        ds = self.ds
+        # 1 bit data is packed and YBR_FULL_422 is resampled by pydicom, see get_pixel_memmap
+        if ds.get("BitsAllocated", 0) not in (8, 16, 32, 64):
+            return None
+        if ds.get("PhotometricInterpretation", "") == "YBR_FULL_422":
+            return None
+        dtype = pixel_dtype(ds)
+        frame_pixels = int(np.prod(self._frame_shape))
+        offset = index * frame_pixels * dtype.itemsize
+        if len(ds.PixelData) < offset + frame_pixels * dtype.itemsize:
+            return None
+        pixels = np.frombuffer(ds.PixelData, dtype=dtype, count=frame_pixels, offset=offset)
+        # a copy that owns its memory, byte swapped if the data is big endian
+        pixels = pixels.astype(dtype.newbyteorder("="))
+        if len(self._frame_shape) == 3 and ds.get("PlanarConfiguration", 0) == 1:
+            rows, columns, samples = self._frame_shape
+            return np.ascontiguousarray(pixels.reshape(samples, rows, columns).transpose(1, 2, 0))
+        return pixels.reshape(self._frame_shape)
+
+    def _pixel_array_frame(self, index: int) -> np.ndarray:
+        """
+        One frame of ds.pixel_array, which converts every frame. The whole array is cached
+        once, so the cache counts all of its bytes rather than one frame's.
+        """
+        key = file_cache_key(getattr(self.ds, "filename", None), "pixel_array")
+        pixels = self.cache.get(key) if self.cache is not None else None
+        if pixels is None:
+            pixels = self.ds.pixel_array
+            if self.cache is not None:
+                self.cache.put(key, pixels)
+        return pixels[index] if self.number_of_frames > 1 else pixels
+
+    def _decode_encapsulated_frame(self, index: int) -> np.ndarray:
+        """ Decodes one frame of encapsulated pixel data through a single frame dataset """
+        if self._encapsulated_frames is None:
+            self._encapsulated_frames = list(
+                generate_pixel_data_frame(self.ds.PixelData, self.number_of_frames)
+            )
+        frame_ds = single_frame_dataset(self.ds, self._encapsulated_frames[index])
+        return frame_ds.pixel_array
+
+
+class SeriesVolume(DicomVolume):
+    """
+    Frames of a series of single-frame files, one file per frame in the order given.
+    Each file is only read when its frame is requested.
+    """
+    def __init__(self, paths, cache=None):
+        """
+        :param paths: file paths in slice order, e.g. from a dicom_scanner SeriesIndex
+        :param cache: optional DicomCache for datasets and decoded frames
+        """
+        if not paths:
+            raise ValueError("A series volume needs at least one file")
+        self.paths = [str(path) for path in paths]
+        self.cache = cache
+        self._frame_shape = None
+
+    @classmethod
+    def from_records(cls, records, cache=None):
+        """
+        Creates the volume from the sorted InstanceRecords of one series
+        :param records: InstanceRecords from a dicom_scanner SeriesIndex
+        :param cache: optional DicomCache for datasets and decoded frames
+        """
+        return cls([record.path for record in records], cache=cache)
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    @property
+    def frame_shape(self) -> tuple[int, ...]:
+        if self._frame_shape is None:
+            self._frame_shape = self.get_frame(0).shape
+        return self._frame_shape
+
+    def frame_source(self, index: int) -> tuple[str | None, int]:
+        return self.paths[self._check_index(index)], 0
+
+    def get_frame(self, index: int) -> np.ndarray:
+        index = self._check_index(index)
+        path = self.paths[index]
+        key = file_cache_key(path, "frame", 0)
+        if self.cache is not None and (cached := self.cache.get(key)) is not None:
+            return cached
+
+        ds = read_dicom_file_mapped(path)
+        if ds is None:
+            raise ValueError(f"Could not read frame {index} from {path}")
+        frame = MultiFrameVolume(ds).get_frame(0)
+
+        if self.cache is not None:
+            self.cache.put(key, frame)
+        return frame
+
+
+def single_frame_dataset(ds, frame: bytes) -> Dataset:
+    """
+    Builds a dataset holding just one encapsulated frame of ds, so a pixel data
+    handler can decode it without touching the other frames
+    :param ds: the multi-frame dataset
+    :param frame: the encoded bytes of one frame
+    :return: a single frame Dataset with the same transfer syntax and image pixel module
+    """
+    frame_ds = Dataset()
+    frame_ds.file_meta = ds.file_meta
+    frame_ds.is_little_endian = ds.is_little_endian
+    frame_ds.is_implicit_VR = ds.is_implicit_VR
+    for keyword in IMAGE_PIXEL_KEYWORDS:
+        if keyword in ds:
+            setattr(frame_ds, keyword, ds[keyword].value)
+    frame_ds.NumberOfFrames = 1
+    frame_ds.PixelData = encapsulate([frame])
+    frame_ds["PixelData"].VR = "OB"
+    return frame_ds
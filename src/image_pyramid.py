@@ -0,0 +1,102 @@
+"""
+Multi-resolution pyramid of a frame. Each level halves the previous one with a vectorized 2x2
+block mean, so a 4k x 5k mammogram shown in an 800 pixel window is windowed and converted at
+about display size instead of full resolution. Levels are built on first use and can be kept in
+a DicomCache so returning to a frame does not rebuild them.
+"""
+
+import logging
+
+import numpy as np
+
+from src.dicom_cache import file_cache_key
+
+logger = logging.getLogger(__name__)  # Start logger
+
+# reduction of each level, level 0 is the full resolution frame
+PYRAMID_FACTORS = (1, 2, 4, 8)
+
+def block_mean(pixels, factor):
+    """
+    Downsamples a frame by averaging factor x factor blocks, rows and columns that do not fill
+    a whole block are dropped.
+    :param pixels: 2D array
+    :param factor: size of the blocks
+    :return: array of the same dtype, (rows // factor, columns // factor)
+    """
+    rows, columns = pixels.shape[0] // factor, pixels.shape[1] // factor
+    blocks = pixels[:rows * factor, :columns * factor].reshape(rows, factor, columns, factor)
+    means = blocks.mean(axis=(1, 3), dtype=np.float32)
+    if pixels.dtype.kind in "ui":
+        # rounded back to the stored dtype so integer levels still go through the window LUT
+        np.rint(means, out=means)
+    return means.astype(pixels.dtype, copy=False)
+
+class ImagePyramid:
+    """
+    Levels of a frame at 1x, 2x, 4x and 8x reduction, built lazily from the next finer level.
+    """
+    def __init__(self, pixels, factors=PYRAMID_FACTORS, cache=None, file_path=None, frame=0):
+        """
+        :param pixels: 2D full resolution frame, level 0
+        :param factors: increasing powers of two starting at 1, levels smaller than a pixel are dropped
+        :param cache: optional DicomCache for the reduced levels
+        :param file_path: file of the frame, needed to cache the levels
+        :param frame: index of the frame in the file
+        """
+        self.factors = [
+            factor for factor in factors
+            if pixels.shape[0] // factor > 0 and pixels.shape[1] // factor > 0
+        ]
+        self.cache = cache
+        self.file_path = file_path
+        self.frame = frame
+        self._levels = {0: pixels}
+
+    def __len__(self) -> int:
+        return len(self.factors)
+
+    def factor(self, level) -> int:
+        """:return: the reduction of a level"""
+        return self.factors[level]
+
+    def shape(self, level) -> tuple[int, int]:
+        """:return: (rows, columns) of a level, without building it"""
+        rows, columns = self._levels[0].shape[:2]
+        factor = self.factors[level]
+        return rows // factor, columns // factor
+
+    def level(self, level) -> np.ndarray:
+        """
+        :param level: index into the factors, 0 is full resolution
+        :return: the frame at that level, built (and cached) on first use
+        """
+        if (pixels := self._levels.get(level)) is not None:
+            return pixels
+
+        key = None
+        if self.cache is not None:
+            key = file_cache_key(self.file_path, "pyramid", self.frame, self.factors[level])
+            pixels = self.cache.get(key)
+        if pixels is None:
+            finer = self.level(level - 1)
+            pixels = block_mean(finer, self.factors[level] // self.factors[level - 1])
+            if self.cache is not None:
+                self.cache.put(key, pixels)
+        self._levels[level] = pixels
+        return pixels
+
+    def level_for_size(self, width, height) -> int:
+        """
+        Picks the coarsest level that still has at least one pixel per screen pixel.
+        :param width: width the frame is shown at, in screen pixels
+        :param height: height the frame is shown at, in screen pixels
+        :return: index of the level
+        """
+        best = 0
+        for level in range(1, len(self)):
+            rows, columns = self.shape(level)
+            if rows < height or columns < width:
+                break
+            best = level
+        return best
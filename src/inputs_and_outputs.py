@@ -3,20 +3,24 @@ This file is used to open the dicom image, if it cant be opened it will throw er
 """
 
 import numpy as np
+from src.dicom_cache import file_cache_key
 from src.dicom_utils import numpy_to_qimage
+from src.dicom_volume import MultiFrameVolume
+from src.pixel_memmap import get_pixel_memmap
 
-#Todo Image is not loading if the image is anything other than 2D
-def get_qimage_from_dicom_file(ds):
+def get_qimage_from_dicom_file(ds, cache=None, frame=0):
     """
     this method attempts to open a dicom image and convert it to a QImage.
     It uses the get_normalized_pixel_array function to extract and normalize the pixel data,
     and then numpy_to_qimage to convert it to a QImage
     if it doesn't work it throws errors
     :param ds: dicom set
+    :param cache: optional DicomCache for the normalized pixel array
+    :param frame: index of the frame to show for multi-frame data, only that frame is decoded
     :return: either the image or nothing
     """
     try:
-        pixels = get_normalized_pixel_array(ds)
+        pixels = get_normalized_pixel_array(ds, cache=cache, frame=frame)
 
         if pixels is None:
             raise ValueError("Failed to normalize pixel array")
@@ -32,22 +36,57 @@ def get_qimage_from_dicom_file(ds):
     except Exception as e:
         raise RuntimeError("Error loading DICOM image") from e
 
-def get_normalized_pixel_array(ds):
+def get_normalized_pixel_array(ds, cache=None, frame=None):
     """
     This function takes a DICOM dataset (ds) and extracts its pixel array.
     It then normalizes the pixel data to the range [0, 1] by dividing by the maximum pixel value,
     if that maximum value is not zero.
+    Uncompressed pixel data is read through a memory mapped view of the file rather
+    than ds.pixel_array, so PixelData is never copied into Python bytes.
     The function returns the normalized pixel array as a NumPy array of float32.
     :param ds: Dicom dataset
+    :param cache: optional DicomCache, the normalized array is cached against the dataset's file,
+        cached arrays are read-only
+    :param frame: if given, only this frame is decoded and normalized (see MultiFrameVolume),
+        otherwise all frames are
     :return: the normalised pixel array
     """
-    pixels = ds.pixel_array
+    key = None
+    if cache is not None:
+        key = file_cache_key(getattr(ds, "filename", None), "normalized", frame)
+        if (cached := cache.get(key)) is not None:
+            return cached
+
+    if frame is not None:
+        pixels = MultiFrameVolume(ds, cache=cache).get_frame(frame)
+    else:
+        pixels = get_pixel_memmap(ds)
+        if pixels is None:
+            pixels = ds.pixel_array
     if not isinstance(pixels, np.ndarray):
         raise TypeError("Pixel array is not a numpy array")
 
-    pixels = pixels.astype(np.float32)
-    max_val = pixels.max()
-    if max_val >= 1e-6:
-        pixels /= max_val
+    pixels = normalize_pixel_array(pixels)
 
+    if cache is not None:
+        cache.put(key, pixels)
     return pixels
+
+def normalize_pixel_array(pixels, out=None):
+    """
+    Normalizes stored pixel values to the range [0, 1] by dividing by the maximum value,
+    if that maximum value is not zero.
+    :param pixels: NumPy array of stored pixel values
+    :param out: optional float32 array of the same shape to write into, e.g. one slice of a
+        preallocated volume, so no temporary array is made
+    :return: the normalised pixel array (out if it was given)
+    """
+    if out is None:
+        # np.array rather than astype so a memmap comes back as a plain in-memory array
+        out = np.array(pixels, dtype=np.float32)
+    else:
+        np.copyto(out, pixels, casting="unsafe")
+    max_val = out.max()
+    if max_val >= 1e-6:
+        out /= max_val
+    return out
@@ -0,0 +1,125 @@
+"""
+Measures the memory an in-memory index of a large archive takes per instance, comparing the
+slotted InstanceRecord with shared field values against a plain dataclass with a __dict__ and
+a separate copy of every string (what parsing each file on its own gives).
+
+Header values are made up for a synthetic archive of CT series, every string is built fresh for
+each instance as it would be when read from its own file.
+
+Usage: python -m src.memory_benchmark [--instances 100000] [--series-size 200]
+"""
+
+import argparse
+import gc
+import logging
+import sys
+import tracemalloc
+from dataclasses import dataclass, fields, make_dataclass
+from datetime import date
+
+from src.dicom_scanner import InstanceRecord
+
+logger = logging.getLogger(__name__)  # Start logger
+
+# the record type before the change, same fields with a per instance __dict__
+DictInstanceRecord = make_dataclass(
+    "DictInstanceRecord",
+    [(field.name, field.type, field) for field in fields(InstanceRecord)],
+)
+
+@dataclass
+class MemoryResult:
+    """
+    This class stores the traced memory of one record type.
+    """
+    name: str
+    instances: int
+    total_bytes: int
+
+    @property
+    def bytes_per_instance(self) -> float:
+        """:return: average size of a record including the values only it holds"""
+        return self.total_bytes / self.instances if self.instances else 0.0
+
+def _fresh(text) -> str:
+    """A new string object equal to text, as a separate dcmread of each file would give"""
+    return "".join(list(text))
+
+def synthetic_headers(instances, series_size=200):
+    """
+    Generator of InstanceRecord keyword arguments for a made-up archive.
+    :param instances: number of instances
+    :param series_size: instances per series, 5 series per study and 2 studies per patient
+    :return: generator of dicts
+    """
+    for index in range(instances):
+        series = index // series_size
+        study = series // 5
+        patient = study // 2
+        yield {
+            "path": _fresh(f"/archive/{patient}/{study}/{series}/{index}.dcm"),
+            "patient_id": _fresh(f"PAT{patient:06d}"),
+            "study_instance_uid": _fresh(f"1.2.826.0.1.3680043.8.498.{study}"),
+            "series_instance_uid": _fresh(f"1.2.826.0.1.3680043.8.498.{study}.{series}"),
+            "sop_instance_uid": _fresh(f"1.2.826.0.1.3680043.8.498.{study}.{series}.{index}"),
+            "instance_number": index % series_size + 1,
+            "image_position": (-250.0, -250.0, float(index % series_size) * 2.5),
+            "image_orientation": (1.0, 0.0, 0.0, 0.0, 1.0, 0.0),
+            "pixel_spacing": (0.9765625, 0.9765625),
+            "slice_thickness": 2.5,
+            "rows": 512,
+            "columns": 512,
+            "given_name": _fresh(f"Given{patient}"),
+            "family_name": _fresh(f"Family{patient}"),
+            "sex": _fresh("MF"[patient % 2]),
+            "birth_date": date(1950 + patient % 50, 1, 1),
+            "modality": _fresh("CT"),
+            "study_id": _fresh(str(study)),
+            "study_description": _fresh("CT CHEST WITH CONTRAST"),
+            "is_valid": True,
+            "file_size": 526_000,
+            "mtime_ns": 1_700_000_000_000_000_000 + index,
+        }
+
+def measure(record_type, instances, series_size=200) -> MemoryResult:
+    """
+    Builds an index of records and measures the memory it holds with tracemalloc.
+    :param record_type: InstanceRecord or DictInstanceRecord
+    :param instances: number of records to build
+    :param series_size: instances per series
+    :return: the MemoryResult
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        records = [record_type(**header) for header in synthetic_headers(instances, series_size)]
+        gc.collect()
+        total_bytes, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del records
+    return MemoryResult(record_type.__name__, instances, total_bytes)
+
+def main(argv=None):
+    """
+    Command line entry point, prints bytes per instance before and after.
+    :param argv: arguments, defaults to sys.argv
+    :return: exit code
+    """
+    parser = argparse.ArgumentParser(description="Measure the memory of the instance index.")
+    parser.add_argument("--instances", type=int, default=100_000, help="records to build")
+    parser.add_argument("--series-size", type=int, default=200, help="instances per series")
+    args = parser.parse_args(argv)
+
+    before = measure(DictInstanceRecord, args.instances, args.series_size)
+    after = measure(InstanceRecord, args.instances, args.series_size)
+    for result in (before, after):
+        print(
+            f"{result.name:<20} {result.bytes_per_instance:8.0f} bytes/instance "
+            f"{result.total_bytes / 2 ** 20:8.1f} MB"
+        )
+    print(f"{'saved':<20} {1 - after.total_bytes / before.total_bytes:8.0%}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
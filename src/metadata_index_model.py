@@ -0,0 +1,412 @@
+""" Class to Create a DICOM Metadata Index Database """
+import json
+import logging
+import os
+import pathlib
+import sqlite3
+from datetime import date
+
+from src.dicom_scanner import InstanceRecord
+
+logger = logging.getLogger(__name__)  # Starting Logger
+
+# Columns stored for each file, path + file_size + mtime_ns decide if a row is stale.
+# is_dicom = 0 rows remember files that are not DICOM so they are not parsed again.
+_RECORD_COLUMNS = [
+    "patient_id",
+    "study_instance_uid",
+    "series_instance_uid",
+    "sop_instance_uid",
+    "instance_number",
+    "image_position",
+    "image_orientation",
+    "pixel_spacing",
+    "slice_thickness",
+    "rows",
+    "columns",
+    "given_name",
+    "family_name",
+    "sex",
+    "birth_date",
+    "modality",
+    "study_id",
+    "study_description",
+    "is_valid",
+    "invalid_reason",
+]
+# geometry tuples are stored as JSON text
+_TUPLE_COLUMNS = {"image_position", "image_orientation", "pixel_spacing"}
+
+# Secondary indexes for find_records/find_studies. Modality and sex have few values, so they
+# lead composite indexes with birth_date to keep a range of birth dates a single index range.
+# study_instance_uid comes last so find_studies can group the matches from the index alone.
+_INDEXES = {
+    "metadata_index_modality": "modality COLLATE NOCASE, birth_date, study_instance_uid",
+    "metadata_index_sex": "sex COLLATE NOCASE, birth_date, study_instance_uid",
+    "metadata_index_birth_date": "birth_date, study_instance_uid",
+    "metadata_index_study_id": "study_id, study_instance_uid",
+    "metadata_index_study": "study_instance_uid",
+}
+# Study descriptions are searched by substring, which no b-tree index can help with, so they
+# are kept in a trigram full text index (rowids shared with metadata_index) kept in step by
+# triggers. Searches of fewer than 3 characters, or on an SQLite without the trigram
+# tokenizer, fall back to a substring scan.
+_DESCRIPTION_TABLE = "metadata_index_description"
+_DESCRIPTION_TRIGGERS = ("metadata_index_insert", "metadata_index_delete")
+_TRIGRAM_LENGTH = 3
+
+
+class MetadataIndexModel:
+    """ class to create a metadata index database of parsed DICOM headers """
+    # Return Codes:
+    #   True or Value indicates ran correctly
+    #   exception indicates operational Error
+
+    def __init__(self, database_path: pathlib.Path, database_name: str):
+        """ Initializing the database connection/creating database """
+        logger.info("Initializing the metadata index connection/creating database")
+        self.database_location: pathlib.Path = database_path / database_name
+        # sqlite3 does not like taking a pathlib.Path object as an input
+        self.posix_database_location: str = self.database_location.as_posix()
+        logger.debug("database location: %s", self.posix_database_location)
+        # False when this SQLite can not keep the description index, set by create_table
+        self.full_text_search: bool = False
+
+        self.create_table()
+        logger.info("Metadata index connection successful")
+
+    def create_table(self) -> bool:
+        """ Creating table in database"""
+        logger.info("Creating metadata_index table in database")
+        try:
+            with sqlite3.connect(self.posix_database_location) as base:
+                base.execute(
+                    "CREATE TABLE IF NOT EXISTS metadata_index ("
+                    "path TEXT PRIMARY KEY, "
+                    "file_size INTEGER NOT NULL, "
+                    "mtime_ns INTEGER NOT NULL, "
+                    "is_dicom INTEGER NOT NULL, "
+                    "patient_id TEXT, "
+                    "study_instance_uid TEXT, "
+                    "series_instance_uid TEXT, "
+                    "sop_instance_uid TEXT, "
+                    "instance_number INTEGER, "
+                    "image_position TEXT, "
+                    "image_orientation TEXT, "
+                    "pixel_spacing TEXT, "
+                    "slice_thickness REAL, "
+                    "rows INTEGER, "
+                    "columns INTEGER, "
+                    "given_name TEXT, "
+                    "family_name TEXT, "
+                    "sex TEXT, "
+                    "birth_date TEXT, "
+                    "modality TEXT, "
+                    "study_id TEXT, "
+                    "study_description TEXT, "
+                    "is_valid INTEGER, "
+                    "invalid_reason TEXT"
+                    ")"
+                )
+                for name, columns in _INDEXES.items():
+                    base.execute(
+                        f"CREATE INDEX IF NOT EXISTS {name} ON metadata_index({columns})"
+                    )
+                try:
+                    _create_description_index(base)
+                    self.full_text_search = True
+                except sqlite3.OperationalError as error:
+                    # SQLite before 3.34 has no trigram tokenizer (or no FTS5 at all), the
+                    # triggers of a database made by a newer one would fail every write
+                    logger.warning("No full text index of study descriptions: %s", error)
+                    for trigger in _DESCRIPTION_TRIGGERS:
+                        base.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+                    self.full_text_search = False
+            logger.info("Table created successfully")
+            return True
+        except sqlite3.OperationalError as error:
+            logger.error("Table did not get created: %s", error)
+            raise sqlite3.OperationalError from error
+
+    def get_records(
+            self,
+            directory: pathlib.Path | str
+    ) -> dict[str, tuple[int, int, InstanceRecord | None]]:
+        """
+        Getting every indexed file under a directory
+        returns path -> (file_size, mtime_ns, record), record is None for non-DICOM files
+        """
+        logger.info("Getting indexed records from database")
+        lower, upper = _directory_range(directory)
+        try:
+            with sqlite3.connect(self.posix_database_location) as base:
+                base.row_factory = sqlite3.Row
+                rows = base.execute(
+                    "SELECT * FROM metadata_index WHERE path >= ? AND path < ?",
+                    [lower, upper]
+                ).fetchall()
+        except sqlite3.OperationalError as error:
+            logger.error("Records not fetched from database")
+            raise sqlite3.OperationalError from error
+        logger.debug("%d records found under %s", len(rows), directory)
+        return {
+            row["path"]: (row["file_size"], row["mtime_ns"], _row_to_record(row))
+            for row in rows
+        }
+
+    def update_records(
+            self,
+            entries: list[tuple[str, int, int, InstanceRecord | None]]
+    ) -> bool:
+        """
+        Adding or replacing index entries in one transaction
+        entries are (path, file_size, mtime_ns, record), record is None for non-DICOM files
+        """
+        logger.info("Updating %d metadata index entries", len(entries))
+        placeholders = ", ".join("?" * (len(_RECORD_COLUMNS) + 4))
+        try:
+            with sqlite3.connect(self.posix_database_location) as base:
+                # a delete rather than INSERT OR REPLACE, whose implicit delete does not
+                # fire the trigger that keeps the description index in step
+                base.executemany(
+                    "DELETE FROM metadata_index WHERE path = ?",
+                    [(entry[0],) for entry in entries]
+                )
+                base.executemany(
+                    "INSERT INTO metadata_index("
+                    f"path, file_size, mtime_ns, is_dicom, {', '.join(_RECORD_COLUMNS)}"
+                    f") VALUES ({placeholders})",
+                    [_entry_to_row(*entry) for entry in entries]
+                )
+                # keeps the statistics the query planner picks an index with up to date
+                base.execute("PRAGMA optimize")
+            logger.info("Metadata index updated successfully")
+            return True
+        except sqlite3.OperationalError as error:
+            logger.error("Metadata index not updated")
+            raise sqlite3.OperationalError from error
+
+    def find_records(
+            self,
+            modality: str | None = None,
+            sex: str | None = None,
+            birth_date_from: date | None = None,
+            birth_date_to: date | None = None,
+            study_id: str | None = None,
+            description: str | None = None,
+            valid_only: bool = False,
+            limit: int | None = None
+    ) -> list[InstanceRecord]:
+        """
+        Finding indexed instances without opening any file, filters
+        that are None are not applied and the rest must all match
+        modality and sex ignore case, the birth date range includes
+        both ends, description matches any part of StudyDescription
+        returns the matching records in no particular order
+        """
+        logger.info("Finding records in the metadata index")
+        where, parameters = _query_filters(
+            modality, sex, birth_date_from, birth_date_to, study_id, description, valid_only,
+            self.full_text_search
+        )
+        query = f"SELECT * FROM metadata_index WHERE {where}"
+        return self._select_records(query, parameters, limit)
+
+    def find_studies(
+            self,
+            modality: str | None = None,
+            sex: str | None = None,
+            birth_date_from: date | None = None,
+            birth_date_to: date | None = None,
+            study_id: str | None = None,
+            description: str | None = None,
+            valid_only: bool = False,
+            limit: int | None = None
+    ) -> list[InstanceRecord]:
+        """
+        Finding indexed studies with the same filters as find_records
+        returns one record per matching study (the first of its matching
+        files to be indexed) so a viewer can jump straight to the study,
+        ordered by patient name and StudyID
+        """
+        logger.info("Finding studies in the metadata index")
+        where, parameters = _query_filters(
+            modality, sex, birth_date_from, birth_date_to, study_id, description, valid_only,
+            self.full_text_search
+        )
+        # the grouping only needs the columns in the indexes, whole rows are
+        # only read for the one instance kept per study
+        query = (
+            "SELECT * FROM metadata_index WHERE rowid IN ("
+            f"SELECT MIN(rowid) FROM metadata_index WHERE {where} "
+            "GROUP BY study_instance_uid"
+            ") ORDER BY family_name, given_name, study_id"
+        )
+        return self._select_records(query, parameters, limit)
+
+    def _select_records(self, query, parameters, limit) -> list[InstanceRecord]:
+        """ Running a query of whole rows and converting them into records """
+        if limit is not None:
+            query += " LIMIT ?"
+            parameters.append(limit)
+        try:
+            with sqlite3.connect(self.posix_database_location) as base:
+                base.row_factory = sqlite3.Row
+                rows = base.execute(query, parameters).fetchall()
+        except sqlite3.OperationalError as error:
+            logger.error("Records not found in database")
+            raise sqlite3.OperationalError from error
+        logger.debug("%d records matched", len(rows))
+        return [_row_to_record(row) for row in rows]
+
+    def delete_missing(
+            self,
+            directory: pathlib.Path | str,
+            existing_paths
+    ) -> bool:
+        """ deleting entries under a directory whose files no longer exist """
+        logger.info("Deleting missing files from the metadata index")
+        existing_paths = set(existing_paths)
+        lower, upper = _directory_range(directory)
+        try:
+            with sqlite3.connect(self.posix_database_location) as base:
+                indexed = base.execute(
+                    "SELECT path FROM metadata_index WHERE path >= ? AND path < ?",
+                    [lower, upper]
+                ).fetchall()
+                missing = [(path,) for (path,) in indexed if path not in existing_paths]
+                base.executemany("DELETE FROM metadata_index WHERE path = ?", missing)
+            logger.info("%d missing files deleted", len(missing))
+            return True
+        except sqlite3.OperationalError as error:
+            logger.error("Missing files not deleted")
+            raise sqlite3.OperationalError from error
+
+
+def _directory_range(directory: pathlib.Path | str) -> tuple[str, str]:
+    """
+    Lower and upper bound of the paths under a directory, so the
+    lookup is a range scan on the primary key rather than a LIKE
+    """
+    prefix = os.path.join(os.path.abspath(directory), "")
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def _create_description_index(base: sqlite3.Connection) -> None:
+    """
+    Creating the trigram index of study descriptions and the triggers
+    keeping it in step, raises sqlite3.OperationalError if this SQLite
+    can not make it
+    """
+    # the index has to be filled in once when it is new, or when its triggers
+    # were dropped while the database was used by an older SQLite
+    rebuild = not base.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = ?",
+        [_DESCRIPTION_TRIGGERS[0]]
+    ).fetchone()
+    base.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {_DESCRIPTION_TABLE} USING fts5("
+        "study_description, content='metadata_index', content_rowid='rowid', "
+        "tokenize='trigram')"
+    )
+    base.execute(
+        f"CREATE TRIGGER IF NOT EXISTS {_DESCRIPTION_TRIGGERS[0]} "
+        "AFTER INSERT ON metadata_index BEGIN "
+        f"INSERT INTO {_DESCRIPTION_TABLE}(rowid, study_description) "
+        "VALUES (new.rowid, new.study_description); END"
+    )
+    base.execute(
+        f"CREATE TRIGGER IF NOT EXISTS {_DESCRIPTION_TRIGGERS[1]} "
+        "AFTER DELETE ON metadata_index BEGIN "
+        f"INSERT INTO {_DESCRIPTION_TABLE}({_DESCRIPTION_TABLE}, rowid, "
+        "study_description) VALUES ('delete', old.rowid, old.study_description); "
+        "END"
+    )
+    if rebuild:
+        base.execute(
+            f"INSERT INTO {_DESCRIPTION_TABLE}({_DESCRIPTION_TABLE}) VALUES ('rebuild')"
+        )
+
+
+def _query_filters(
+        modality, sex, birth_date_from, birth_date_to, study_id, description, valid_only,
+        full_text_search=True
+) -> tuple[str, list]:
+    """
+    WHERE clause and parameters of a find_records/find_studies query, so
+    each filter can use one of the secondary indexes, descriptions are
+    only looked up in the full text index if full_text_search is True
+    """
+    clauses = []
+    parameters = []
+    if modality is not None:
+        clauses.append("modality = ? COLLATE NOCASE")
+        parameters.append(modality)
+    if sex is not None:
+        clauses.append("sex = ? COLLATE NOCASE")
+        parameters.append(sex)
+    # ISO dates sort the same as the dates themselves
+    if birth_date_from is not None:
+        clauses.append("birth_date >= ?")
+        parameters.append(birth_date_from.isoformat())
+    if birth_date_to is not None:
+        clauses.append("birth_date <= ?")
+        parameters.append(birth_date_to.isoformat())
+    if study_id is not None:
+        clauses.append("study_id = ?")
+        parameters.append(study_id)
+    # with a birth date or StudyID to narrow the rows down, checking the description of each
+    # is quicker than collecting every row of the full text index that matches it
+    narrowed = any(value is not None for value in (birth_date_from, birth_date_to, study_id))
+    if description:
+        if full_text_search and len(description) >= _TRIGRAM_LENGTH and not narrowed:
+            # a quoted phrase matches the text anywhere, quotes in it are doubled
+            clauses.append(
+                f"rowid IN (SELECT rowid FROM {_DESCRIPTION_TABLE} "
+                f"WHERE {_DESCRIPTION_TABLE} MATCH ?)"
+            )
+            parameters.append('"' + description.replace('"', '""') + '"')
+        else:
+            clauses.append("instr(lower(study_description), lower(?)) > 0")
+            parameters.append(description)
+    if valid_only:
+        clauses.append("is_valid = 1")
+    # the filters never match the NULL columns of files that are not DICOM, without any
+    # filters those files still have to be left out
+    return " AND ".join(clauses or ["is_dicom = 1"]), parameters
+
+
+def _entry_to_row(path, file_size, mtime_ns, record):
+    """ Converting an index entry into the values of a row """
+    if record is None:
+        return [path, file_size, mtime_ns, 0] + [None] * len(_RECORD_COLUMNS)
+    values = []
+    for column in _RECORD_COLUMNS:
+        value = getattr(record, column)
+        if column in _TUPLE_COLUMNS and value is not None:
+            value = json.dumps(value)
+        elif isinstance(value, date):
+            value = value.isoformat()
+        values.append(value)
+    return [path, file_size, mtime_ns, 1] + values
+
+
+def _row_to_record(row: sqlite3.Row) -> InstanceRecord | None:
+    """ Converting a row back into an InstanceRecord """
+    if not row["is_dicom"]:
+        return None
+    values = {}
+    for column in _RECORD_COLUMNS:
+        value = row[column]
+        if column in _TUPLE_COLUMNS and value is not None:
+            value = tuple(json.loads(value))
+        values[column] = value
+    if values["birth_date"] is not None:
+        values["birth_date"] = date.fromisoformat(values["birth_date"])
+    values["is_valid"] = bool(values["is_valid"])
+    return InstanceRecord(
+        path=row["path"],
+        file_size=row["file_size"],
+        mtime_ns=row["mtime_ns"],
+        **values
+    )
@@ -1,16 +1,17 @@
 
 import numpy as np
 import sys
-import pydicom
 import logging
 from PySide6 import QtWidgets
 from PySide6.QtWidgets import QMessageBox
 from PySide6.QtGui import QPixmap, QImage
-from PySide6.QtCore import QTimer
-from src.inputs_and_outputs import get_qimage_from_dicom_file
-from src.dicom_utils import extract_patient_info, validate_dicom
-from src.read_dicom_file import read_dicom_file
+from PySide6.QtCore import QEvent, QThreadPool, QTimer, Qt
+from src.dicom_loader import Worker, decode_frame, load_dicom
+from src.dicom_cache import DICOM_CACHE
+from src.render_target import RenderTarget
+from src.window_level import drag_window
 from src.user_pref_controller import UserPrefController
+from src.study_search_ui import StudySearchDialog
 from babel.dates import format_date
 import pathlib
 import os
@@ -18,11 +19,13 @@ import os
 class MiniProjectUI(QtWidgets.QDialog):
     """The class that contains the UI"""
     number_rows_for_dic_button = 2
+    minimum_image_size = (512, 512)
 
     def __init__(self,data_base):
         super().__init__()
         self.setWindowTitle("Mini Project UI")
         self.path = ""
+        self.ds = None
         self.data_base = data_base
         if self.data_base is not None:
             default_path = self.data_base.default_path()
@@ -32,9 +35,46 @@ class MiniProjectUI(QtWidgets.QDialog):
         self.directory_button_box()
         main_layout = QtWidgets.QVBoxLayout()
         self.image_label = QtWidgets.QLabel("No Image to Display")
+        # the label takes the space the layout gives it rather than the size of the pixmap,
+        # so images are rendered at the size they are shown at, not the other way round
+        self.image_label.setSizePolicy(QtWidgets.QSizePolicy.Ignored, QtWidgets.QSizePolicy.Ignored)
+        self.image_label.setMinimumSize(*self.minimum_image_size)
+        # dragging on the image changes the window/level, double click resets it
+        self.windowed_frame = None
+        # display buffers of frames no longer shown, reused by the next frame render
+        self.spare_targets = []
+        self.drag_start = None
+        self.pending_window = None
+        self.image_label.installEventFilter(self)
+        self.window_label = QtWidgets.QLabel()
+        # windows the image from its histogram, ignoring outliers such as metal or annotations
+        self.auto_window_button = QtWidgets.QPushButton("Auto Window")
+        self.auto_window_button.setEnabled(False)
+        self.auto_window_button.clicked.connect(self.apply_auto_window)
+        window_layout = QtWidgets.QHBoxLayout()
+        window_layout.addWidget(self.window_label)
+        window_layout.addStretch()
+        window_layout.addWidget(self.auto_window_button)
+        # only shown for multi-frame files
+        self.frame_slider = QtWidgets.QSlider(Qt.Horizontal)
+        self.frame_slider.setVisible(False)
+        self.frame_slider.valueChanged.connect(self.show_frame)
+        # busy indicator shown while a file is loading in the background
+        self.thread_pool = QThreadPool()
+        # the most recent background load, older ones are cancelled when a new one starts
+        self.active_worker = None
+        self.study_search = None  # StudySearchDialog, made on the first Find Study
+        self.progress_bar = QtWidgets.QProgressBar()
+        self.progress_bar.setRange(0, 0)
+        self.progress_bar.setVisible(False)
+        self.status = QtWidgets.QLabel()
 
         main_layout.addWidget(self._grid_group_box)
         main_layout.addWidget(self.image_label)
+        main_layout.addWidget(self.frame_slider)
+        main_layout.addLayout(window_layout)
+        main_layout.addWidget(self.progress_bar)
+        main_layout.addWidget(self.status)
 
         self.setLayout(main_layout)
 
@@ -56,13 +96,6 @@ class MiniProjectUI(QtWidgets.QDialog):
             self.add_directory()
 
 
-    def file_cannot_be_opened_error(self):
-        """Displays the file error open button"""
-        error_message = QtWidgets.QMessageBox()
-        error_message.setIcon(QtWidgets.QMessageBox.Warning)
-        error_message.setText("File can not be opened because the file is missing format data or appropriate headers")
-        error_message.exec()
-
     def show_database_message(self, success: bool):
         """Dislays a message to inform user if the value was saved"""
         msg_box = QMessageBox()
@@ -91,6 +124,10 @@ class MiniProjectUI(QtWidgets.QDialog):
         self.modality = QtWidgets.QLabel("Modality")
 
         button.clicked.connect(self.add_directory)
+        # searches the metadata index, only available with a database to keep it in
+        find_button = QtWidgets.QPushButton("Find Study")
+        find_button.setEnabled(self.data_base is not None)
+        find_button.clicked.connect(self.find_study)
         layout.addWidget(path_label, 0, 0)
         layout.addWidget(self.text, 0, 1, 1,4)
         layout.addWidget(fname_label, 1, 0)
@@ -105,6 +142,7 @@ class MiniProjectUI(QtWidgets.QDialog):
         layout.addWidget(self.sex, 1, 4)
         layout.addWidget(self.patient_id, 2, 4)
         layout.addWidget(self.modality, 3, 4)
+        layout.addWidget(find_button, 5, 3)
         layout.addWidget(button, 5, 4)
         layout.setColumnStretch(1, 20)
         self._grid_group_box.setLayout(layout)
@@ -132,6 +170,21 @@ class MiniProjectUI(QtWidgets.QDialog):
             self.path = dir_path
             self.open_dicom_file()
 
+    def find_study(self):
+        """Opens the study search, the chosen study's file is opened like Open New File"""
+        # made once and shown again, so dialogs and their connections do not pile up
+        if self.study_search is None:
+            self.study_search = StudySearchDialog(
+                self.data_base.create_metadata_index(), self.thread_pool, self
+            )
+            self.study_search.study_selected.connect(self.open_study)
+        self.study_search.exec()
+
+    def open_study(self, path):
+        """Opens a file of the study picked in the study search"""
+        self.path = path
+        self.open_dicom_file()
+
     #This also needs to be changed to reflect the MySQL
     def check_saved_dir(self):
         """Checks if the file in the directory has been created"""
@@ -155,45 +208,90 @@ class MiniProjectUI(QtWidgets.QDialog):
         label.setText(str(value) if value else default)
 
     def open_dicom_file(self):
-        """Opens a DICOM file and displays the image linked to that file, if available"""
-        try:
-            ds = read_dicom_file(self.path)
-
-            #Adds the validation needed for AXIAL files and "StudyID+StudyDescription"
-            if ds is not None:
-                validate_dicom(ds)
-            else:
-                logging.error("validate_dicom failed")
-                # just returning to avoid raising exception as exception is handled by not overwriting self.path if an empty string is the path
-                return
-                # raise ValueError("Invalid DICOM file or failed to load the file.")
-
-            if ds is not None:
-                self.save_directory_path()
-            else:
-                logging.error("Could not open DICOM file")
-
-        except pydicom.errors.InvalidDicomError:
-            self.file_cannot_be_opened_error()
-
+        """
+        Starts loading the DICOM file on a worker thread, the patient details
+        and image are filled in by dicom_file_loaded when it finishes
+        """
         self.text.setText(self.path)
+        worker = Worker(
+            load_dicom, self.path, cache=DICOM_CACHE, display_size=self.display_size(), preview=True
+        )
+        worker.signals.preview.connect(self.preview_ready)
+        self.start_worker(worker, self.dicom_file_loaded)
+
+    def start_worker(self, worker, on_finished):
+        """
+        Runs a pipeline worker on the thread pool and shows the progress state.
+        The previous load is superseded: its token is cancelled so it stops at its next
+        stage, and anything it has already emitted is ignored
+        """
+        if self.active_worker is not None:
+            self.active_worker.token.cancel()
+        self.active_worker = worker
+        worker.signals.progress.connect(self.worker_progress)
+        worker.signals.finished.connect(on_finished)
+        worker.signals.failed.connect(self.loading_failed)
+        self.show_progress("Loading")
+        self.thread_pool.start(worker)
+
+    def is_active_worker(self):
+        """True if the signal being handled came from the most recent load rather than a superseded one"""
+        return self.active_worker is not None and self.sender() is self.active_worker.signals
+
+    def worker_progress(self, stage):
+        """Called on the GUI thread as a background load starts each stage"""
+        if self.is_active_worker():
+            self.show_progress(stage)
+
+    def show_progress(self, stage):
+        """Shows the stage the background load is at"""
+        self.progress_bar.setVisible(True)
+        self.status.setText(f"{stage}...")
+
+    def hide_progress(self):
+        """Hides the progress state once the background load is over"""
+        self.progress_bar.setVisible(False)
+        self.status.setText("")
+
+    def preview_ready(self, image):
+        """Called on the GUI thread with a low resolution image, shown until the file has loaded"""
+        if not self.is_active_worker():
+            return
+        self.frame_slider.setVisible(False)
+        self.set_windowed_frame(None)
+        self.display_image(image)
 
+    def loading_failed(self, message):
+        """Called on the GUI thread when a background load raised an error"""
+        if not self.is_active_worker():
+            return
+        self.hide_progress()
+        logging.error("Could not open DICOM file: %s", message)
+        self.status.setText(f"Could not open DICOM file: {message}")
 
-        metadata = extract_patient_info(ds)
+    def dicom_file_loaded(self, result):
+        """Called on the GUI thread with the LoadResult of open_dicom_file"""
+        if not self.is_active_worker():
+            return
+        self.hide_progress()
+        self.save_directory_path()
 
-        # Check for pixel data, and display it if available
-        if 'PixelData' in ds:
-            try:
-                image = get_qimage_from_dicom_file(ds)
-                pixmap = QPixmap.fromImage(image)
-                self.image_label.setPixmap(pixmap)
-                self.image_label.setScaledContents(True)
-            except Exception as e:
-                logging.error(f"Error displaying image: {e}")
-                self.image_label.setText("Error Displaying Image")
+        # Display the image if available
+        self.ds = result.ds
+        if result.image is not None:
+            # blocking signals so resetting the slider does not render frame 0 twice
+            self.frame_slider.blockSignals(True)
+            self.frame_slider.setRange(0, result.number_of_frames - 1)
+            self.frame_slider.setValue(0)
+            self.frame_slider.blockSignals(False)
+            self.frame_slider.setVisible(result.number_of_frames > 1)
+            self.display_image(result.image)
         else:
-            self.image_label.setText("No Image Data Found")
+            self.frame_slider.setVisible(False)
+            self.image_label.setText(result.image_error)
+        self.set_windowed_frame(result.frame)
 
+        metadata = result.metadata
         if metadata.birth_date:
             # Change the date variable to a string
             formatted_birth_date = format_date(metadata.birth_date, format='long', locale='en')
@@ -208,6 +306,109 @@ class MiniProjectUI(QtWidgets.QDialog):
         self.dob.setText(formatted_birth_date)
         self.modality.setText(metadata.modality)
 
+    def show_frame(self, frame):
+        """
+        Renders one frame of the open file on a worker thread, only that frame is decoded.
+        The window/level the user has set is kept
+        """
+        window = self.windowed_frame.window if self.windowed_frame is not None else None
+        # the worker owns the target until its frame is shown, so no buffer is shared between threads
+        target = self.spare_targets.pop() if self.spare_targets else RenderTarget()
+        worker = Worker(
+            decode_frame, self.ds, frame, cache=DICOM_CACHE, window=window, target=target,
+            display_size=self.display_size()
+        )
+        self.start_worker(worker, self.frame_rendered)
+
+    def frame_rendered(self, rendered):
+        """Called on the GUI thread with the RenderedFrame from show_frame"""
+        if not self.is_active_worker():
+            return
+        self.hide_progress()
+        self.display_image(rendered.image)
+        self.set_windowed_frame(rendered.frame)
+
+    def set_windowed_frame(self, windowed_frame):
+        """Keeps the decoded frame so the window/level can be changed without decoding it again"""
+        previous = self.windowed_frame
+        if previous is not None and previous is not windowed_frame and not self.spare_targets:
+            # its image has been copied to the label, so the buffer can be rendered into again
+            self.spare_targets.append(previous.target)
+        self.windowed_frame = windowed_frame
+        self.drag_start = None
+        self.show_window_level()
+
+    def show_window_level(self):
+        """Shows the current window/level, or nothing if the image can not be windowed"""
+        self.auto_window_button.setEnabled(self.windowed_frame is not None)
+        if self.windowed_frame is None:
+            self.window_label.setText("")
+            return
+        window = self.windowed_frame.window
+        self.window_label.setText(f"Window: {window.width:.0f}  Level: {window.center:.0f}")
+
+    def apply_auto_window(self):
+        """Sets the window from robust percentiles of the frame's histogram"""
+        if self.windowed_frame is not None:
+            self.change_window(self.windowed_frame.auto_window())
+
+    def eventFilter(self, watched, event):
+        """
+        Turns mouse drags on the image into window/level changes, and re-renders the image
+        at the matching pyramid level when the label is resized
+        """
+        if watched is self.image_label and self.windowed_frame is not None:
+            event_type = event.type()
+            if event_type == QEvent.Resize:
+                self.change_window(self.windowed_frame.window)
+            if event_type == QEvent.MouseButtonDblClick:
+                self.change_window(self.windowed_frame.default_window)
+                return True
+            if event_type == QEvent.MouseButtonPress and event.button() == Qt.LeftButton:
+                self.drag_start = (event.position(), self.windowed_frame.window)
+                return True
+            if event_type == QEvent.MouseMove and self.drag_start is not None:
+                start_position, start_window = self.drag_start
+                delta = event.position() - start_position
+                self.change_window(drag_window(start_window, delta.x(), delta.y()))
+                return True
+            if event_type == QEvent.MouseButtonRelease and self.drag_start is not None:
+                self.drag_start = None
+                return True
+        return super().eventFilter(watched, event)
+
+    def change_window(self, window):
+        """
+        Re-renders the current frame with a new window. Mouse moves that arrive before the
+        next render are merged, so only the latest window is ever drawn
+        """
+        if self.pending_window is None:
+            QTimer.singleShot(0, self.render_pending_window)
+        self.pending_window = window
+
+    def render_pending_window(self):
+        """
+        Applies the latest window to the decoded frame, only the lookup table is recomputed.
+        Large frames are rendered from the pyramid level that matches the size of the label
+        """
+        window, self.pending_window = self.pending_window, None
+        if window is None or self.windowed_frame is None:
+            return
+        level = self.windowed_frame.level_for_size(*self.display_size())
+        self.display_image(self.windowed_frame.render_image(window, level=level))
+        self.show_window_level()
+
+    def display_size(self):
+        """The (width, height) images are shown at, in device pixels"""
+        ratio = self.image_label.devicePixelRatioF()
+        return (round(self.image_label.width() * ratio), round(self.image_label.height() * ratio))
+
+    def display_image(self, image):
+        """Shows a QImage in the image label"""
+        pixmap = QPixmap.fromImage(image)
+        self.image_label.setPixmap(pixmap)
+        self.image_label.setScaledContents(True)
+
 if __name__ == "__main__":
     app = QtWidgets.QApplication(sys.argv)
     database = UserPrefController(pathlib.Path("preferences.db"))
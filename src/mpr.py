@@ -0,0 +1,286 @@
+"""
+Multiplanar reformatting of a loaded series volume. Axial, coronal and sagittal slices are
+strided NumPy views of the one (slices, rows, columns) buffer, so no reformatted copy of the
+volume is ever made, and they go straight into numpy_to_qimage. Voxels are rarely cubes, so
+each plane has an aspect ratio from PixelSpacing and the slice spacing that the image is
+stretched by when it is shown.
+
+The volume holds stored values, the array of a CompactVolume or a raw array, and its modality
+rescale per slice. One window is applied to every plane at render time, each row through the
+rescale of the slice it comes from, so coronal and sagittal rows from different slices are
+shown on the same scale, which per-slice normalized volumes are not.
+
+Maximum intensity projections over a slab of slices are a single vectorized max along one
+axis, and are cached per slab so paging back and forth does not reduce the slab again.
+"""
+
+import logging
+from dataclasses import dataclass
+
+import numpy as np
+from PySide6.QtCore import Qt
+from PySide6.QtGui import QImage
+
+from src.compact_volume import CompactVolume
+from src.dicom_cache import DicomCache
+from src.dicom_scanner import slice_position
+from src.dicom_utils import numpy_to_qimage
+from src.window_level import (
+    Rescale, apply_window, auto_window, default_window, pixel_histogram, supports_lut
+)
+
+logger = logging.getLogger(__name__)  # Start logger
+
+AXIAL = "axial"
+CORONAL = "coronal"
+SAGITTAL = "sagittal"
+
+# axis of the (slices, rows, columns) volume each plane cuts across
+PLANE_AXES = {AXIAL: 0, CORONAL: 1, SAGITTAL: 2}
+
+# slab projections kept per volume
+SLAB_CACHE_BYTES = 256 * 1024 * 1024  # 256 MB
+
+@dataclass(frozen=True)
+class VoxelSpacing:
+    """
+    This class stores the size of a voxel in mm along each axis of the volume.
+    """
+    slices: float = 1.0  # between slice centres
+    rows: float = 1.0
+    columns: float = 1.0
+
+def spacing_from_records(records) -> VoxelSpacing:
+    """
+    Voxel size of a sorted series. The slice spacing is measured between the slice positions,
+    SliceThickness is only used when positions are missing, as slices may overlap or have gaps.
+    :param records: sorted InstanceRecords of one series from a SeriesIndex
+    :return: the VoxelSpacing, 1 mm along any axis that can not be worked out
+    """
+    if not records:
+        return VoxelSpacing()
+    first = records[0]
+    row, column = first.pixel_spacing if first.pixel_spacing else (1.0, 1.0)
+
+    positions = [slice_position(record) for record in records]
+    if len(records) > 1 and None not in positions:
+        slice_spacing = float(np.median(np.abs(np.diff(positions))))
+    else:
+        slice_spacing = first.slice_thickness or 0.0
+    return VoxelSpacing(slices=slice_spacing or 1.0, rows=row or 1.0, columns=column or 1.0)
+
+class MprVolume:
+    """
+    Axial, coronal and sagittal views of a (slices, rows, columns) volume of stored values,
+    e.g. from series_loader.load_compact_series_volume().
+    """
+    def __init__(self, volume, spacing=VoxelSpacing(), cache=None, rescale=None):
+        """
+        :param volume: CompactVolume, or 3D array of stored values, of slices in slice order.
+            The planes are views of its array, which is not copied.
+        :param spacing: VoxelSpacing of the volume
+        :param cache: DicomCache for slab projections, defaults to a new one of SLAB_CACHE_BYTES
+        :param rescale: modality rescale of every slice, defaults to the CompactVolume's rescale
+            of each slice (identity for an array)
+        """
+        slopes = intercepts = None
+        if isinstance(volume, CompactVolume):
+            slopes, intercepts = volume.slopes, volume.intercepts
+            volume = volume.array
+        if volume.ndim != 3:
+            raise ValueError(f"Volume must be 3D, got shape {volume.shape}")
+        if rescale is not None or slopes is None:
+            rescale = rescale if rescale is not None else Rescale()
+            slopes = np.full(volume.shape[0], rescale.slope, dtype=np.float64)
+            intercepts = np.full(volume.shape[0], rescale.intercept, dtype=np.float64)
+        self.volume = volume
+        self.spacing = spacing
+        # modality rescale of each slice
+        self.slopes = slopes
+        self.intercepts = intercepts
+        self.cache = cache if cache is not None else DicomCache(max_bytes=SLAB_CACHE_BYTES)
+        # part of every cache key, so volumes can share a cache
+        self._cache_token = object()
+        self._window = None
+
+    def __len__(self) -> int:
+        return self.volume.shape[0]
+
+    def plane_length(self, plane) -> int:
+        """:return: number of slices in a plane"""
+        return self.volume.shape[PLANE_AXES[plane]]
+
+    def get_slice(self, plane, index) -> np.ndarray:
+        """
+        :param plane: AXIAL, CORONAL or SAGITTAL
+        :param index: slice of that plane
+        :return: 2D view of the volume, coronal and sagittal rows run along the slices from
+            the last one down, so the superior end of an axial series is at the top
+        """
+        axis = PLANE_AXES[plane]
+        length = self.volume.shape[axis]
+        if not -length <= index < length:
+            raise IndexError(f"Slice {index} out of range for {length} {plane} slices")
+        # basic indexing, which always gives a view, also of the reversed slice axis
+        return _rows_up(plane, self.volume[(slice(None),) * axis + (index,)])
+
+    def aspect(self, plane) -> float:
+        """
+        :param plane: AXIAL, CORONAL or SAGITTAL
+        :return: height / width of a pixel of the plane, 1.0 for square pixels
+        """
+        if plane == AXIAL:
+            return self.spacing.rows / self.spacing.columns
+        if plane == CORONAL:
+            return self.spacing.slices / self.spacing.columns
+        return self.spacing.slices / self.spacing.rows
+
+    def display_shape(self, plane) -> tuple[int, int]:
+        """:return: (rows, columns) of the plane once stretched to square pixels"""
+        rows, columns = self._shape(plane)
+        aspect = self.aspect(plane)
+        if aspect >= 1.0:
+            return max(round(rows * aspect), 1), columns
+        return rows, max(round(columns / aspect), 1)
+
+    def mip(self, plane, start, stop) -> np.ndarray:
+        """
+        Maximum intensity projection of a slab, cached per slab. Axial slabs of slices with
+        different rescales are projected in modality units, see projection_rescales().
+        :param plane: AXIAL, CORONAL or SAGITTAL
+        :param start: first slice of the slab
+        :param stop: slice after the last one of the slab
+        :return: 2D array of the same shape as a slice of the plane
+        """
+        start, stop, _ = slice(start, stop).indices(self.plane_length(plane))
+        if stop <= start:
+            raise ValueError(f"Empty slab {start}:{stop} of the {plane} plane")
+        key = (self._cache_token, "mip", plane, start, stop)
+        if (cached := self.cache.get(key)) is not None:
+            return cached
+        axis = PLANE_AXES[plane]
+        if plane == AXIAL and not _uniform(self.slopes[start:stop], self.intercepts[start:stop]):
+            # a running max of one rescaled slice at a time, never a float copy of the slab
+            projection = self._rescaled_slice(start)
+            for index in range(start + 1, stop):
+                np.maximum(projection, self._rescaled_slice(index), out=projection)
+        else:
+            slab = self.volume[(slice(None),) * axis + (slice(start, stop),)]
+            projection = _rows_up(plane, slab.max(axis=axis))
+        self.cache.put(key, projection)
+        return projection
+
+    def slice_rescales(self, plane, index) -> tuple[np.ndarray, np.ndarray]:
+        """
+        :param plane: AXIAL, CORONAL or SAGITTAL
+        :param index: slice of that plane
+        :return: (slopes, intercepts) of the rows of get_slice(), one entry for an axial slice
+        """
+        if plane == AXIAL:
+            index %= len(self)
+            return self.slopes[index:index + 1], self.intercepts[index:index + 1]
+        return self.slopes[::-1], self.intercepts[::-1]
+
+    def projection_rescales(self, plane, start, stop) -> tuple[np.ndarray, np.ndarray]:
+        """
+        :param plane: AXIAL, CORONAL or SAGITTAL
+        :param start: first slice of the slab
+        :param stop: slice after the last one of the slab
+        :return: (slopes, intercepts) of the rows of mip(), identity for modality values
+        """
+        if plane != AXIAL:
+            return self.slopes[::-1], self.intercepts[::-1]
+        start, stop, _ = slice(start, stop).indices(len(self))
+        slopes, intercepts = self.slopes[start:stop], self.intercepts[start:stop]
+        if _uniform(slopes, intercepts):
+            return slopes[:1], intercepts[:1]
+        return np.ones(1), np.zeros(1)
+
+    def auto_window(self):
+        """
+        One window for every plane, from the histogram of the whole volume, so slices with
+        different maxima keep their relative brightness. Volumes of non integer values or of
+        slices with different rescales get the full range of their modality values.
+        :return: the WindowLevel, worked out on the first call
+        """
+        if self._window is None:
+            if supports_lut(self.volume) and _uniform(self.slopes, self.intercepts):
+                histogram = pixel_histogram(self.volume[0])
+                for index in range(1, len(self)):
+                    histogram = histogram + pixel_histogram(self.volume[index])
+                rescale = Rescale(float(self.slopes[0]), float(self.intercepts[0]))
+                self._window = auto_window(histogram, rescale)
+            else:
+                ends = np.stack([self.volume.min(axis=(1, 2)), self.volume.max(axis=(1, 2))])
+                self._window = default_window(ends * self.slopes + self.intercepts)
+        return self._window
+
+    def render(self, plane, index, window=None, rescale=None, target=None, slab=1) -> QImage:
+        """
+        Shows a slice (or the MIP of a slab centred on it) stretched to its aspect ratio.
+        :param plane: AXIAL, CORONAL or SAGITTAL
+        :param index: slice of that plane
+        :param window: WindowLevel in modality units, defaults to auto_window()
+        :param rescale: modality rescale of every row, defaults to the slices' own rescales
+        :param target: optional RenderTarget to convert into
+        :param slab: number of slices in the MIP, 1 shows the slice itself
+        :return: the QImage, its own copy when stretched
+        """
+        if slab > 1:
+            start = max(index - slab // 2, 0)
+            pixels = self.mip(plane, start, start + slab)
+            slopes, intercepts = self.projection_rescales(plane, start, start + slab)
+        else:
+            pixels = self.get_slice(plane, index)
+            slopes, intercepts = self.slice_rescales(plane, index)
+        if rescale is not None:
+            slopes, intercepts = np.array([rescale.slope]), np.array([rescale.intercept])
+        window = window if window is not None else self.auto_window()
+        out = target.buffer(pixels.shape) if target is not None else None
+        pixels = _window_rows(pixels, window, slopes, intercepts, out)
+        image = numpy_to_qimage(pixels, target)
+        rows, columns = self.display_shape(plane)
+        if (rows, columns) == pixels.shape:
+            return image
+        return image.scaled(columns, rows, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+
+    def _rescaled_slice(self, index):
+        """An axial slice in modality units as float32"""
+        pixels = self.volume[index].astype(np.float32)
+        pixels *= self.slopes[index]
+        pixels += self.intercepts[index]
+        return pixels
+
+    def _shape(self, plane):
+        """(rows, columns) of a slice of the plane"""
+        shape = list(self.volume.shape)
+        del shape[PLANE_AXES[plane]]
+        return tuple(shape)
+
+def _rows_up(plane, pixels):
+    """
+    Coronal and sagittal rows run along the slices, which are sorted by ascending position,
+    inferior first for an axial series. Their rows are reversed (a view) to put superior on top.
+    """
+    return pixels if plane == AXIAL else pixels[::-1]
+
+def _uniform(slopes, intercepts) -> bool:
+    """True if every slice has the same rescale"""
+    return bool(np.all(slopes == slopes[0]) and np.all(intercepts == intercepts[0]))
+
+def _window_rows(pixels, window, slopes, intercepts, out=None):
+    """
+    apply_window() with the rescale of each row, rows of a rescale are windowed together so a
+    volume with one rescale is a single lookup table gather.
+    :param slopes: slope of each row, or a single one for every row
+    :param intercepts: intercept of each row, or a single one for every row
+    """
+    if _uniform(slopes, intercepts):
+        return apply_window(pixels, window, Rescale(float(slopes[0]), float(intercepts[0])),
+                            out=out)
+    if out is None:
+        out = np.empty(pixels.shape, dtype=np.uint8)
+    for slope, intercept in set(zip(slopes.tolist(), intercepts.tolist())):
+        rows = np.flatnonzero((slopes == slope) & (intercepts == intercept))
+        out[rows] = apply_window(pixels[rows], window, Rescale(slope, intercept))
+    return out
@@ -0,0 +1,202 @@
+"""
+Decodes compressed frames (JPEG 2000, JPEG-LS, RLE, ...) across a process pool. pydicom's pixel
+data handlers hold the GIL, so threads decode one frame at a time however many cores there are.
+
+Encapsulated PixelData is split into one small dataset per frame and sent to the workers, which
+write the decoded pixels into a block of shared memory instead of pickling them back. The block
+holds a few chunks of frames per worker and is reused as chunks are copied out, so memory stays
+flat however many frames there are.
+"""
+
+import logging
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+from pydicom.encaps import generate_pixel_data_frame
+from pydicom.pixel_data_handlers.util import pixel_dtype
+
+from src.dicom_volume import MultiFrameVolume, single_frame_dataset
+from src.pixel_memmap import read_dicom_file_mapped
+from src.window_level import rescale_from_dataset
+
+logger = logging.getLogger(__name__)  # Start logger
+
+# frames sent to a worker at a time
+CHUNK_FRAMES = 4
+
+def is_compressed(ds) -> bool:
+    """:return: True if the dataset's transfer syntax is compressed (encapsulated)"""
+    file_meta = getattr(ds, "file_meta", None)
+    transfer_syntax = file_meta.get("TransferSyntaxUID", None) if file_meta else None
+    return transfer_syntax is not None and transfer_syntax.is_compressed
+
+def frame_layout(ds) -> tuple[tuple[int, ...], np.dtype]:
+    """
+    The shape and dtype a pixel data handler decodes one frame of ds to, read from the header.
+    :param ds: dataset or header with the image pixel module
+    :return: ((rows, columns[, samples]), dtype)
+    """
+    samples = int(ds.get("SamplesPerPixel", 1))
+    shape = (int(ds.Rows), int(ds.Columns), *((samples,) if samples > 1 else ()))
+    return shape, pixel_dtype(ds)
+
+def iter_decoded_chunks(decode, sources, frame_shape, dtype, max_workers=None,
+                        chunk_frames=CHUNK_FRAMES, mp_context=None):
+    """
+    Decodes sources across a process pool, yielding chunks of frames as they complete.
+    Chunks are not in order. With a single worker or a single source everything is decoded
+    in this process.
+    :param decode: picklable function from a source to (frame of frame_shape, info), where info
+        is anything small and picklable about the source, e.g. its rescale
+    :param sources: picklable sources, e.g. single frame datasets or file paths
+    :param frame_shape: shape of every decoded frame
+    :param dtype: dtype of the decoded frames
+    :param max_workers: number of worker processes, defaults to the CPU count
+    :param chunk_frames: number of frames sent to a worker at a time
+    :param mp_context: optional multiprocessing context the workers are started with, e.g.
+        spawn from a process running threads, which fork is not safe in
+    :raises ValueError: if a frame does not decode to frame_shape
+    :return: generator of (positions in sources, (len(positions), *frame_shape) array,
+        list of the info of each frame)
+    """
+    sources = list(sources)
+    max_workers = max_workers or os.cpu_count() or 1
+    chunks = [
+        list(range(start, min(start + chunk_frames, len(sources))))
+        for start in range(0, len(sources), chunk_frames)
+    ]
+    if max_workers == 1 or len(sources) <= 1:
+        for positions in chunks:
+            frames = np.empty((len(positions), *frame_shape), dtype=dtype)
+            infos = []
+            for out, position in zip(frames, positions):
+                frame, info = decode(sources[position])
+                out[...] = _checked_frame(frame, frame_shape, dtype, position)
+                infos.append(info)
+            yield positions, frames, infos
+        return
+
+    # two chunks per worker keeps every worker busy, slots are reused as chunks complete
+    slot_count = min(max_workers * 2, len(chunks))
+    slots_shape = (slot_count, chunk_frames, *frame_shape)
+    nbytes = int(np.prod(slots_shape)) * np.dtype(dtype).itemsize
+    shm = SharedMemory(create=True, size=max(nbytes, 1))
+    executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=mp_context)
+    slots = np.ndarray(slots_shape, dtype=dtype, buffer=shm.buf)
+    try:
+        free_slots = list(range(slot_count))
+        pending = {}  # future -> (slot, positions)
+        remaining = iter(chunks)
+        while True:
+            while free_slots and (positions := next(remaining, None)) is not None:
+                slot = free_slots.pop()
+                future = executor.submit(
+                    _decode_chunk, decode, [sources[position] for position in positions],
+                    positions, shm.name, slots_shape, dtype, slot,
+                )
+                pending[future] = (slot, positions)
+            if not pending:
+                return
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                slot, positions = pending.pop(future)
+                infos = future.result()  # re-raises any error from the worker
+                # copied out so the slot can be reused and the block closed
+                chunk = slots[slot, :len(positions)].copy()
+                free_slots.append(slot)
+                yield positions, chunk, infos
+    finally:
+        # stops queued chunks if the caller stops early or a chunk failed
+        executor.shutdown(wait=True, cancel_futures=True)
+        del slots
+        shm.close()
+        shm.unlink()
+
+def stream_decoded_frames(ds, indices=None, max_workers=None, chunk_frames=CHUNK_FRAMES,
+                          mp_context=None):
+    """
+    Generator that decodes frames of a compressed multi-frame dataset across a process pool
+    into one preallocated array.
+    :param ds: dataset with encapsulated pixel data
+    :param indices: frame indexes to decode, defaults to every frame
+    :param max_workers: number of worker processes, defaults to the CPU count
+    :param chunk_frames: number of frames sent to a worker at a time
+    :param mp_context: optional multiprocessing context, see iter_decoded_chunks()
+    :raises ValueError: if the pixel data is not compressed
+    :return: generator of (frames, frames_decoded, total_frames, positions), the same array
+        every time, positions are the indexes into frames (and indices) of the chunk just decoded
+    """
+    if not is_compressed(ds):
+        raise ValueError("Pixel data is not compressed, use MultiFrameVolume to map it")
+    number_of_frames = int(ds.get("NumberOfFrames", 1) or 1)
+    fragments = list(generate_pixel_data_frame(ds.PixelData, number_of_frames))
+    indices = range(number_of_frames) if indices is None else indices
+    sources = [single_frame_dataset(ds, fragments[index]) for index in indices]
+
+    frame_shape, dtype = frame_layout(ds)
+    frames = np.empty((len(sources), *frame_shape), dtype=dtype)
+    logger.info("Decoding %d compressed frames into a %s array", len(sources), frames.shape)
+    decoded = 0
+    for positions, chunk, _ in iter_decoded_chunks(
+            _decode_dataset, sources, frame_shape, dtype, max_workers, chunk_frames, mp_context
+    ):
+        frames[positions] = chunk
+        decoded += len(positions)
+        yield frames, decoded, len(sources), positions
+
+def decode_frames(ds, indices=None, max_workers=None):
+    """
+    Decodes frames of a compressed multi-frame dataset, see stream_decoded_frames()
+    :param ds: dataset with encapsulated pixel data
+    :param indices: frame indexes to decode, defaults to every frame
+    :param max_workers: number of worker processes
+    :return: the (frames, rows, columns[, samples]) array of stored values
+    """
+    frames = None
+    for frames, *_ in stream_decoded_frames(ds, indices, max_workers):
+        pass
+    return frames
+
+def _decode_dataset(frame_ds):
+    """Decodes a single frame dataset from single_frame_dataset(), frames share one rescale"""
+    return frame_ds.pixel_array, None
+
+def decode_file(path):
+    """
+    Decodes the first frame of a file, used to decode series of single-frame files
+    :return: (frame, Rescale of the file), slices of PET or CT may each have their own
+    """
+    ds = read_dicom_file_mapped(path)
+    if ds is None:
+        raise ValueError(f"Could not read {path}")
+    return np.asarray(MultiFrameVolume(ds).get_frame(0)), rescale_from_dataset(ds)
+
+def _decode_chunk(decode, sources, positions, shm_name, slots_shape, dtype, slot):
+    """
+    Worker process entry point, decodes a chunk of frames into a shared memory slot
+    :return: the info of each frame
+    """
+    # pool workers share the parent's resource tracker, which unlinks the block if the parent dies
+    shm = SharedMemory(name=shm_name)
+    try:
+        frame_bytes = int(np.prod(slots_shape[2:])) * np.dtype(dtype).itemsize
+        start = slot * slots_shape[1] * frame_bytes
+        infos = []
+        for source, position in zip(sources, positions):
+            frame, info = decode(source)
+            frame = _checked_frame(frame, slots_shape[2:], dtype, position)
+            infos.append(info)
+            # written through a temporary memoryview so no array keeps the block open
+            shm.buf[start:start + frame_bytes] = frame.reshape(-1).view(np.uint8)
+            start += frame_bytes
+    finally:
+        shm.close()
+    return infos
+
+def _checked_frame(frame, frame_shape, dtype, position):
+    """:return: the decoded frame as a contiguous array of dtype, if it has the expected size"""
+    if frame.shape != tuple(frame_shape):
+        raise ValueError(f"Frame {position} is {frame.shape}, expected {tuple(frame_shape)}")
+    return np.ascontiguousarray(frame.astype(dtype, casting="same_kind", copy=False))
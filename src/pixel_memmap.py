@@ -0,0 +1,80 @@
+"""
+Zero-copy access to uncompressed pixel data. For Implicit/Explicit VR Little Endian files the
+byte offset of PixelData is recorded while reading and the pixels are returned as an np.memmap
+view of the file, so the OS pages frames in as they are used and nothing is copied up front.
+"""
+
+import logging
+import os
+import numpy as np
+from pydicom.dataelem import RawDataElement
+from pydicom.pixel_data_handlers.util import get_expected_length, pixel_dtype, reshape_pixel_array
+from pydicom.uid import ExplicitVRLittleEndian, ImplicitVRLittleEndian
+from src.read_dicom_file import DEFER_SIZE, read_dicom_file
+
+logger = logging.getLogger(__name__)  # Start logger
+
+PIXEL_DATA_TAG = 0x7FE00010
+UNDEFINED_LENGTH = 0xFFFFFFFF  # encapsulated (compressed) pixel data
+MEMMAP_TRANSFER_SYNTAXES = (ImplicitVRLittleEndian, ExplicitVRLittleEndian)
+
+def read_dicom_file_mapped(file_path):
+    """
+    Reads a DICOM file leaving PixelData on disk, so get_pixel_memmap() can map it.
+    :param file_path: path to the DICOM file
+    :return: the FileDataset, or None if the file can not be read
+    """
+    return read_dicom_file(file_path, defer_size=DEFER_SIZE)
+
+def get_pixel_memmap(ds):
+    """
+    Returns the pixel data of a dataset as a read-only np.memmap view of its file, with the
+    same dtype and shape as ds.pixel_array. Only possible when the dataset came from a file
+    with an uncompressed little endian transfer syntax and PixelData has not been loaded
+    or changed in memory.
+    :param ds: DICOM dataset, usually from read_dicom_file_mapped()
+    :return: the np.memmap view, or None if the pixel data can not be memory mapped
+    """
+    if "PixelData" not in ds:
+        return None
+
+    # a RawDataElement has not been converted (or changed) since it was read,
+    # so the value on disk at value_tell is still the dataset's pixel data.
+    # ds.get_item() would read a deferred value, so the element dict is used directly
+    elem = ds._dict.get(PIXEL_DATA_TAG)  # pylint: disable=protected-access
+    if not isinstance(elem, RawDataElement) or elem.length == UNDEFINED_LENGTH:
+        return None
+
+    file_path = getattr(ds, "filename", None)
+    if not isinstance(file_path, (str, os.PathLike)) or not os.path.isfile(file_path):
+        return None
+
+    file_meta = getattr(ds, "file_meta", None)
+    transfer_syntax = file_meta.get("TransferSyntaxUID", None) if file_meta else None
+    if transfer_syntax not in MEMMAP_TRANSFER_SYNTAXES:
+        return None
+
+    # 1 bit data is packed and YBR_FULL_422 is resampled by pydicom, neither is a plain view
+    if ds.get("BitsAllocated", 0) not in (8, 16, 32, 64):
+        return None
+    if ds.get("PhotometricInterpretation", "") == "YBR_FULL_422":
+        return None
+
+    try:
+        expected_length = get_expected_length(ds)
+        if expected_length == 0 or expected_length > elem.length:
+            logger.warning("PixelData in %s is shorter than expected", file_path)
+            return None
+
+        dtype = pixel_dtype(ds)
+        pixels = np.memmap(
+            file_path,
+            dtype=dtype,
+            mode="r",
+            offset=elem.value_tell,
+            shape=(expected_length // dtype.itemsize,),
+        )
+        return reshape_pixel_array(ds, pixels)
+    except (AttributeError, ValueError, NotImplementedError, OSError) as e:
+        logger.warning("Could not memory map pixel data in %s: %s", file_path, str(e))
+        return None
@@ -0,0 +1,113 @@
+""" Class to Store the Pseudonyms given to Patient IDs """
+import logging
+import pathlib
+import sqlite3
+import uuid
+
+logger = logging.getLogger(__name__)  # Starting Logger
+
+
+class PseudonymModel:
+    """
+    class to keep the namespace pseudonyms are made from and the
+    mapping of each original PatientID to its pseudonym
+    """
+    # Return Codes:
+    #   True or Value indicates ran correctly
+    #   exception indicates operational Error
+
+    def __init__(self, database_path: pathlib.Path, database_name: str):
+        """ Initializing the database connection/creating database """
+        logger.info("Initializing the pseudonym connection/creating database")
+        self.database_location: pathlib.Path = database_path / database_name
+        # sqlite3 does not like taking a pathlib.Path object as an input
+        self.posix_database_location: str = self.database_location.as_posix()
+        logger.debug("database location: %s", self.posix_database_location)
+
+        self.create_table()
+        logger.info("Pseudonym connection successful")
+
+    def create_table(self) -> bool:
+        """ Creating tables in database"""
+        logger.info("Creating pseudonym tables in database")
+        try:
+            with sqlite3.connect(self.posix_database_location) as base:
+                # a single row, the same namespace always gives the same pseudonyms
+                base.execute(
+                    "CREATE TABLE IF NOT EXISTS pseudonym_namespace ("
+                    "id INTEGER PRIMARY KEY CHECK (id = 1), "
+                    "namespace TEXT NOT NULL"
+                    ")"
+                )
+                base.execute(
+                    "CREATE TABLE IF NOT EXISTS pseudonym_map ("
+                    "patient_id TEXT PRIMARY KEY, "
+                    "pseudonym TEXT NOT NULL UNIQUE"
+                    ")"
+                )
+            logger.info("Tables created successfully")
+            return True
+        except sqlite3.OperationalError as error:
+            logger.error("Tables did not get created: %s", error)
+            raise sqlite3.OperationalError from error
+
+    def get_namespace(self) -> uuid.UUID:
+        """
+        Getting the namespace pseudonyms are made from, a random
+        one is created and kept the first time it is asked for
+        """
+        logger.info("Getting pseudonym namespace from database")
+        try:
+            with sqlite3.connect(self.posix_database_location) as base:
+                # OR IGNORE so two runs starting at once end up with the same namespace
+                base.execute(
+                    "INSERT OR IGNORE INTO pseudonym_namespace(id, namespace) VALUES (1, ?)",
+                    [str(uuid.uuid4())]
+                )
+                (namespace,) = base.execute(
+                    "SELECT namespace FROM pseudonym_namespace WHERE id = 1"
+                ).fetchone()
+        except sqlite3.OperationalError as error:
+            logger.error("Namespace not fetched from database")
+            raise sqlite3.OperationalError from error
+        return uuid.UUID(namespace)
+
+    def add_mappings(self, entries: list[tuple[str, str]]) -> bool:
+        """
+        Adding (patient_id, pseudonym) pairs in one transaction,
+        pairs that are already kept are left as they are
+        """
+        logger.info("Adding %d pseudonym mappings", len(entries))
+        try:
+            with sqlite3.connect(self.posix_database_location) as base:
+                base.executemany(
+                    "INSERT OR IGNORE INTO pseudonym_map(patient_id, pseudonym) VALUES (?, ?)",
+                    entries
+                )
+            logger.info("Pseudonym mappings added successfully")
+            return True
+        except sqlite3.OperationalError as error:
+            logger.error("Pseudonym mappings not added")
+            raise sqlite3.OperationalError from error
+
+    def get_pseudonym(self, patient_id: str) -> str | None:
+        """ Getting the pseudonym of a PatientID, None if it has none """
+        return self._lookup(
+            "SELECT pseudonym FROM pseudonym_map WHERE patient_id = ?", patient_id
+        )
+
+    def get_patient_id(self, pseudonym: str) -> str | None:
+        """ Getting the original PatientID behind a pseudonym, None if unknown """
+        return self._lookup(
+            "SELECT patient_id FROM pseudonym_map WHERE pseudonym = ?", pseudonym
+        )
+
+    def _lookup(self, query: str, value: str) -> str | None:
+        """ Running a query for a single value """
+        try:
+            with sqlite3.connect(self.posix_database_location) as base:
+                row = base.execute(query, [value]).fetchone()
+        except sqlite3.OperationalError as error:
+            logger.error("Pseudonym mapping not fetched from database")
+            raise sqlite3.OperationalError from error
+        return row[0] if row is not None else None
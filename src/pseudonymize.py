@@ -0,0 +1,317 @@
+"""
+Command line pipeline that copies a folder tree of DICOM files, replacing the PatientID and
+PatientName of every file with a stable UUID pseudonym. extract_patient_info already shows
+UUID names as anonymized.
+
+Pseudonyms are uuid5(namespace, PatientID), with the namespace and the PatientID -> pseudonym
+mapping kept in a PseudonymModel, so a patient gets the same pseudonym in every run and a
+pseudonym can be traced back by whoever holds the database.
+
+Only the header of each file is parsed. Everything from the PixelData element on is copied
+through as raw bytes in fixed size blocks, so pixels are never decoded (compressed pixel data
+stays as it was encoded) and memory stays flat however large the files are. Files are
+handed to a process pool in chunks with only a few in flight, as in bulk_validate, so a large
+export is limited by disk I/O rather than the CPU.
+
+Usage: python -m src.pseudonymize <source> <destination> [--database mapping.db]
+                                  [--report report.jsonl] [--workers N]
+"""
+
+import argparse
+import json
+import logging
+import os
+import pathlib
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+from dataclasses import dataclass
+
+import pydicom
+from pydicom.errors import InvalidDicomError
+from pydicom.filereader import read_partial
+from pydicom.filewriter import dcmwrite
+from pydicom.uid import DeflatedExplicitVRLittleEndian
+
+from src.bulk_validate import configure_logging, iter_chunk_results
+from src.dicom_scanner import iter_dicom_paths
+from src.pseudonym_model import PseudonymModel
+from src.user_pref_controller import UserPrefController
+
+logger = logging.getLogger(__name__)  # Start logger
+
+# size of the blocks the pixel data is copied in
+COPY_BUFFER_SIZE = 1024 * 1024  # 1 MB
+
+# other attributes that identify the patient, removed rather than pseudonymized
+REMOVED_TAGS = [
+    "OtherPatientIDs",
+    "OtherPatientIDsSequence",
+    "OtherPatientNames",
+    "PatientAddress",
+    "PatientTelephoneNumbers",
+    "PatientMotherBirthName",
+]
+
+# elements a header-only read stops at, the same as pydicom's stop_before_pixels
+_PIXEL_DATA_TAGS = {0x7FE00010, 0x7FE00009, 0x7FE00008}
+
+# report status of each file
+PSEUDONYMIZED = "pseudonymized"
+FAILED = "failed"
+
+@dataclass
+class PseudonymizeSummary:
+    """
+    This class stores the totals of a pseudonymization run.
+    """
+    pseudonymized: int = 0
+    failed: int = 0
+    bytes_written: int = 0
+    elapsed: float = 0.0  # seconds
+
+    @property
+    def total(self) -> int:
+        """:return: number of files processed"""
+        return self.pseudonymized + self.failed
+
+    @property
+    def megabytes_per_second(self) -> float:
+        """:return: aggregate write throughput of the run"""
+        return self.bytes_written / 2 ** 20 / self.elapsed if self.elapsed > 0 else 0.0
+
+def pseudonym_for(namespace: uuid.UUID, patient_id: str) -> str:
+    """
+    :param namespace: namespace of the mapping, see PseudonymModel.get_namespace()
+    :param patient_id: original PatientID
+    :return: the pseudonym, the same for the same namespace and PatientID
+    """
+    return str(uuid.uuid5(namespace, patient_id))
+
+def pseudonymize_dataset(ds, pseudonym):
+    """
+    Replaces the patient identifiers of a dataset in place.
+    :param ds: dataset, header only or complete
+    :param pseudonym: replaces PatientID and PatientName
+    """
+    ds.PatientID = pseudonym
+    ds.PatientName = pseudonym
+    for keyword in REMOVED_TAGS:
+        if keyword in ds:
+            delattr(ds, keyword)
+    # group lengths are retired and would be wrong once the values above have changed
+    for tag in [tag for tag in ds.keys() if tag.element == 0]:
+        del ds[tag]
+    ds.PatientIdentityRemoved = "YES"
+    ds.DeidentificationMethod = "PatientID and PatientName replaced with UUID pseudonyms"
+
+def pseudonymize_file(source, destination, namespace) -> tuple[str, str]:
+    """
+    Writes a copy of a file with its patient identifiers replaced, the pixel data is copied
+    as raw bytes. The copy is written to a temporary file first, so an existing destination
+    is only ever replaced by a complete file.
+    :param source: path to the DICOM file
+    :param destination: path to write the copy to, its folder is created if missing
+    :param namespace: namespace of the pseudonyms
+    :raises InvalidDicomError: if the file is not DICOM
+    :raises ValueError: if the file has no PatientID or PatientName to pseudonymize
+    :return: (original PatientID, pseudonym)
+    """
+    destination = pathlib.Path(destination)
+    with open(source, "rb") as file:
+        ds = _read_header(file)
+        patient_id = str(ds.get("PatientID", "") or ds.get("PatientName", "")).strip()
+        if not patient_id:
+            raise ValueError("No PatientID or PatientName to pseudonymize")
+        pseudonym = pseudonym_for(namespace, patient_id)
+        pseudonymize_dataset(ds, pseudonym)
+
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        handle, temporary = tempfile.mkstemp(dir=destination.parent, suffix=".tmp")
+        try:
+            with os.fdopen(handle, "wb") as output:
+                dcmwrite(output, ds, write_like_original=True)
+                if not _is_deflated(ds):
+                    # the file is positioned at the PixelData element, which is written
+                    # the same way by the same transfer syntax
+                    shutil.copyfileobj(file, output, COPY_BUFFER_SIZE)
+            os.replace(temporary, destination)
+        except Exception:
+            pathlib.Path(temporary).unlink(missing_ok=True)
+            raise
+    return patient_id, pseudonym
+
+def _read_header(file):
+    """
+    Reads the elements before the pixel data, leaving the file positioned at the first
+    byte not parsed. A deflated file can only be inflated as a whole, so it is read in full.
+    """
+    try:
+        ds = read_partial(file, lambda tag, vr, length: tag in _PIXEL_DATA_TAGS)
+    except InvalidDicomError:
+        # files without a preamble and file meta, as read_dicom_file accepts
+        file.seek(0)
+        ds = read_partial(file, lambda tag, vr, length: tag in _PIXEL_DATA_TAGS, force=True)
+        if "SOPClassUID" not in ds:
+            raise
+    if _is_deflated(ds):
+        file.seek(0)
+        ds = pydicom.dcmread(file)
+    return ds
+
+def _is_deflated(ds) -> bool:
+    """True if the dataset was stored with the deflated transfer syntax"""
+    file_meta = getattr(ds, "file_meta", None)
+    return file_meta is not None and file_meta.get("TransferSyntaxUID") == (
+        DeflatedExplicitVRLittleEndian
+    )
+
+def _pseudonymize_entry(source, destination, namespace) -> dict:
+    """Pseudonymizes one file, turning errors into a failed report entry"""
+    try:
+        patient_id, pseudonym = pseudonymize_file(source, destination, namespace)
+    except Exception as e:
+        logger.debug("Could not pseudonymize %s: %s", source, e)
+        return {"path": str(source), "status": FAILED, "reason": str(e)}
+    return {
+        "path": str(source),
+        "status": PSEUDONYMIZED,
+        "output": str(destination),
+        "bytes": os.path.getsize(destination),
+        # only kept in the mapping table, never written to the report
+        "patient_id": patient_id,
+        "pseudonym": pseudonym,
+    }
+
+def _pseudonymize_chunk(pairs, namespace):
+    """Worker process entry point, pseudonymizes a chunk of (source, destination) pairs"""
+    return [_pseudonymize_entry(source, destination, namespace) for source, destination in pairs]
+
+def iter_pseudonymized(pairs, namespace, max_workers=None, chunksize=16):
+    """
+    Pseudonymizes files across a process pool, yielding entries as chunks complete.
+    Entries are not in the order of pairs.
+    :param pairs: iterable of (source, destination) paths, consumed lazily
+    :param namespace: namespace of the pseudonyms
+    :param max_workers: number of worker processes, defaults to the CPU count
+    :param chunksize: number of files sent to a worker at a time
+    :return: generator of entries with the path, status and the PatientID and pseudonym
+        (or the reason the file failed)
+    """
+    return iter_chunk_results(
+        _pseudonymize_chunk, pairs, namespace, max_workers=max_workers, chunksize=chunksize
+    )
+
+def pseudonymize_directory(
+        source, destination, pseudonym_model, report=None, max_workers=None, chunksize=16,
+        progress_every=1000
+):
+    """
+    Copies every DICOM file under source to the same relative path under destination with
+    its patient identifiers pseudonymized, keeping the mapping in pseudonym_model.
+    Files that can not be read are reported and not copied.
+    :param source: root of the folder tree
+    :param destination: folder to write the copies to, must not be inside source
+    :param pseudonym_model: PseudonymModel holding the namespace and mapping table
+    :param report: optional writable text file for a JSON-lines report without patient IDs
+    :param max_workers: number of worker processes
+    :param chunksize: number of files sent to a worker at a time
+    :param progress_every: log the running throughput after this many files
+    :raises ValueError: if destination is inside source
+    :return: the PseudonymizeSummary of the run
+    """
+    source = os.path.abspath(source)
+    destination = os.path.abspath(destination)
+    if os.path.commonpath([source, destination]) == source:
+        raise ValueError("The destination must not be inside the source folder")
+
+    namespace = pseudonym_model.get_namespace()
+    pairs = (
+        (path, os.path.join(destination, os.path.relpath(path, source)))
+        for path in iter_dicom_paths(source)
+    )
+    summary = PseudonymizeSummary()
+    mappings = {}
+    start = time.perf_counter()
+    for entry in iter_pseudonymized(pairs, namespace, max_workers, chunksize):
+        if entry["status"] == PSEUDONYMIZED:
+            summary.pseudonymized += 1
+            summary.bytes_written += entry["bytes"]
+            mappings[entry.pop("patient_id")] = entry.pop("pseudonym")
+        else:
+            summary.failed += 1
+        if report is not None:
+            report.write(json.dumps(entry) + "\n")
+        if progress_every and summary.total % progress_every == 0:
+            pseudonym_model.add_mappings(list(mappings.items()))
+            mappings.clear()
+            summary.elapsed = time.perf_counter() - start
+            logger.info("%d files, %.1f MB/s", summary.total, summary.megabytes_per_second)
+    pseudonym_model.add_mappings(list(mappings.items()))
+    summary.elapsed = time.perf_counter() - start
+    return summary
+
+def main(argv=None):
+    """
+    Command line entry point.
+    :param argv: arguments, defaults to sys.argv
+    :raises SystemExit: on bad arguments
+    :return: exit code, 0 if every file was pseudonymized, 1 if any failed
+    """
+    parser = argparse.ArgumentParser(
+        description="Copy a DICOM folder tree with patient identifiers replaced by pseudonyms."
+    )
+    parser.add_argument("source", help="root of the folder tree to pseudonymize")
+    parser.add_argument("destination", help="folder to write the pseudonymized copies to")
+    parser.add_argument(
+        "--database",
+        default=None,
+        help="SQLite file for the namespace and mapping table (default: the user preferences "
+             "database in ~/.onko)",
+    )
+    parser.add_argument(
+        "--report", default=None, help="JSON-lines report to write, '-' for stdout"
+    )
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes")
+    parser.add_argument(
+        "--chunksize", type=int, default=16, help="files sent to a worker at a time"
+    )
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.source):
+        parser.error(f"{args.source} is not a directory")
+    source = os.path.abspath(args.source)
+    if os.path.commonpath([source, os.path.abspath(args.destination)]) == source:
+        parser.error("the destination must not be inside the source folder")
+
+    if args.database is None:
+        pseudonym_model = UserPrefController().create_pseudonym_model()
+    else:
+        database = pathlib.Path(args.database)
+        pseudonym_model = PseudonymModel(database.parent, database.name)
+
+    configure_logging(__name__)
+    if args.report is None or args.report == "-":
+        report = sys.stdout if args.report == "-" else None
+        summary = pseudonymize_directory(
+            args.source, args.destination, pseudonym_model, report, args.workers, args.chunksize
+        )
+    else:
+        with open(args.report, "w", encoding="utf-8") as report:
+            summary = pseudonymize_directory(
+                args.source, args.destination, pseudonym_model, report, args.workers,
+                args.chunksize
+            )
+
+    print(
+        f"{summary.total} files in {summary.elapsed:.1f}s "
+        f"({summary.megabytes_per_second:.1f} MB/s): "
+        f"{summary.pseudonymized} pseudonymized, {summary.failed} failed",
+        file=sys.stderr,
+    )
+    return 0 if summary.failed == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,25 +1,100 @@
 """
 provides a read_dicom_file() function that takes a file path to a dicom file, checks if the
 file is valid, and returns the FileDataset object. If the file is not valid it will return None.
+
+The file can also be read header-only (everything up to the PixelData element, or only an
+explicit list of tags) so it can be validated cheaply, with load_pixel_data() filling in the
+pixel data later if the file is actually going to be displayed.
+
+Functions that look at a dataset declare the tags they use with @requires_tags, and
+tag_union() of those functions is what a header-only read needs. A read of specific tags stops
+at the first element past the largest one, so private sequences and pixel data further on in
+the file are never parsed.
 """
 
+import copy
 import logging
 import os
 import pydicom
 from pydicom.errors import InvalidDicomError
+from pydicom.filereader import read_partial
+from pydicom.misc import size_in_bytes
+from pydicom.tag import Tag
+from src.dicom_cache import file_cache_key
 
 logger = logging.getLogger(__name__)  # Start logger
 
-def read_dicom_file(file_path):
-    """Read a DICOM file, return None if invalid or empty."""
+# Element values larger than this are left on disk until they are accessed
+DEFER_SIZE = "1 KB"
+
+# the PixelData element (and the float/double float variants after it) ends every header read
+PIXEL_DATA_GROUP = 0x7FE0
+
+def requires_tags(*keywords):
+    """
+    Decorator that declares the DICOM keywords a function reads from a dataset, as the
+    function's required_tags attribute, so callers can read just those from the file.
+    :param keywords: DICOM keywords, e.g. "PatientName"
+    :return: the decorator, which returns the function itself
+    """
+    def decorate(function):
+        function.required_tags = tuple(keywords)
+        return function
+    return decorate
+
+def tag_union(*consumers) -> list[str]:
+    """
+    :param consumers: functions declared with @requires_tags, or lists of keywords
+    :return: every keyword the consumers need, in the order first seen and without repeats
+    """
+    keywords = []
+    for consumer in consumers:
+        keywords.extend(getattr(consumer, "required_tags", consumer))
+    return list(dict.fromkeys(keywords))
+
+def read_dicom_file(
+        file_path,
+        stop_before_pixels=False,
+        specific_tags=None,
+        defer_size=None,
+        cache=None
+):
+    """
+    Read a DICOM file, return None if invalid or empty.
+    :param file_path: path to the DICOM file
+    :param stop_before_pixels: if True, stop reading before the PixelData element
+    :param specific_tags: optional list of tags/keywords, only these are read from the file
+    :param defer_size: values larger than this are only read from the file when accessed
+    :param cache: optional DicomCache, a dataset read the same way from the unchanged file is reused
+    :return: the FileDataset, or None if the file can not be read
+    """
+    if cache is None:
+        return _read_dicom_file(file_path, stop_before_pixels, specific_tags, defer_size)
+
+    key = file_cache_key(
+        file_path,
+        "dataset",
+        stop_before_pixels,
+        tuple(specific_tags) if specific_tags is not None else None,
+        defer_size,
+    )
+    dicom_file = cache.get(key)
+    if dicom_file is None:
+        dicom_file = _read_dicom_file(file_path, stop_before_pixels, specific_tags, defer_size)
+        if dicom_file is not None:
+            cache.put(key, dicom_file)
+    return dicom_file
+
+def _read_dicom_file(file_path, stop_before_pixels, specific_tags, defer_size):
+    """Reads the file for read_dicom_file(), without the cache"""
     try:
         # Check for empty file first
         if os.path.getsize(file_path) == 0:
             logger.warning("Empty file: %s", file_path)
             return None
-            
+
         # Try standard read
-        dicom_file = pydicom.dcmread(file_path)
+        dicom_file = _dcmread(file_path, stop_before_pixels, specific_tags, defer_size)
 
         logger.info("Successfully read DICOM file: %s", file_path)
         return dicom_file
@@ -31,8 +106,14 @@ def read_dicom_file(file_path):
     except InvalidDicomError as e:
         logger.warning("File %s is not a valid DICOM part 10 file: %s", file_path, str(e))
         try:
+            # SOPClassUID is needed below to check the force-read file
+            if specific_tags is not None:
+                specific_tags = [*specific_tags, "SOPClassUID"]
+
             # Try force-reading
-            dicom_file = pydicom.dcmread(file_path, force=True)
+            dicom_file = _dcmread(
+                file_path, stop_before_pixels, specific_tags, defer_size, force=True
+            )
 
             # Check if file  has a required attribute
             if not hasattr(dicom_file, 'SOPClassUID'):
@@ -49,3 +130,86 @@ def read_dicom_file(file_path):
         logger.error("Unexpected error reading %s: %s", file_path, str(e))
         return None
 
+def _dcmread(file_path, stop_before_pixels, specific_tags, defer_size, force=False):
+    """
+    pydicom.dcmread(), except a read of specific tags stops after the largest of them instead
+    of walking (and parsing undefined length sequences) to the end of the file.
+    """
+    if specific_tags is None:
+        return pydicom.dcmread(
+            file_path,
+            stop_before_pixels=stop_before_pixels,
+            defer_size=defer_size,
+            force=force,
+        )
+
+    specific_tags = [Tag(tag) for tag in specific_tags]
+    last_tag = max(specific_tags, default=Tag(0))
+
+    def stop_when(tag, vr, length):
+        return tag > last_tag or (stop_before_pixels and tag.group == PIXEL_DATA_GROUP)
+
+    with open(file_path, "rb") as file:
+        return read_partial(
+            file,
+            stop_when,
+            defer_size=size_in_bytes(defer_size),
+            force=force,
+            specific_tags=specific_tags,
+        )
+
+def read_dicom_header(file_path, specific_tags=None, cache=None):
+    """
+    Read only the header of a DICOM file (everything before PixelData).
+    :param file_path: path to the DICOM file
+    :param specific_tags: optional list of tags/keywords to restrict the read to
+    :param cache: optional DicomCache to reuse a previously read header
+    :return: the FileDataset without pixel data, or None if the file can not be read
+    """
+    return read_dicom_file(
+        file_path,
+        stop_before_pixels=True,
+        specific_tags=specific_tags,
+        cache=cache
+    )
+
+def load_pixel_data(ds, cache=None):
+    """
+    Fills in the elements (including PixelData) that were skipped when the dataset
+    was read with read_dicom_header(). Large values are deferred, so PixelData is only
+    read (or memory mapped) once it is used.
+    Neither ds nor the cached full dataset is changed, both may be shared through the
+    cache, so the elements are merged into a copy of their own.
+    :param ds: dataset previously read from a file
+    :param cache: optional DicomCache to reuse a previously read dataset
+    :return: a dataset with pixel data (ds itself if it already had it), or None if the
+        file can not be re-read
+    """
+    if "PixelData" in ds:
+        return ds
+
+    file_path = getattr(ds, "filename", None)
+    if not isinstance(file_path, (str, os.PathLike)):
+        logger.error("Can not load pixel data, dataset has no file name")
+        return None
+
+    full_ds = read_dicom_file(file_path, defer_size=DEFER_SIZE, cache=cache)
+    if full_ds is None:
+        return None
+
+    # keep anything already on the dataset, only add what was skipped.
+    # items() gives the unconverted elements so deferred values stay on disk
+    merged = _shallow_copy(full_ds)
+    merged.update(ds)
+
+    logger.info("Loaded pixel data for %s", file_path)
+    return merged
+
+def _shallow_copy(ds):
+    """
+    Copy of a dataset with an element dict of its own, so elements added to it, or converted
+    and read from disk when it is accessed, never show up on the original
+    """
+    copied = copy.copy(ds)
+    copied._dict = dict(ds._dict)  # pylint: disable=protected-access
+    return copied
@@ -0,0 +1,79 @@
+"""
+Reusable display buffers for rendering frames to QImages. A RenderTarget owns one uint8 buffer per
+viewport size and a QImage that views it, every render writes into the buffer in place with NumPy
+out= operations, so scrolling through frames of the same size allocates nothing and the QImage
+can never outlive the memory it points at.
+"""
+
+import logging
+from collections import OrderedDict
+
+import numpy as np
+from PySide6.QtGui import QImage
+
+logger = logging.getLogger(__name__)  # Start logger
+
+# viewport sizes kept per target, e.g. full resolution and a drag preview
+MAX_SIZES = 4
+
+class RenderTarget:
+    """
+    A uint8 display buffer per frame size and the QImage over it. The QImage is only valid until
+    the next render of the same size, copy it (e.g. QPixmap.fromImage) before rendering again.
+    A target must only be rendered into by one thread at a time.
+    """
+    def __init__(self, max_sizes=MAX_SIZES):
+        """
+        :param max_sizes: number of sizes kept, the least recently used size is dropped above it
+        """
+        self.max_sizes = max_sizes
+        self._buffers = OrderedDict()  # (rows, columns) -> (uint8 buffer, QImage over it)
+        self._scratch = {}  # (rows, columns) -> float32 buffer for normalized input
+
+    def buffer(self, shape) -> np.ndarray:
+        """
+        :param shape: (rows, columns) of the frame
+        :return: the uint8 buffer for frames of this size, allocated on first use
+        """
+        return self._entry(tuple(shape))[0]
+
+    def image(self, shape) -> QImage:
+        """
+        :param shape: (rows, columns) of the frame
+        :return: the QImage that shows the buffer for this size
+        """
+        return self._entry(tuple(shape))[1]
+
+    def render(self, array) -> QImage:
+        """
+        Writes a 2D frame into the buffer of its size.
+        :param array: uint8 display values, or values normalized to [0, 1]
+        :return: the QImage of the buffer
+        """
+        shape = array.shape
+        out = self.buffer(shape)
+        if array.dtype == np.uint8:
+            np.copyto(out, array)
+        else:
+            if (scratch := self._scratch.get(shape)) is None:
+                scratch = self._scratch[shape] = np.empty(shape, dtype=np.float32)
+            np.multiply(array, 255, out=scratch, casting="unsafe")
+            np.clip(scratch, 0, 255, out=scratch)
+            np.copyto(out, scratch, casting="unsafe")
+        return self.image(shape)
+
+    def _entry(self, shape):
+        """Looks up or allocates the buffer and QImage for a size"""
+        entry = self._buffers.get(shape)
+        if entry is None:
+            rows, columns = shape
+            buffer = np.empty(shape, dtype=np.uint8)
+            image = QImage(buffer.data, columns, rows, columns, QImage.Format_Grayscale8)
+            entry = self._buffers[shape] = (buffer, image)
+            logger.debug("Allocated %s render buffer", shape)
+            while len(self._buffers) > self.max_sizes:
+                dropped, _ = self._buffers.popitem(last=False)
+                self._scratch.pop(dropped, None)
+        else:
+            self._buffers.move_to_end(shape)
+        return entry
@@ -0,0 +1,186 @@
+"""
+Streams a series of single-frame files into one preallocated (n_slices, rows, cols) volume.
+Slices are decoded in parallel and normalized straight into their place in the volume, so no
+list of per-slice arrays is built and np.stack is never needed (which doubles peak memory on
+1,000-slice CTs). Progress is yielded as each slice lands.
+
+stream_compact_series_volume() keeps the slices in their stored dtype instead (see
+compact_volume.py), half the memory of float32 for 16-bit data, with an optional memory cap.
+
+Uncompressed slices are memory mapped and read in a thread pool. Compressed series are decoded
+in a process pool instead (see parallel_decode.py), as pydicom's decoders hold the GIL.
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+from src.compact_volume import CompactVolume
+from src.dicom_volume import MultiFrameVolume
+from src.inputs_and_outputs import normalize_pixel_array
+from src.parallel_decode import decode_file, frame_layout, is_compressed, iter_decoded_chunks
+from src.pixel_memmap import read_dicom_file_mapped
+from src.read_dicom_file import read_dicom_header
+from src.window_level import rescale_from_dataset
+
+logger = logging.getLogger(__name__)  # Start logger
+
+# header elements needed to size the volume and pick how to decode it
+HEADER_TAGS = [
+    "Rows",
+    "Columns",
+    "SamplesPerPixel",
+    "BitsAllocated",
+    "PixelRepresentation",
+    "RescaleSlope",
+    "RescaleIntercept",
+]
+
+def stream_series_volume(paths, max_workers=None):
+    """
+    Generator that decodes each file of a series in a thread pool (a process pool if the first
+    file is compressed) and writes its normalized pixels into a preallocated float32 volume.
+    Closing the generator early cancels the slices that have not started yet.
+    :param paths: file paths in slice order, e.g. from a dicom_scanner SeriesIndex
+    :param max_workers: number of decode threads or processes, defaults to the executor's default
+    :raises ValueError: if a file can not be read or its size does not match the first slice
+    :return: generator of (volume, slices_loaded, total_slices), the same volume every time
+    """
+    paths = [str(path) for path in paths]
+    header = _read_series_header(paths)
+    volume = np.empty((len(paths), int(header.Rows), int(header.Columns)), dtype=np.float32)
+    logger.info("Loading %d slices into a %s volume", len(paths), volume.shape)
+
+    if is_compressed(header):
+        yield from _stream_compressed_slices(paths, header, volume, max_workers)
+        return
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        futures = [
+            executor.submit(_load_slice, path, volume, index)
+            for index, path in enumerate(paths)
+        ]
+        for loaded, future in enumerate(as_completed(futures), start=1):
+            future.result()  # re-raises any error from the slice
+            yield volume, loaded, len(paths)
+    finally:
+        # stops queued slices if the caller stops early or a slice failed
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def stream_compact_series_volume(paths, max_workers=None, max_bytes=None, scratch_dir=None):
+    """
+    Generator that decodes each file of a series like stream_series_volume(), but keeps the
+    stored values and the rescale of each slice in a CompactVolume instead of normalizing them.
+    :param paths: file paths in slice order, e.g. from a dicom_scanner SeriesIndex
+    :param max_workers: number of decode threads or processes, defaults to the executor's default
+    :param max_bytes: slices kept in RAM at most, older ones are spilled to a scratch file
+    :param scratch_dir: folder for the scratch file, defaults to the system temp folder
+    :raises ValueError: if a file can not be read or its size does not match the first slice
+    :return: generator of (volume, slices_loaded, total_slices), the same volume every time
+    """
+    paths = [str(path) for path in paths]
+    header = _read_series_header(paths)
+    frame_shape, dtype = frame_layout(header)
+    volume = CompactVolume(
+        len(paths), frame_shape, dtype, rescale=rescale_from_dataset(header),
+        max_bytes=max_bytes, scratch_dir=scratch_dir, paths=paths,
+    )
+    logger.info("Loading %d slices into a %s %s volume", len(paths), volume.shape, volume.dtype)
+
+    if is_compressed(header):
+        # compressed slices are decoded in other processes, which send back each one's rescale
+        loaded = 0
+        for positions, frames, rescales in iter_decoded_chunks(
+                decode_file, paths, frame_shape, dtype, max_workers
+        ):
+            for index, pixels, rescale in zip(positions, frames, rescales):
+                volume.set_frame(index, pixels, rescale)
+                loaded += 1
+                yield volume, loaded, len(paths)
+        return
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        futures = [
+            executor.submit(_read_native_slice, path, index)
+            for index, path in enumerate(paths)
+        ]
+        for loaded, future in enumerate(as_completed(futures), start=1):
+            index, pixels, rescale = future.result()  # re-raises any error from the slice
+            volume.set_frame(index, pixels, rescale)
+            yield volume, loaded, len(paths)
+    finally:
+        # stops queued slices if the caller stops early or a slice failed
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def load_series_volume(paths, max_workers=None):
+    """
+    Loads a whole series into a volume, see stream_series_volume()
+    :param paths: file paths in slice order
+    :param max_workers: number of decode threads
+    :return: the (n_slices, rows, cols) float32 volume
+    """
+    volume = None
+    for volume, _, _ in stream_series_volume(paths, max_workers=max_workers):
+        pass
+    return volume
+
+def load_compact_series_volume(paths, max_workers=None, max_bytes=None, scratch_dir=None):
+    """
+    Loads a whole series into a CompactVolume, see stream_compact_series_volume()
+    :param paths: file paths in slice order
+    :param max_workers: number of decode threads or processes
+    :param max_bytes: slices kept in RAM at most
+    :param scratch_dir: folder for the scratch file
+    :return: the CompactVolume of stored values
+    """
+    volume = None
+    for volume, _, _ in stream_compact_series_volume(
+            paths, max_workers=max_workers, max_bytes=max_bytes, scratch_dir=scratch_dir
+    ):
+        pass
+    return volume
+
+def _read_series_header(paths):
+    """The size of the volume comes from the first header, nothing is decoded yet"""
+    if not paths:
+        raise ValueError("A series volume needs at least one file")
+    header = read_dicom_header(paths[0], specific_tags=HEADER_TAGS)
+    if header is None or "Rows" not in header or "Columns" not in header:
+        raise ValueError(f"Could not read the image size from {paths[0]}")
+    return header
+
+def _read_native_slice(path, index):
+    """Maps or decodes one file, its stored values are copied into the volume by the caller"""
+    ds = read_dicom_file_mapped(path)
+    if ds is None:
+        raise ValueError(f"Could not read slice {index} from {path}")
+    return index, MultiFrameVolume(ds).get_frame(0), rescale_from_dataset(ds)
+
+def _stream_compressed_slices(paths, header, volume, max_workers):
+    """Decodes compressed slices across processes and normalizes each chunk as it arrives"""
+    frame_shape, dtype = frame_layout(header)
+    if frame_shape != volume.shape[1:]:
+        raise ValueError(f"Expected grayscale slices of {volume.shape[1:]}, got {frame_shape}")
+    loaded = 0
+    for positions, frames, _ in iter_decoded_chunks(
+            decode_file, paths, frame_shape, dtype, max_workers
+    ):
+        for index, pixels in zip(positions, frames):
+            normalize_pixel_array(pixels, out=volume[index])
+            loaded += 1
+            yield volume, loaded, len(paths)
+
+def _load_slice(path, volume, index):
+    """Decodes one file and normalizes it in place into volume[index]"""
+    ds = read_dicom_file_mapped(path)
+    if ds is None:
+        raise ValueError(f"Could not read slice {index} from {path}")
+    pixels = MultiFrameVolume(ds).get_frame(0)
+    if pixels.shape != volume.shape[1:]:
+        raise ValueError(
+            f"Slice {index} in {path} is {pixels.shape}, expected {volume.shape[1:]}"
+        )
+    normalize_pixel_array(pixels, out=volume[index])
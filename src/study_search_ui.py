@@ -0,0 +1,164 @@
+"""
+Dialog to find a study in the metadata index by modality, sex, birth date range, StudyID or
+part of the StudyDescription, without opening any DICOM file. Double clicking a study (or
+Open) emits study_selected with the path of one of its files, which the viewer then opens.
+"""
+
+import logging
+from datetime import datetime
+
+from PySide6 import QtWidgets
+from PySide6.QtCore import QThreadPool, Qt, Signal
+
+from src.dicom_loader import Worker, index_directory
+
+logger = logging.getLogger(__name__)  # Start logger
+
+class StudySearchDialog(QtWidgets.QDialog):
+    """Searches a MetadataIndexModel and lists one line per matching study"""
+    study_selected = Signal(str)  # path of a file of the chosen study
+    sex_choices = ["Any", "M", "F", "O"]
+    max_results = 500
+
+    def __init__(self, metadata_index, thread_pool=None, parent=None):
+        """
+        :param metadata_index: MetadataIndexModel to search and to index folders into
+        :param thread_pool: QThreadPool to index folders on, defaults to the global one
+        :param parent: parent widget
+        """
+        super().__init__(parent)
+        self.setWindowTitle("Find Study")
+        self.metadata_index = metadata_index
+        self.thread_pool = thread_pool if thread_pool is not None else QThreadPool.globalInstance()
+        self.index_worker = None  # the Worker indexing a folder, if any
+
+        self.modality = QtWidgets.QLineEdit()
+        self.modality.setPlaceholderText("e.g. CT")
+        self.sex = QtWidgets.QComboBox()
+        self.sex.addItems(self.sex_choices)
+        self.born_from = QtWidgets.QLineEdit()
+        self.born_from.setPlaceholderText("YYYYMMDD")
+        self.born_to = QtWidgets.QLineEdit()
+        self.born_to.setPlaceholderText("YYYYMMDD")
+        self.study_id = QtWidgets.QLineEdit()
+        self.description = QtWidgets.QLineEdit()
+        self.description.setPlaceholderText("any part of the study description")
+
+        form = QtWidgets.QFormLayout()
+        form.addRow("Modality:", self.modality)
+        form.addRow("Sex:", self.sex)
+        form.addRow("Born from:", self.born_from)
+        form.addRow("Born to:", self.born_to)
+        form.addRow("Study ID:", self.study_id)
+        form.addRow("Description:", self.description)
+        for line_edit in (self.modality, self.born_from, self.born_to, self.study_id,
+                          self.description):
+            line_edit.returnPressed.connect(self.search)
+
+        self.results = QtWidgets.QListWidget()
+        self.results.itemDoubleClicked.connect(self.open_item)
+        self.status = QtWidgets.QLabel()
+
+        search_button = QtWidgets.QPushButton("Search")
+        search_button.setDefault(True)
+        search_button.clicked.connect(self.search)
+        self.index_button = QtWidgets.QPushButton("Index Folder...")
+        self.index_button.clicked.connect(self.choose_folder)
+        open_button = QtWidgets.QPushButton("Open")
+        open_button.clicked.connect(lambda: self.open_item(self.results.currentItem()))
+        button_layout = QtWidgets.QHBoxLayout()
+        button_layout.addWidget(self.index_button)
+        button_layout.addStretch()
+        button_layout.addWidget(search_button)
+        button_layout.addWidget(open_button)
+
+        layout = QtWidgets.QVBoxLayout()
+        layout.addLayout(form)
+        layout.addWidget(self.results)
+        layout.addWidget(self.status)
+        layout.addLayout(button_layout)
+        self.setLayout(layout)
+
+    def filters(self):
+        """The find_studies keyword arguments of the filled in fields"""
+        sex = self.sex.currentText()
+        return {
+            "modality": self.modality.text().strip() or None,
+            "sex": sex if sex != "Any" else None,
+            "birth_date_from": _parse_date(self.born_from.text()),
+            "birth_date_to": _parse_date(self.born_to.text()),
+            "study_id": self.study_id.text().strip() or None,
+            "description": self.description.text().strip() or None,
+        }
+
+    def search(self):
+        """Lists the studies matching the fields, the index answers without opening files"""
+        try:
+            filters = self.filters()
+        except ValueError:
+            self.status.setText("Birth dates must be written as YYYYMMDD")
+            return
+        studies = self.metadata_index.find_studies(**filters, limit=self.max_results)
+        self.results.clear()
+        for record in studies:
+            birth_date = record.birth_date.isoformat() if record.birth_date else "Unknown"
+            item = QtWidgets.QListWidgetItem(
+                f"{record.family_name}, {record.given_name}  ({record.sex}, {birth_date})  "
+                f"{record.modality}  Study {record.study_id}: {record.study_description}"
+            )
+            item.setData(Qt.UserRole, record.path)
+            self.results.addItem(item)
+        self.status.setText(f"{len(studies)} studies found")
+
+    def open_item(self, item):
+        """Hands the path of the chosen study to the viewer and closes the dialog"""
+        if item is None:
+            return
+        self.study_selected.emit(item.data(Qt.UserRole))
+        self.accept()
+
+    def choose_folder(self):
+        """Asks for a folder and adds its headers to the index on a worker thread"""
+        directory = QtWidgets.QFileDialog.getExistingDirectory(self, "Select Folder to Index")
+        if directory.strip() == "":
+            return
+        worker = Worker(index_directory, directory, self.metadata_index)
+        worker.signals.finished.connect(self.folder_indexed)
+        worker.signals.failed.connect(self.indexing_failed)
+        self.index_worker = worker
+        self.index_button.setEnabled(False)
+        self.status.setText(f"Indexing {directory}...")
+        self.thread_pool.start(worker)
+
+    def folder_indexed(self, studies):
+        """Called on the GUI thread once index_directory has finished"""
+        self.index_worker = None
+        self.index_button.setEnabled(True)
+        self.status.setText(f"Indexed {studies} studies")
+        self.search()
+
+    def indexing_failed(self, message):
+        """Called on the GUI thread when index_directory raised an error"""
+        self.index_worker = None
+        self.index_button.setEnabled(True)
+        logger.error("Could not index folder: %s", message)
+        self.status.setText(f"Could not index folder: {message}")
+
+    def done(self, result):
+        """
+        Closing the dialog cancels indexing that is still running and stops its result from
+        being delivered, the dialog is kept and can be shown again
+        """
+        if self.index_worker is not None:
+            self.index_worker.token.cancel()
+            self.index_worker.signals.finished.disconnect(self.folder_indexed)
+            self.index_worker.signals.failed.disconnect(self.indexing_failed)
+            self.index_worker = None
+            self.index_button.setEnabled(True)
+            self.status.setText("Indexing was cancelled")
+        super().done(result)
+
+def _parse_date(text):
+    """A YYYYMMDD date as typed into the dialog, None if it was left empty"""
+    text = text.strip()
+    return datetime.strptime(text, "%Y%m%d").date() if text else None
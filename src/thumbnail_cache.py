@@ -0,0 +1,143 @@
+"""
+On-disk store of small uint8 previews of DICOM instances, kept in a thumbnails folder inside
+the ~/.onko directory. Thumbnails are keyed by SOPInstanceUID + file mtime, both of which a
+dicom_scanner InstanceRecord already holds, so a series browser can paint thousands of studies
+from the store without opening a single DICOM file. A changed file gets a new thumbnail.
+"""
+
+import hashlib
+import logging
+import os
+import pathlib
+import tempfile
+
+import numpy as np
+
+from src.image_pyramid import block_mean
+from src.inputs_and_outputs import get_normalized_pixel_array
+from src.pixel_memmap import read_dicom_file_mapped
+
+logger = logging.getLogger(__name__)  # Start logger
+
+# longest side of a thumbnail in pixels
+THUMBNAIL_SIZE = 128
+
+def make_thumbnail(ds, size=THUMBNAIL_SIZE, frame=0) -> np.ndarray:
+    """
+    Normalizes one frame through get_normalized_pixel_array and shrinks it with a block mean.
+    :param ds: dataset with grayscale pixel data
+    :param size: longest side of the thumbnail, smaller frames are kept at their own size
+    :param frame: index of the frame to preview
+    :raises ValueError: if the frame is not 2D
+    :return: 2D uint8 array
+    """
+    pixels = get_normalized_pixel_array(ds, frame=frame)
+    if pixels.ndim != 2:
+        raise ValueError(f"Can only make thumbnails of 2D frames, got shape {pixels.shape}")
+    factor = max(-(-max(pixels.shape) // size), 1)
+    if factor > 1:
+        pixels = block_mean(pixels, factor)
+    # scaled and truncated the same way RenderTarget.render shows normalized frames
+    return np.clip(pixels * 255, 0, 255).astype(np.uint8)
+
+class ThumbnailCache:
+    """
+    Folder of .npy thumbnails, one per SOPInstanceUID, spread over subfolders so no single
+    folder holds every file. Writes are atomic so a browser can read while a scan writes.
+    """
+    def __init__(self, directory: pathlib.Path, size=THUMBNAIL_SIZE):
+        """
+        :param directory: folder to keep the thumbnails in, created if missing
+        :param size: longest side of new thumbnails in pixels
+        """
+        self.directory = pathlib.Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.size = size
+
+    def path_for(self, uid: str, mtime_ns: int) -> pathlib.Path:
+        """
+        :param uid: SOPInstanceUID of the instance
+        :param mtime_ns: mtime of the file the instance is stored in
+        :return: where the thumbnail is kept
+        """
+        # named by a hash of the UID, which comes from the file, so a UID such as '../../x'
+        # can not point outside the folder or add wildcards to the stale glob in put()
+        name = hashlib.sha1(str(uid).strip("\0 ").encode()).hexdigest()
+        return self.directory / name[:2] / f"{name}_{int(mtime_ns)}.npy"
+
+    def get(self, uid: str, mtime_ns: int) -> np.ndarray | None:
+        """
+        :param uid: SOPInstanceUID of the instance
+        :param mtime_ns: mtime of the file the instance is stored in
+        :return: the thumbnail, or None if there is none for this version of the file
+        """
+        try:
+            return np.load(self.path_for(uid, mtime_ns), allow_pickle=False)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, uid: str, mtime_ns: int, thumbnail: np.ndarray) -> None:
+        """
+        Stores a thumbnail, replacing the thumbnails of older versions of the file.
+        :param uid: SOPInstanceUID of the instance
+        :param mtime_ns: mtime of the file the instance is stored in
+        :param thumbnail: 2D uint8 array
+        """
+        path = self.path_for(uid, mtime_ns)
+        path.parent.mkdir(exist_ok=True)
+        for stale in path.parent.glob(f"{path.name.rsplit('_', 1)[0]}_*.npy"):
+            if stale != path:
+                stale.unlink(missing_ok=True)
+        handle, temporary = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(handle, "wb") as file:
+                np.save(file, thumbnail, allow_pickle=False)
+            os.replace(temporary, path)
+        except OSError:
+            pathlib.Path(temporary).unlink(missing_ok=True)
+            raise
+
+    def get_or_create(self, file_path, uid=None, mtime_ns=None) -> np.ndarray | None:
+        """
+        Looks up the thumbnail of a file, opening the file only on a miss.
+        :param file_path: path to the DICOM file
+        :param uid: SOPInstanceUID if already known, e.g. from an InstanceRecord
+        :param mtime_ns: mtime of the file if already known
+        :return: the thumbnail, or None if the file has no readable 2D pixel data
+        """
+        if mtime_ns is None:
+            try:
+                mtime_ns = os.stat(file_path).st_mtime_ns
+            except OSError:
+                return None
+        if uid is not None and (thumbnail := self.get(uid, mtime_ns)) is not None:
+            return thumbnail
+
+        ds = read_dicom_file_mapped(file_path)
+        if ds is None or "PixelData" not in ds:
+            return None
+        try:
+            thumbnail = make_thumbnail(ds, self.size)
+        except (AttributeError, TypeError, ValueError) as e:
+            logger.warning("No thumbnail for %s: %s", file_path, e)
+            return None
+        uid = uid or ds.get("SOPInstanceUID", None)
+        if uid:
+            self.put(uid, mtime_ns, thumbnail)
+        return thumbnail
+
+    def for_record(self, record) -> np.ndarray | None:
+        """
+        :param record: InstanceRecord from dicom_scanner
+        :return: the thumbnail of the instance, see get_or_create()
+        """
+        return self.get_or_create(record.path, record.sop_instance_uid, record.mtime_ns)
+
+    def for_series(self, records) -> np.ndarray | None:
+        """
+        :param records: sorted InstanceRecords of one series from a SeriesIndex
+        :return: the thumbnail of the middle instance, which shows the series best
+        """
+        if not records:
+            return None
+        return self.for_record(records[len(records) // 2])
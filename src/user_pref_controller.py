@@ -10,6 +10,9 @@ import logging  # Logging what is happening in the code base
 
 from src.user_pref_interface import UserPrefInterface
 from src.user_pref_model import UserPrefModel  # accessing the database
+from src.metadata_index_model import MetadataIndexModel  # DICOM header cache
+from src.thumbnail_cache import ThumbnailCache  # series browser previews
+from src.pseudonym_model import PseudonymModel  # pseudonymization mapping
 
 logger = logging.getLogger(__name__)  # Starting logger
 
@@ -46,6 +49,9 @@ class UserPrefController(UserPrefInterface):
         )
         self.user: str = "default"  # Username for key
         self.database: UserPrefModel = None  # Database access
+        self.metadata_index: MetadataIndexModel = None  # DICOM header cache
+        self.thumbnail_cache: ThumbnailCache = None  # series browser previews
+        self.pseudonym_model: PseudonymModel = None  # pseudonymization mapping
         logger.info("Finish UserPreferences Database")
 
     # Overwritten From Abstract Class
@@ -141,6 +147,58 @@ class UserPrefController(UserPrefInterface):
         except sqlite3.OperationalError as error:
             raise sqlite3.OperationalError from error
 
+    def create_metadata_index(self) -> MetadataIndexModel:
+        """
+        Creating the metadata index table in the same database as the
+        user preferences, used by scan_directory to skip unchanged files
+        """
+        logger.info("START: Creating Metadata Index")
+        self.create_directory()
+        try:
+            if self.metadata_index is None:
+                self.metadata_index = MetadataIndexModel(
+                    database_path=self.db_location,
+                    database_name=self.database_name
+                )
+            logger.info("FINISH: Creating Metadata Index")
+        except sqlite3.OperationalError as error:
+            raise sqlite3.OperationalError from error
+        return self.metadata_index
+
+    def create_thumbnail_cache(self) -> ThumbnailCache:
+        """
+        Creating the thumbnail store in a thumbnails folder next to
+        the database, used by series browsers to paint without
+        opening the DICOM files
+        """
+        logger.info("START: Creating Thumbnail Cache")
+        self.create_directory()
+        if self.thumbnail_cache is None:
+            self.thumbnail_cache = ThumbnailCache(
+                self.db_location.joinpath("thumbnails")
+            )
+        logger.info("FINISH: Creating Thumbnail Cache")
+        return self.thumbnail_cache
+
+    def create_pseudonym_model(self) -> PseudonymModel:
+        """
+        Creating the pseudonym tables in the same database as the
+        user preferences, used by pseudonymize to give a patient
+        the same pseudonym in every run
+        """
+        logger.info("START: Creating Pseudonym Model")
+        self.create_directory()
+        try:
+            if self.pseudonym_model is None:
+                self.pseudonym_model = PseudonymModel(
+                    database_path=self.db_location,
+                    database_name=self.database_name
+                )
+            logger.info("FINISH: Creating Pseudonym Model")
+        except sqlite3.OperationalError as error:
+            raise sqlite3.OperationalError from error
+        return self.pseudonym_model
+
     def set_default_directory(self, path: pathlib.Path) -> bool:
         """
         Sets or changes the default directory in the database.
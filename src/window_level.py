@@ -0,0 +1,414 @@
+"""
+Window/level rendering of integer pixel data through a lookup table. The modality rescale
+(RescaleSlope/RescaleIntercept) and the VOI window (WindowCenter/WindowWidth) are folded into
+one uint8 table with an entry for every possible stored value, so rendering a frame is a single
+gather from the stored pixels straight to display bytes, with no float temporaries.
+Tables are cached per (stored dtype, window, rescale), so changing the window/level costs one
+table build and then one gather per frame.
+
+Without a stored window the frame is auto-windowed from robust percentiles of an integer
+histogram of its stored values (np.bincount, sampled on large frames), so a single hot pixel from
+metal or a burned-in annotation does not wash out the image. Histograms are cached per frame and
+can be added together for a window across a whole series.
+"""
+
+import logging
+from dataclasses import dataclass
+from functools import lru_cache
+
+import numpy as np
+from pydicom.multival import MultiValue
+
+from src.dicom_cache import file_cache_key
+from src.dicom_volume import MultiFrameVolume
+from src.image_pyramid import ImagePyramid
+from src.render_target import RenderTarget
+
+logger = logging.getLogger(__name__)  # Start logger
+
+# stored values wider than this are windowed arithmetically, their table would be too large
+MAX_LUT_BITS = 16
+
+# pixels looked up in the table at a time, which bounds the intp index copy np.take makes
+LUT_BLOCK_PIXELS = 64 * 1024
+
+# percentiles of the stored values that auto_window() maps to black and white
+AUTO_WINDOW_PERCENTILES = (0.5, 99.5)
+
+# frames with more pixels than this are sampled on a regular grid for their histogram
+HISTOGRAM_SAMPLE_PIXELS = 512 * 512
+
+# screen pixels of mouse drag that change the window by its own width
+DRAG_PIXELS_PER_WIDTH = 256
+
+@dataclass(frozen=True)
+class WindowLevel:
+    """
+    This class stores a VOI window in modality units (e.g. HU for CT).
+    """
+    center: float
+    width: float
+
+@dataclass(frozen=True)
+class Rescale:
+    """
+    This class stores the modality rescale, modality value = stored value * slope + intercept.
+    """
+    slope: float = 1.0
+    intercept: float = 0.0
+
+def rescale_from_dataset(ds) -> Rescale:
+    """
+    :param ds: DICOM dataset
+    :return: the Rescale of the dataset, identity if it has none
+    """
+    slope = ds.get("RescaleSlope", None)
+    intercept = ds.get("RescaleIntercept", None)
+    return Rescale(
+        slope=float(slope) if slope not in (None, "") else 1.0,
+        intercept=float(intercept) if intercept not in (None, "") else 0.0,
+    )
+
+def window_from_dataset(ds) -> WindowLevel | None:
+    """
+    Reads the first window of the dataset, WindowCenter/WindowWidth may hold several.
+    :param ds: DICOM dataset
+    :return: the WindowLevel, or None if the dataset has no usable window
+    """
+    center = ds.get("WindowCenter", None)
+    width = ds.get("WindowWidth", None)
+    if isinstance(center, MultiValue):
+        center = center[0] if center else None
+    if isinstance(width, MultiValue):
+        width = width[0] if width else None
+    if center in (None, "") or width in (None, "") or float(width) < 1:
+        return None
+    return WindowLevel(float(center), float(width))
+
+def default_window(pixels, rescale=Rescale()) -> WindowLevel:
+    """
+    A window covering the full range of the frame, for data without a stored window.
+    :param pixels: stored pixel values
+    :param rescale: modality rescale of the pixels
+    :return: the WindowLevel
+    """
+    low, high = (float(value) * rescale.slope + rescale.intercept
+                 for value in (pixels.min(), pixels.max()))
+    low, high = min(low, high), max(low, high)
+    return WindowLevel(center=(low + high) / 2, width=max(high - low, 1.0))
+
+@dataclass
+class PixelHistogram:
+    """
+    This class stores how many pixels have each stored value, counts[i] is the number of
+    pixels with the value offset + i.
+    """
+    counts: np.ndarray
+    offset: int
+
+    @property
+    def total(self) -> int:
+        """:return: number of pixels counted"""
+        return int(self.counts.sum())
+
+    def percentile(self, q) -> int:
+        """
+        :param q: percentile, 0 to 100
+        :return: the lowest stored value with at least q percent of the pixels at or below it
+        """
+        cumulative = np.cumsum(self.counts)
+        rank = max(int(np.ceil(q / 100 * cumulative[-1])), 1)
+        return self.offset + int(np.searchsorted(cumulative, rank))
+
+    def __add__(self, other):
+        """Combines the histograms of two frames, e.g. for a window across a series"""
+        low = min(self.offset, other.offset)
+        high = max(self.offset + len(self.counts), other.offset + len(other.counts))
+        counts = np.zeros(high - low, dtype=np.int64)
+        for histogram in (self, other):
+            start = histogram.offset - low
+            counts[start:start + len(histogram.counts)] += histogram.counts
+        return PixelHistogram(counts, low)
+
+def pixel_histogram(pixels, sample_pixels=HISTOGRAM_SAMPLE_PIXELS) -> PixelHistogram:
+    """
+    Counts the stored values of integer pixels with np.bincount, large frames are sampled
+    on a regular grid of about sample_pixels pixels.
+    :param pixels: 2D stored pixel values of 16 bits or less, see supports_lut()
+    :param sample_pixels: number of pixels to count at most (roughly)
+    :return: the PixelHistogram, trimmed to the range of values present
+    """
+    if not supports_lut(pixels):
+        raise TypeError(f"Can not build an integer histogram of {pixels.dtype} pixels")
+    step = max(int(np.ceil(np.sqrt(pixels.size / sample_pixels))), 1)
+    sample = pixels[::step, ::step] if step > 1 else pixels
+
+    bits = pixels.dtype.itemsize * 8
+    if pixels.dtype.kind == "i":
+        # count the two's complement bit patterns, then move the negative values in front
+        counts = np.bincount(sample.view(f"u{pixels.dtype.itemsize}").ravel(), minlength=2 ** bits)
+        counts = np.roll(counts, 2 ** (bits - 1))
+        offset = -2 ** (bits - 1)
+    else:
+        counts = np.bincount(sample.ravel(), minlength=1)
+        offset = 0
+
+    present = np.flatnonzero(counts)
+    if len(present) == 0:
+        return PixelHistogram(np.zeros(1, dtype=np.int64), 0)
+    return PixelHistogram(counts[present[0]:present[-1] + 1], offset + int(present[0]))
+
+def frame_histogram(pixels, cache=None, file_path=None, frame=0) -> PixelHistogram:
+    """
+    The histogram of one frame, cached against the file it came from.
+    :param pixels: 2D stored pixel values of the frame
+    :param cache: optional DicomCache
+    :param file_path: file of the frame, needed to cache the histogram
+    :param frame: index of the frame in the file
+    :return: the PixelHistogram
+    """
+    key = file_cache_key(file_path, "histogram", frame) if cache is not None else None
+    if key is not None and (cached := cache.get(key)) is not None:
+        return cached
+    histogram = pixel_histogram(pixels)
+    if key is not None:
+        cache.put(key, histogram, nbytes=histogram.counts.nbytes)
+    return histogram
+
+def volume_histogram(volume, cache=None) -> PixelHistogram:
+    """
+    The combined histogram of every frame of a DicomVolume, for one window across a series.
+    Frames whose histogram is cached are not decoded.
+    :param volume: MultiFrameVolume or SeriesVolume of integer pixels
+    :param cache: optional DicomCache for the per frame histograms
+    :return: the PixelHistogram
+    """
+    total = None
+    for index in range(len(volume)):
+        file_path, frame = volume.frame_source(index)
+        key = file_cache_key(file_path, "histogram", frame) if cache is not None else None
+        histogram = cache.get(key) if key is not None else None
+        if histogram is None:
+            histogram = frame_histogram(volume.get_frame(index), cache, file_path, frame)
+        total = histogram if total is None else total + histogram
+    return total
+
+def auto_window(histogram: PixelHistogram, rescale=Rescale(),
+                percentiles=AUTO_WINDOW_PERCENTILES) -> WindowLevel:
+    """
+    A window from robust percentiles of the stored values rather than their min and max.
+    :param histogram: PixelHistogram of a frame, or of a series
+    :param rescale: modality rescale of the stored values
+    :param percentiles: (low, high) percentiles shown as black and white
+    :return: the WindowLevel
+    """
+    low, high = (histogram.percentile(q) * rescale.slope + rescale.intercept for q in percentiles)
+    low, high = min(low, high), max(low, high)
+    return WindowLevel(center=(low + high) / 2, width=max(high - low, 1.0))
+
+def supports_lut(pixels) -> bool:
+    """
+    :param pixels: stored pixel values
+    :return: True if the pixels can be windowed through a lookup table
+    """
+    dtype = pixels.dtype
+    return dtype.kind in "ui" and dtype.isnative and dtype.itemsize * 8 <= MAX_LUT_BITS
+
+def window_values(values, window: WindowLevel, out=None):
+    """
+    The linear VOI function of DICOM PS3.3 C.11.2.1.2, from modality values to 0-255.
+    :param values: float array of modality values
+    :param window: the window to apply
+    :param out: optional uint8 array to write into
+    :return: uint8 array of display values
+    """
+    width = max(window.width, 1.0)
+    scaled = ((values - (window.center - 0.5)) / max(width - 1, 1.0) + 0.5) * 255
+    np.clip(scaled, 0, 255, out=scaled)
+    if out is None:
+        return scaled.astype(np.uint8)
+    np.copyto(out, scaled, casting="unsafe")
+    return out
+
+@lru_cache(maxsize=32)
+def get_lut(dtype, window: WindowLevel, rescale: Rescale = Rescale(), invert=False) -> np.ndarray:
+    """
+    Builds the read-only uint8 table for every stored value of dtype, cached per arguments.
+    The table is indexed by the stored values viewed as unsigned, see apply_window().
+    :param dtype: integer numpy dtype of the stored values, 16 bits or less
+    :param window: window in modality units
+    :param rescale: modality rescale of the stored values
+    :param invert: True for MONOCHROME1, where low values are shown white
+    :return: uint8 table of 2**bits entries
+    """
+    dtype = np.dtype(dtype)
+    unsigned = np.dtype(f"u{dtype.itemsize}")
+    # entry i is for the stored value whose bit pattern is i
+    stored = np.arange(2 ** (dtype.itemsize * 8), dtype=unsigned).view(dtype)
+    lut = window_values(stored * rescale.slope + rescale.intercept, window)
+    if invert:
+        np.subtract(255, lut, out=lut)
+    lut.flags.writeable = False
+    return lut
+
+def apply_window(pixels, window: WindowLevel, rescale=Rescale(), invert=False, out=None):
+    """
+    Converts stored pixel values to display bytes. Integer data of 16 bits or less is a single
+    gather through the cached table, anything else is windowed arithmetically.
+    :param pixels: stored pixel values
+    :param window: window in modality units
+    :param rescale: modality rescale of the pixels
+    :param invert: True for MONOCHROME1
+    :param out: optional uint8 array of the same shape to write into
+    :return: uint8 array of the same shape as pixels
+    """
+    if supports_lut(pixels):
+        lut = get_lut(pixels.dtype, window, rescale, invert)
+        unsigned = pixels.view(f"u{pixels.dtype.itemsize}") if pixels.dtype.kind == "i" else pixels
+        return _take_blocks(lut, unsigned, out)
+
+    values = np.asarray(pixels, dtype=np.float64) * rescale.slope + rescale.intercept
+    result = window_values(values, window, out=out)
+    if invert:
+        np.subtract(255, result, out=result)
+    return result
+
+def _take_blocks(lut, indices, out=None):
+    """
+    np.take(lut, indices, out=out) a block of rows at a time. np.take converts its indices
+    to intp first, 8 bytes a pixel for the whole frame, so only a block is converted at once.
+    """
+    if out is None:
+        out = np.empty(indices.shape, dtype=np.uint8)
+    if indices.ndim == 0:
+        out[...] = lut[indices]
+        return out
+    row_pixels = max(indices[0].size, 1)
+    rows = max(LUT_BLOCK_PIXELS // row_pixels, 1)
+    for start in range(0, indices.shape[0], rows):
+        np.take(lut, indices[start:start + rows], out=out[start:start + rows])
+    return out
+
+def drag_window(start: WindowLevel, dx, dy) -> WindowLevel:
+    """
+    The window after a mouse drag, right widens the window and down raises the level.
+    The step scales with the starting width so CT and 16-bit radiographs feel the same.
+    :param start: the window when the drag started
+    :param dx: horizontal distance dragged in screen pixels
+    :param dy: vertical distance dragged in screen pixels
+    :return: the new WindowLevel
+    """
+    step = max(start.width, 2.0) / DRAG_PIXELS_PER_WIDTH
+    return WindowLevel(
+        center=start.center + dy * step,
+        width=max(start.width + dx * step, 1.0),
+    )
+
+class WindowedFrame:
+    """
+    The stored pixels of one decoded frame, kept so the window can be changed and the
+    frame rendered again without reading or decoding the file again.
+    Rendering uses the ImagePyramid level that matches the size the frame is shown at.
+    """
+    def __init__(
+            self, pixels, rescale=Rescale(), window=None, invert=False, target=None,
+            cache=None, file_path=None, frame=0
+    ):
+        """
+        :param pixels: 2D stored pixel values
+        :param rescale: modality rescale of the pixels
+        :param window: starting window, defaults to auto_window()
+        :param invert: True for MONOCHROME1
+        :param target: RenderTarget to render into, e.g. one recycled from a previous frame
+        :param cache: optional DicomCache for the pyramid levels and histogram
+        :param file_path: file of the frame, needed to cache them
+        :param frame: index of the frame in the file
+        """
+        self.pixels = pixels
+        self.pyramid = ImagePyramid(pixels, cache=cache, file_path=file_path, frame=frame)
+        self.rescale = rescale
+        self.invert = invert
+        self.cache = cache
+        self.file_path = file_path
+        self.frame = frame
+        self._histogram = None
+        self.default_window = window or self.auto_window()
+        self.window = self.default_window
+        self.target = target if target is not None else RenderTarget()
+
+    @classmethod
+    def from_dataset(cls, ds, cache=None, frame=0, target=None):
+        """
+        Decodes one frame of a dataset, starting from the dataset's own window
+        :param ds: dataset with pixel data
+        :param cache: optional DicomCache for the decoded frame
+        :param frame: index of the frame
+        :param target: RenderTarget to render into
+        """
+        pixels = MultiFrameVolume(ds, cache=cache).get_frame(frame)
+        return cls(
+            pixels,
+            rescale=rescale_from_dataset(ds),
+            window=window_from_dataset(ds),
+            invert=ds.get("PhotometricInterpretation", "") == "MONOCHROME1",
+            target=target,
+            cache=cache,
+            file_path=getattr(ds, "filename", None),
+            frame=frame,
+        )
+
+    def histogram(self) -> PixelHistogram | None:
+        """:return: the cached histogram of the frame, None if its pixels are not integers"""
+        if self._histogram is None and supports_lut(self.pixels):
+            self._histogram = frame_histogram(self.pixels, self.cache, self.file_path, self.frame)
+        return self._histogram
+
+    def auto_window(self) -> WindowLevel:
+        """:return: the histogram based window of the frame, or its full range for non integer data"""
+        if (histogram := self.histogram()) is not None:
+            return auto_window(histogram, self.rescale)
+        return default_window(self.pixels, self.rescale)
+
+    def render(self, window=None, level=0):
+        """
+        Applies a window to the stored pixels. The result is written into the target's buffer
+        for its size, so it must be copied (e.g. by QPixmap.fromImage) before the next render.
+        :param window: WindowLevel to apply, defaults to the current window
+        :param level: pyramid level to render, 0 is full resolution, see level_for_size()
+        :return: 2D uint8 array ready for numpy_to_qimage
+        """
+        if window is not None:
+            self.window = window
+        pixels = self.pyramid.level(level)
+        out = self.target.buffer(pixels.shape)
+        return apply_window(pixels, self.window, self.rescale, self.invert, out=out)
+
+    def render_image(self, window=None, level=0):
+        """
+        Renders like render() and returns the target's QImage of the result, which is only
+        valid until the next render
+        :param window: WindowLevel to apply, defaults to the current window
+        :param level: pyramid level to render
+        :return: the QImage
+        """
+        return self.target.image(self.render(window, level).shape)
+
+    def level_for_size(self, width, height) -> int:
+        """
+        :param width: width the frame is shown at, in screen pixels
+        :param height: height the frame is shown at, in screen pixels
+        :return: the coarsest pyramid level that still has a pixel per screen pixel
+        """
+        return self.pyramid.level_for_size(width, height)
+
+def get_windowed_pixel_array(ds, window=None, cache=None, frame=0):
+    """
+    Decodes one frame of a dataset and applies its window/level.
+    :param ds: dataset with pixel data
+    :param window: WindowLevel to apply, defaults to the dataset's own window, or the
+        auto window of the frame if it has none
+    :param cache: optional DicomCache for the decoded frame
+    :param frame: index of the frame
+    :return: 2D uint8 array ready for numpy_to_qimage
+    """
+    return WindowedFrame.from_dataset(ds, cache=cache, frame=frame).render(window)
@@ -0,0 +1,119 @@
+"""Test file for the bulk_validate.py functionality"""
+
+import json
+import logging
+from unittest.mock import patch
+
+import pytest
+from pydicom.uid import generate_uid
+from src import bulk_validate
+from src.bulk_validate import ValidationSummary, main, validate_directory, validate_file
+from tests.test_dicom_scanner import create_slice
+
+
+def _scale_chunk(chunk, factor):
+    """A picklable chunk function for the process pool"""
+    return [item * factor for item in chunk]
+
+
+@pytest.fixture
+def archive(tmp_path):
+    """A folder tree with valid, rejected and non-DICOM files"""
+    root = tmp_path / "archive"
+    (root / "nested").mkdir(parents=True)
+    study, series = generate_uid(), generate_uid()
+    for index in range(5):
+        create_slice(root / f"valid{index}.dcm", "P1", study, series, float(index), index)
+    scout = create_slice(root / "nested" / "scout.dcm", "P1", study, series, 0.0, 9)
+    scout.ImageType = ["ORIGINAL", "PRIMARY", "LOCALIZER"]
+    scout.save_as(str(root / "nested" / "scout.dcm"))
+    (root / "nested" / "notes.txt").write_text("This is not a DICOM file")
+    return root
+
+
+class TestBulkValidate:
+    """Test class for the bulk validation command line gate"""
+
+    def test_validate_file(self, archive):
+        """Test the status and reason of each kind of file"""
+        assert validate_file(archive / "valid0.dcm")["status"] == "valid"
+        rejected = validate_file(archive / "nested" / "scout.dcm")
+        assert rejected["status"] == "invalid"
+        assert "LOCALIZER" in rejected["reason"]
+        assert validate_file(archive / "nested" / "notes.txt")["status"] == "unreadable"
+
+    def test_validate_directory_report(self, archive, tmp_path):
+        """Test every file gets exactly one JSON line in the report"""
+        report_path = tmp_path / "report.jsonl"
+        with open(report_path, "w", encoding="utf-8") as report:
+            summary = validate_directory(archive, report, max_workers=2, chunksize=2)
+
+        entries = [json.loads(line) for line in report_path.read_text().splitlines()]
+        assert len(entries) == 7
+        assert len({entry["path"] for entry in entries}) == 7
+        assert (summary.valid, summary.invalid, summary.unreadable) == (5, 1, 1)
+        assert summary.files_per_second > 0
+
+    def test_bounded_in_flight(self, archive):
+        """Test only a couple of chunks per worker are read ahead of the results"""
+        consumed = []
+
+        def paths():
+            for index in range(100):
+                consumed.append(index)
+                yield archive / "valid0.dcm"
+
+        results = bulk_validate.iter_validation_results(paths(), max_workers=1, chunksize=5)
+        next(results)
+        # two chunks of five were submitted, plus one more once the first completed
+        assert len(consumed) <= 15
+        results.close()
+
+    def test_chunk_results_arguments(self):
+        """Test the shared pool loop passes the extra arguments to every chunk"""
+        results = bulk_validate.iter_chunk_results(
+            _scale_chunk, range(10), 3, max_workers=2, chunksize=4
+        )
+        assert sorted(results) == [index * 3 for index in range(10)]
+
+    def test_main(self, archive, tmp_path, capsys):
+        """Test the command line writes the report and fails the gate on rejected files"""
+        report_path = tmp_path / "report.jsonl"
+        code = main([str(archive), "--report", str(report_path), "--workers", "2"])
+        assert code == 1
+        assert len(report_path.read_text().splitlines()) == 7
+        assert "files/s" in capsys.readouterr().err
+
+    def test_main_all_valid(self, archive, capsys):
+        """Test the gate passes when every file is valid"""
+        (archive / "nested" / "scout.dcm").unlink()
+        (archive / "nested" / "notes.txt").unlink()
+        assert main([str(archive), "--workers", "1"]) == 0
+        assert len(capsys.readouterr().out.splitlines()) == 5
+
+    def test_configure_logging(self):
+        """Test only the command's own logger shows INFO, other modules only warnings"""
+        command = logging.getLogger("src.bulk_validate")
+        try:
+            with patch("logging.basicConfig") as basic_config:
+                bulk_validate.configure_logging("src.bulk_validate")
+            assert basic_config.call_args.kwargs["level"] == logging.WARNING
+            assert command.level == logging.INFO
+        finally:
+            command.setLevel(logging.NOTSET)
+
+    def test_main_missing_directory(self, tmp_path):
+        """Test a directory that does not exist is rejected"""
+        with pytest.raises(SystemExit):
+            main([str(tmp_path / "missing")])
+
+    def test_summary_throughput(self):
+        """Test the files/s of a summary"""
+        summary = ValidationSummary(valid=8, invalid=1, unreadable=1, elapsed=2.0)
+        assert summary.total == 10
+        assert summary.files_per_second == 5.0
+        assert ValidationSummary().files_per_second == 0.0
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -0,0 +1,116 @@
+"""Test file for the compact_volume.py functionality"""
+
+import numpy as np
+import pytest
+from src.compact_volume import CompactVolume
+from src.window_level import Rescale, WindowedFrame
+
+SLICES = np.arange(5 * 8 * 6, dtype=np.int16).reshape(5, 8, 6) - 100
+SLICE_BYTES = SLICES[0].nbytes
+
+
+def filled_volume(**kwargs):
+    """A CompactVolume with every slice of SLICES set in order"""
+    volume = CompactVolume(len(SLICES), SLICES.shape[1:], np.int16, **kwargs)
+    for index, pixels in enumerate(SLICES):
+        volume.set_frame(index, pixels)
+    return volume
+
+
+class TestCompactVolume:
+    """Test class for CompactVolume"""
+
+    def test_stored_dtype(self):
+        """Test slices are kept in the stored dtype, half the size of float32"""
+        volume = filled_volume()
+        assert volume.get_frame(3).dtype == np.int16
+        assert volume.nbytes_in_memory == SLICES.nbytes
+        assert np.array_equal(volume.get_frame(-1), SLICES[-1])
+
+    def test_lazy_rescale(self):
+        """Test the rescale is only applied when a rescaled frame is asked for"""
+        volume = filled_volume(rescale=Rescale(slope=2.0, intercept=-1024.0))
+        assert np.array_equal(volume.get_frame(1), SLICES[1])
+        rescaled = volume.get_rescaled_frame(1)
+        assert rescaled.dtype == np.float32
+        assert np.array_equal(rescaled, SLICES[1] * 2.0 - 1024)
+
+    def test_windowed_frame(self):
+        """Test a slice renders through the window lookup table with its rescale"""
+        volume = filled_volume(rescale=Rescale(intercept=-1024.0))
+        frame = WindowedFrame(volume.get_frame(2), rescale=volume.rescale(2))
+        assert frame.render().shape == (8, 6)
+
+    def test_one_array(self):
+        """Test every slice is a view of one contiguous (slices, rows, columns) array"""
+        volume = filled_volume()
+        assert volume.array.shape == SLICES.shape
+        assert volume.array.flags.c_contiguous
+        assert np.array_equal(volume.array, SLICES)
+        assert np.shares_memory(volume.get_frame(2), volume.array)
+
+    def test_rescale_vectors(self):
+        """Test each slice keeps its own rescale in the slope and intercept vectors"""
+        volume = filled_volume(rescale=Rescale(intercept=-1024.0))
+        volume.set_frame(3, SLICES[3], Rescale(2.0, 0.0))
+        assert volume.slopes.tolist() == [1.0, 1.0, 1.0, 2.0, 1.0]
+        assert volume.intercepts.tolist() == [-1024.0] * 3 + [0.0, -1024.0]
+        assert volume.rescale(3) == Rescale(2.0, 0.0)
+
+    def test_spilled_over_cap(self, tmp_path):
+        """Test a volume larger than the memory cap is one memory mapped scratch file"""
+        volume = filled_volume(max_bytes=2 * SLICE_BYTES, scratch_dir=tmp_path)
+        assert volume.spilled
+        assert isinstance(volume.array, np.memmap)
+        assert volume.array.shape == SLICES.shape
+        assert volume.nbytes_in_memory == 0
+        for index, pixels in enumerate(SLICES):
+            assert np.array_equal(volume.get_frame(index), pixels)
+        volume.close()
+        with pytest.raises(LookupError):
+            volume.get_frame(0)
+
+    def test_fits_cap(self):
+        """Test a volume within the memory cap stays in RAM"""
+        volume = filled_volume(max_bytes=SLICES.nbytes)
+        assert not volume.spilled
+
+    def test_lower_cap(self):
+        """Test lowering the cap moves the volume to a scratch file straight away"""
+        volume = filled_volume()
+        volume.set_max_bytes(SLICE_BYTES)
+        assert volume.spilled
+        assert volume.nbytes_in_memory == 0
+        for index, pixels in enumerate(SLICES):
+            assert np.array_equal(volume.get_frame(index), pixels)
+        volume.close()
+
+    def test_set_again(self):
+        """Test setting a slice again replaces its values"""
+        volume = filled_volume(max_bytes=SLICE_BYTES)
+        volume.set_frame(0, np.zeros(SLICES.shape[1:], dtype=np.int16))
+        assert not volume.get_frame(0).any()
+        assert np.array_equal(volume.get_frame(1), SLICES[1])
+
+    def test_wrong_shape(self):
+        """Test a slice of another size is rejected"""
+        volume = CompactVolume(2, (8, 6), np.int16)
+        with pytest.raises(ValueError):
+            volume.set_frame(0, np.zeros((4, 4), dtype=np.int16))
+
+    def test_wrong_dtype(self):
+        """Test a slice whose values may not fit the volume's dtype is rejected, not wrapped"""
+        volume = CompactVolume(2, (8, 6), np.uint16)
+        with pytest.raises(ValueError):
+            volume.set_frame(0, np.full((8, 6), -1, dtype=np.int16))
+        volume.set_frame(1, np.full((8, 6), 200, dtype=np.uint8))
+        assert volume.get_frame(1).dtype == np.uint16
+
+    def test_not_loaded(self):
+        """Test reading a slice that was never set raises a LookupError"""
+        with pytest.raises(LookupError):
+            CompactVolume(2, (8, 6), np.int16).get_frame(1)
+
+
+if __name__ == "__main__":
+    pytest.main()
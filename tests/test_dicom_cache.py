@@ -0,0 +1,145 @@
+"""Test file for the dicom_cache.py functionality"""
+
+import os
+import numpy as np
+import pytest
+from src.dicom_cache import DicomCache, estimate_nbytes, file_cache_key
+from src.inputs_and_outputs import get_normalized_pixel_array
+from src.read_dicom_file import read_dicom_file, read_dicom_header
+from tests.test_pixel_memmap import create_image_dicom
+
+
+class TestDicomCache:
+    """Test class for DicomCache"""
+
+    def test_hit_and_miss_counters(self):
+        """Test hits and misses are counted"""
+        cache = DicomCache(max_bytes=1000)
+        assert cache.get("a") is None
+        cache.put("a", "value", nbytes=10)
+        assert cache.get("a") == "value"
+        stats = cache.stats()
+        assert (stats.hits, stats.misses, stats.evictions) == (1, 1, 0)
+        assert (stats.size_bytes, stats.entries) == (10, 1)
+
+    def test_evicts_least_recently_used(self):
+        """Test the least recently used entry is evicted once the byte limit is passed"""
+        cache = DicomCache(max_bytes=30)
+        cache.put("a", 1, nbytes=10)
+        cache.put("b", 2, nbytes=10)
+        cache.put("c", 3, nbytes=10)
+        cache.get("a")  # "b" is now the least recently used
+        cache.put("d", 4, nbytes=10)
+
+        assert cache.get("b") is None
+        assert [cache.get(key) for key in "acd"] == [1, 3, 4]
+        assert cache.stats().evictions == 1
+        assert cache.stats().size_bytes == 30
+
+    def test_replacing_entry_updates_size(self):
+        """Test putting the same key again replaces its size"""
+        cache = DicomCache(max_bytes=100)
+        cache.put("a", 1, nbytes=60)
+        cache.put("a", 2, nbytes=20)
+        assert cache.stats().size_bytes == 20
+        assert cache.get("a") == 2
+
+    def test_value_over_limit_not_cached(self):
+        """Test a value bigger than the whole cache is not stored"""
+        cache = DicomCache(max_bytes=10)
+        cache.put("a", 1, nbytes=5)
+        cache.put("big", 2, nbytes=11)
+        assert cache.get("big") is None
+        assert cache.get("a") == 1
+
+    def test_set_max_bytes_evicts(self):
+        """Test lowering the limit evicts straight away"""
+        cache = DicomCache(max_bytes=100)
+        for key in "abcd":
+            cache.put(key, key, nbytes=25)
+        cache.set_max_bytes(50)
+        assert cache.stats().entries == 2
+        assert cache.get("a") is None
+        assert cache.get("d") == "d"
+
+    def test_cached_arrays_are_read_only(self):
+        """Test cached arrays can not be changed by the callers sharing them"""
+        cache = DicomCache()
+        array = np.zeros((4, 4), dtype=np.float32)
+        cache.put("a", array)
+        assert cache.stats().size_bytes == array.nbytes
+        with pytest.raises(ValueError):
+            cache.get("a")[0, 0] = 1
+
+    def test_clear(self):
+        """Test clear removes the entries but keeps the counters"""
+        cache = DicomCache()
+        cache.put("a", 1, nbytes=1)
+        cache.get("a")
+        cache.clear()
+        assert cache.get("a") is None
+        assert (cache.stats().entries, cache.stats().hits) == (0, 1)
+
+    def test_file_cache_key_changes_with_mtime(self, tmp_path):
+        """Test the key changes when the file is modified and is None when it is missing"""
+        path = tmp_path / "a.dcm"
+        path.write_bytes(b"data")
+        key = file_cache_key(path, "dataset")
+        assert key == file_cache_key(str(path), "dataset")
+        os.utime(path, ns=(0, 0))
+        assert file_cache_key(path, "dataset") != key
+        assert file_cache_key(tmp_path / "missing.dcm") is None
+        assert file_cache_key(None) is None
+
+    def test_estimate_nbytes_of_memmap(self, tmp_path):
+        """Test file backed memmaps cost nothing but copies of them do"""
+        path = tmp_path / "a.bin"
+        np.arange(10, dtype=np.uint16).tofile(path)
+        mapped = np.memmap(path, dtype=np.uint16, mode="r", shape=(10,))
+        assert estimate_nbytes(mapped) == 0
+        assert estimate_nbytes(mapped.astype(np.float32)) == 40
+
+
+class TestCachedReads:
+    """Test class for the cache parameter of read_dicom_file and get_normalized_pixel_array"""
+
+    @pytest.fixture
+    def image_path(self, tmp_path):
+        """A small 16 bit image"""
+        path = tmp_path / "image.dcm"
+        create_image_dicom(path, np.arange(64, dtype=np.uint16).reshape(1, 8, 8))
+        return path
+
+    def test_read_dicom_file_cached(self, image_path):
+        """Test the same dataset is returned until the file changes"""
+        cache = DicomCache()
+        first = read_dicom_file(image_path, cache=cache)
+        assert read_dicom_file(image_path, cache=cache) is first
+        # a different read mode is a different entry
+        assert read_dicom_header(image_path, cache=cache) is not first
+
+        os.utime(image_path, ns=(0, 0))
+        assert read_dicom_file(image_path, cache=cache) is not first
+        assert cache.stats().hits == 1
+
+    def test_invalid_file_not_cached(self, tmp_path):
+        """Test files that fail to read are not cached"""
+        cache = DicomCache()
+        path = tmp_path / "invalid.dcm"
+        path.write_text("This is not a DICOM file")
+        assert read_dicom_file(path, cache=cache) is None
+        assert cache.stats().entries == 0
+
+    def test_normalized_pixel_array_cached(self, image_path):
+        """Test the normalized array is reused for the unchanged file"""
+        cache = DicomCache()
+        ds = read_dicom_file(image_path)
+        first = get_normalized_pixel_array(ds, cache=cache)
+        assert get_normalized_pixel_array(ds, cache=cache) is first
+        assert type(first) is np.ndarray
+        assert first.max() == 1.0
+        assert cache.stats().size_bytes == first.nbytes
+
+
+if __name__ == "__main__":
+    pytest.main()
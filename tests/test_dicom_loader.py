@@ -0,0 +1,369 @@
+"""Test file for the dicom_loader.py functionality"""
+
+import numpy as np
+import pytest
+from PySide6.QtGui import QImage
+from src.dicom_loader import (
+    CancellationToken, LoadCancelled, LoadResult, Worker, decode_all_frames, decode_frame,
+    index_directory, load_dicom, preview_frame, render_frame,
+)
+from pydicom.uid import RLELossless
+from src.dicom_cache import DicomCache, estimate_nbytes, file_cache_key
+from src.metadata_index_model import MetadataIndexModel
+from src.pixel_memmap import read_dicom_file_mapped
+from src.read_dicom_file import read_dicom_header
+from src.render_target import RenderTarget
+from src.window_level import WindowLevel
+from tests.test_dicom_scanner import create_slice
+from tests.test_pixel_memmap import create_image_dicom
+
+FRAMES = np.arange(3 * 16 * 12, dtype=np.uint16).reshape(3, 16, 12)
+
+
+def create_viewable_dicom(filename, image_type=("ORIGINAL", "AXIAL"), frames=FRAMES, *args):
+    """Create a multi-frame CT file that passes validate_dicom"""
+    ds = create_image_dicom(filename, frames, *args)
+    ds.StudyID = "S1"
+    ds.StudyDescription = "Chest"
+    ds.ImageType = list(image_type)
+    ds.Modality = "CT"
+    ds.PatientName = "Doe^John"
+    ds.PatientID = "P1"
+    ds.save_as(str(filename))
+    return ds
+
+
+class TestLoadDicom:
+    """Test class for the load_dicom and render_frame pipeline functions"""
+
+    def test_load_dicom(self, tmp_path):
+        """Test a valid file is loaded with its patient info and first frame"""
+        path = tmp_path / "image.dcm"
+        create_viewable_dicom(path)
+        stages = []
+        result = load_dicom(path, progress=stages.append)
+
+        assert isinstance(result, LoadResult)
+        assert result.metadata.family_name == "Doe"
+        assert result.number_of_frames == 3
+        assert isinstance(result.image, QImage)
+        assert result.image_error is None
+        assert stages == [
+            "Reading header", "Validating", "Loading pixel data", "Decoding", "Rendering"
+        ]
+
+    def test_cached_header_unchanged(self, tmp_path):
+        """Test loading the pixel data leaves the cached header and the cache size as they were"""
+        path = tmp_path / "image.dcm"
+        frames = np.random.default_rng(0).integers(0, 4096, (2, 128, 128), dtype=np.uint16)
+        create_viewable_dicom(path, ("ORIGINAL", "AXIAL"), frames, RLELossless)
+        cache = DicomCache(max_bytes=64 * 1024 * 1024)
+        result = load_dicom(path, cache=cache)
+        decode_frame(result.ds, 1, cache=cache)
+        assert np.array_equal(result.ds.pixel_array, frames)
+
+        assert "PixelData" not in read_dicom_header(path, cache=cache)
+        # no entry holds more than it was counted as when it was put in the cache, the
+        # elements of a header are converted on access but the pixel data is not loaded on it
+        entries = list(cache._entries.values())  # pylint: disable=protected-access
+        assert cache.stats().size_bytes == sum(nbytes for _, nbytes in entries)
+        for value, nbytes in entries:
+            assert estimate_nbytes(value) < nbytes + 1024
+
+    def test_load_rejected_file(self, tmp_path):
+        """Test validate_dicom errors are raised before any pixel data is loaded"""
+        path = tmp_path / "scout.dcm"
+        create_viewable_dicom(path, image_type=("ORIGINAL", "LOCALIZER"))
+        stages = []
+        with pytest.raises(ValueError, match="LOCALIZER"):
+            load_dicom(path, progress=stages.append)
+        assert "Loading pixel data" not in stages
+
+    def test_load_unreadable_file(self, tmp_path):
+        """Test a file that can not be read raises a ValueError"""
+        path = tmp_path / "invalid.dcm"
+        path.write_text("This is not a DICOM file")
+        with pytest.raises(ValueError, match="Could not read"):
+            load_dicom(path)
+
+    def test_load_without_pixel_data(self, tmp_path):
+        """Test a file without pixel data loads with an image error"""
+        path = tmp_path / "image.dcm"
+        ds = create_viewable_dicom(path)
+        del ds.PixelData
+        ds.save_as(str(path))
+        result = load_dicom(path)
+        assert result.image is None
+        assert result.image_error == "No Image Data Found"
+
+    def test_render_frame(self, tmp_path):
+        """Test a later frame can be rendered from the loaded dataset"""
+        path = tmp_path / "image.dcm"
+        create_viewable_dicom(path)
+        result = load_dicom(path)
+        image = render_frame(result.ds, 2)
+        assert (image.width(), image.height()) == (12, 16)
+
+    def test_decode_frame_keeps_pixels(self, tmp_path):
+        """Test grayscale frames keep their stored pixels for re-windowing"""
+        path = tmp_path / "image.dcm"
+        create_viewable_dicom(path)
+        result = load_dicom(path)
+        assert np.array_equal(result.frame.pixels, FRAMES[0])
+
+        window = WindowLevel(center=100.0, width=50.0)
+        rendered = decode_frame(result.ds, 1, window=window)
+        assert np.array_equal(rendered.frame.pixels, FRAMES[1])
+        assert rendered.frame.window == window
+
+    def test_decode_frame_into_target(self, tmp_path):
+        """Test frames of the same size are rendered into the buffer of a recycled target"""
+        path = tmp_path / "image.dcm"
+        create_viewable_dicom(path)
+        ds = load_dicom(path).ds
+        target = RenderTarget()
+        first = decode_frame(ds, 0, target=target)
+        second = decode_frame(ds, 1, target=target)
+        assert second.image is first.image is target.image((16, 12))
+        assert second.frame.target is target
+
+    def test_cancel_between_stages(self, tmp_path):
+        """Test a load cancelled during one stage stops before the next one starts"""
+        path = tmp_path / "image.dcm"
+        create_viewable_dicom(path)
+        token = CancellationToken()
+        stages = []
+
+        def progress(stage):
+            stages.append(stage)
+            if stage == "Validating":
+                token.cancel()
+
+        with pytest.raises(LoadCancelled):
+            load_dicom(path, progress=progress, token=token)
+        assert stages == ["Reading header", "Validating"]
+
+    def test_cancel_before_render(self, tmp_path):
+        """Test a frame cancelled while decoding is never rendered"""
+        path = tmp_path / "image.dcm"
+        create_viewable_dicom(path)
+        ds = load_dicom(path).ds
+        token = CancellationToken()
+        stages = []
+
+        def progress(stage):
+            stages.append(stage)
+            token.cancel()
+
+        with pytest.raises(LoadCancelled):
+            render_frame(ds, 1, progress=progress, token=token)
+        assert stages == ["Decoding"]
+
+
+class TestPreview:
+    """Test class for the strided preview shown before the full decode"""
+
+    LARGE = np.arange(600 * 520, dtype=np.uint16).reshape(1, 600, 520)
+
+    def test_preview_frame(self, tmp_path):
+        """Test a large frame is previewed from every n-th row and column"""
+        path = tmp_path / "large.dcm"
+        create_image_dicom(path, self.LARGE)
+        image = preview_frame(read_dicom_file_mapped(path), max_size=200)
+        # step 3 for a longest side of 600
+        assert (image.width(), image.height()) == (174, 200)
+
+    def test_no_preview(self, tmp_path):
+        """Test small and compressed frames are not previewed"""
+        path = tmp_path / "small.dcm"
+        create_image_dicom(path, FRAMES)
+        assert preview_frame(read_dicom_file_mapped(path)) is None
+
+        path = tmp_path / "rle.dcm"
+        create_image_dicom(path, self.LARGE, RLELossless)
+        assert preview_frame(read_dicom_file_mapped(path), max_size=200) is None
+
+    def test_preview_before_decode(self, tmp_path):
+        """Test the preview is handed over before the frame is decoded"""
+        path = tmp_path / "large.dcm"
+        ds = create_image_dicom(path, self.LARGE)
+        ds.StudyID = "S1"
+        ds.StudyDescription = "Chest"
+        ds.ImageType = ["ORIGINAL", "AXIAL"]
+        ds.save_as(str(path))
+        events = []
+        result = load_dicom(
+            path,
+            progress=events.append,
+            preview=lambda image: events.append(("preview", image.width())),
+        )
+        assert events[-4:] == ["Previewing", ("preview", 174), "Decoding", "Rendering"]
+        assert (result.image.width(), result.image.height()) == (520, 600)
+
+
+class TestDecodeAllFrames:
+    """Test class for decoding compressed multi-frame files into the cache while they load"""
+
+    MULTI = np.arange(9 * 16 * 12, dtype=np.uint16).reshape(9, 16, 12)
+
+    def test_load_decodes_every_frame(self, tmp_path):
+        """Test every frame is cached with progress after each chunk, frame 0 is previewed"""
+        path = tmp_path / "rle.dcm"
+        create_viewable_dicom(path, ("ORIGINAL", "AXIAL"), self.MULTI, RLELossless)
+        cache = DicomCache(max_bytes=64 * 1024 * 1024)
+        events = []
+        result = load_dicom(
+            path, cache=cache, progress=events.append,
+            preview=lambda image: events.append(("preview", image.width())),
+        )
+        assert events[3:] == [
+            "Previewing", "Decoding 9 frames", ("preview", 12), "Decoded 4 of 9 frames",
+            "Decoded 8 of 9 frames", "Decoded 9 of 9 frames", "Decoding", "Rendering",
+        ]
+        for index, frame in enumerate(self.MULTI):
+            assert np.array_equal(cache.get(file_cache_key(path, "frame", index)), frame)
+
+        # a later frame is the cached one, not decoded again
+        rendered = decode_frame(result.ds, 8, cache=cache)
+        assert rendered.frame.pixels is cache.get(file_cache_key(path, "frame", 8))
+
+    def test_process_pool(self, tmp_path):
+        """Test the frames decoded by spawned worker processes match the stored pixels"""
+        path = tmp_path / "rle.dcm"
+        create_viewable_dicom(path, ("ORIGINAL", "AXIAL"), self.MULTI, RLELossless)
+        cache = DicomCache(max_bytes=64 * 1024 * 1024)
+        assert decode_all_frames(read_dicom_file_mapped(path), cache, max_workers=2)
+        for index, frame in enumerate(self.MULTI):
+            assert np.array_equal(cache.get(file_cache_key(path, "frame", index)), frame)
+
+    def test_cancel_between_chunks(self, tmp_path):
+        """Test a load cancelled while its frames decode stops after the current chunk"""
+        path = tmp_path / "rle.dcm"
+        create_viewable_dicom(path, ("ORIGINAL", "AXIAL"), self.MULTI, RLELossless)
+        token = CancellationToken()
+        stages = []
+
+        def progress(stage):
+            stages.append(stage)
+            if stage.startswith("Decoded"):
+                token.cancel()
+
+        with pytest.raises(LoadCancelled):
+            load_dicom(path, cache=DicomCache(), progress=progress, token=token)
+        assert stages[-2:] == ["Decoding 9 frames", "Decoded 4 of 9 frames"]
+
+    def test_left_to_decode_on_demand(self, tmp_path):
+        """Test uncompressed files and frames that do not fit the cache are not decoded up front"""
+        path = tmp_path / "plain.dcm"
+        create_viewable_dicom(path, ("ORIGINAL", "AXIAL"), self.MULTI)
+        assert not decode_all_frames(read_dicom_file_mapped(path), DicomCache())
+
+        path = tmp_path / "rle.dcm"
+        create_viewable_dicom(path, ("ORIGINAL", "AXIAL"), self.MULTI, RLELossless)
+        ds = read_dicom_file_mapped(path)
+        assert not decode_all_frames(ds, None)
+        assert not decode_all_frames(ds, DicomCache(max_bytes=self.MULTI.nbytes - 1))
+
+
+class TestWorker:
+    """Test class for the QRunnable Worker, run synchronously"""
+
+    def test_worker_finished(self):
+        """Test the return value and progress are emitted"""
+        def pipeline(value, progress, token):
+            progress("Working")
+            return value * 2
+
+        worker = Worker(pipeline, 21)
+        results, stages = [], []
+        worker.signals.finished.connect(results.append)
+        worker.signals.progress.connect(stages.append)
+        worker.run()
+        assert results == [42]
+        assert stages == ["Working"]
+
+    def test_worker_failed(self):
+        """Test exceptions are emitted as failed rather than raised"""
+        def pipeline(progress, token):
+            raise ValueError("bad file")
+
+        worker = Worker(pipeline)
+        errors, results = [], []
+        worker.signals.failed.connect(errors.append)
+        worker.signals.finished.connect(results.append)
+        worker.run()
+        assert errors == ["bad file"]
+        assert results == []
+
+    def test_superseded_before_start(self):
+        """Test a worker cancelled while queued never runs its function"""
+        calls, cancelled = [], []
+
+        def pipeline(progress, token):
+            calls.append(token)
+
+        worker = Worker(pipeline)
+        worker.signals.cancelled.connect(lambda: cancelled.append(True))
+        worker.token.cancel()
+        worker.run()
+        assert calls == []
+        assert cancelled == [True]
+
+    def test_superseded_while_running(self):
+        """Test the result of a worker cancelled on its last stage is dropped"""
+        token = CancellationToken()
+
+        def pipeline(progress, token):
+            token.cancel()  # as if a newer load started meanwhile
+            return "stale"
+
+        worker = Worker(pipeline, token=token)
+        results, cancelled = [], []
+        worker.signals.finished.connect(results.append)
+        worker.signals.cancelled.connect(lambda: cancelled.append(True))
+        worker.run()
+        assert results == []
+        assert cancelled == [True]
+
+    def test_worker_preview(self):
+        """Test preview=True hands the function a callable that emits signals.preview"""
+        def pipeline(progress, token, preview):
+            preview("early")
+            return "final"
+
+        worker = Worker(pipeline, preview=True)
+        events = []
+        worker.signals.preview.connect(events.append)
+        worker.signals.finished.connect(events.append)
+        worker.run()
+        assert events == ["early", "final"]
+
+
+class TestIndexDirectory:
+    """Test class for scanning a folder into the metadata index from a worker"""
+
+    def test_index_then_find(self, tmp_path):
+        """Test an indexed study can be found and opened from the index alone"""
+        folder = tmp_path / "archive"
+        folder.mkdir()
+        for index in range(3):
+            create_slice(folder / f"{index}.dcm", "P1", "1.2.3", "1.2.3.4", float(index), index)
+        metadata_index = MetadataIndexModel(database_path=tmp_path, database_name="index.db")
+        stages = []
+        assert index_directory(folder, metadata_index, progress=stages.append) == 1
+        assert stages == ["Indexing"]
+
+        studies = metadata_index.find_studies(modality="ct", description="hes")
+        assert [record.study_instance_uid for record in studies] == ["1.2.3"]
+        assert load_dicom(studies[0].path).metadata.family_name == "Doe"
+
+    def test_cancelled(self, tmp_path):
+        """Test a cancelled token stops the scan before it starts"""
+        token = CancellationToken()
+        token.cancel()
+        with pytest.raises(LoadCancelled):
+            index_directory(tmp_path, None, token=token)
+
+
+if __name__ == "__main__":
+    pytest.main()
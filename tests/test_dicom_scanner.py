@@ -0,0 +1,191 @@
+"""Test file for the dicom_scanner.py functionality"""
+
+import os
+import pickle
+import pytest
+from unittest.mock import patch
+from pydicom.dataset import FileDataset, FileMetaDataset
+from pydicom.uid import UID, ExplicitVRLittleEndian, generate_uid
+from src import dicom_scanner
+from src.dicom_scanner import InstanceRecord, build_series_index, scan_directory
+from src.metadata_index_model import MetadataIndexModel
+
+
+def create_slice(filename, patient_id, study_uid, series_uid, z, instance_number):
+    """Create a minimal CT slice at the given z position"""
+    file_meta = FileMetaDataset()
+    file_meta.MediaStorageSOPClassUID = UID("1.2.840.10008.5.1.4.1.1.2")
+    file_meta.MediaStorageSOPInstanceUID = generate_uid()
+    file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+
+    ds = FileDataset(str(filename), {}, file_meta=file_meta, preamble=b"\0" * 128)
+    ds.SOPClassUID = file_meta.MediaStorageSOPClassUID
+    ds.SOPInstanceUID = file_meta.MediaStorageSOPInstanceUID
+    ds.PatientID = patient_id
+    ds.PatientName = "Doe^John"
+    ds.Modality = "CT"
+    ds.StudyID = "S1"
+    ds.StudyDescription = "Chest"
+    ds.ImageType = ["ORIGINAL", "PRIMARY", "AXIAL"]
+    ds.StudyInstanceUID = study_uid
+    ds.SeriesInstanceUID = series_uid
+    ds.InstanceNumber = instance_number
+    ds.ImagePositionPatient = [0.0, 0.0, z]
+    ds.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+    ds.is_little_endian = True
+    ds.is_implicit_VR = False
+    ds.save_as(str(filename))
+    return ds
+
+
+class TestDicomScanner:
+    """Test class for scan_directory"""
+
+    @pytest.fixture
+    def study_dir(self, tmp_path):
+        """Two patients, one with slices saved out of order in a nested folder"""
+        study_uid = generate_uid()
+        series_uid = generate_uid()
+        directory = tmp_path / "study"
+        nested = directory / "nested" / "deeper"
+        nested.mkdir(parents=True)
+        # instance numbers deliberately disagree with the positions
+        for i, z in enumerate([10.0, -5.0, 2.5]):
+            create_slice(nested / f"slice{i}", "P1", study_uid, series_uid, z, 3 - i)
+        create_slice(directory / "other.dcm", "P2", generate_uid(), generate_uid(), 0.0, 1)
+        (directory / "notes.txt").write_text("This is not a DICOM file")
+        return directory, study_uid, series_uid
+
+    @pytest.mark.parametrize("use_processes", [False, True], ids=["threads", "processes"])
+    def test_scan_directory(self, study_dir, use_processes):
+        """Test the index groups files by patient, study and series"""
+        directory, study_uid, series_uid = study_dir
+        index = scan_directory(directory, max_workers=2, use_processes=use_processes)
+
+        assert set(index) == {"P1", "P2"}
+        instances = index["P1"][study_uid][series_uid]
+        assert len(instances) == 3
+        assert [inst.image_position[2] for inst in instances] == [-5.0, 2.5, 10.0]
+        assert len(index["P2"]) == 1
+
+    def test_scan_empty_directory(self, tmp_path):
+        """Test an empty directory gives an empty index"""
+        assert scan_directory(tmp_path, use_processes=False) == {}
+
+    def test_read_instance_record_invalid(self, tmp_path):
+        """Test non-DICOM files are skipped"""
+        path = tmp_path / "notes.txt"
+        path.write_text("This is not a DICOM file")
+        assert dicom_scanner.read_instance_record(path) is None
+
+    def test_read_instance_record_fields(self, study_dir):
+        """Test the patient info and validate_dicom outcome are kept on the record"""
+        directory, _, _ = study_dir
+        record = dicom_scanner.read_instance_record(directory / "other.dcm")
+        assert (record.given_name, record.family_name, record.modality) == ("John", "Doe", "CT")
+        assert record.study_id == "S1"
+        assert record.is_valid
+        assert record.invalid_reason is None
+
+    def test_read_instance_record_rejected(self, tmp_path):
+        """Test the rejection reason from validate_dicom is kept on the record"""
+        path = tmp_path / "scout.dcm"
+        ds = create_slice(path, "P1", generate_uid(), generate_uid(), 0.0, 1)
+        ds.ImageType = ["ORIGINAL", "PRIMARY", "LOCALIZER"]
+        ds.save_as(str(path))
+        record = dicom_scanner.read_instance_record(path)
+        assert not record.is_valid
+        assert record.invalid_reason == "Skipping LOCALIZER image."
+
+    def test_rescan_with_metadata_index(self, study_dir):
+        """Test only new or changed files are parsed when a metadata index is used"""
+        directory, study_uid, series_uid = study_dir
+        metadata_index = MetadataIndexModel(database_path=directory.parent,
+                                            database_name="index.db")
+        first = scan_directory(directory, use_processes=False, metadata_index=metadata_index)
+
+        with patch("src.dicom_scanner.read_instance_record",
+                   wraps=dicom_scanner.read_instance_record) as reader:
+            second = scan_directory(directory, use_processes=False, metadata_index=metadata_index)
+            reader.assert_not_called()
+        assert second == first
+
+        changed = directory / "other.dcm"
+        os.utime(changed, ns=(0, 0))
+        with patch("src.dicom_scanner.read_instance_record",
+                   wraps=dicom_scanner.read_instance_record) as reader:
+            scan_directory(directory, use_processes=False, metadata_index=metadata_index)
+            assert [c.args[0] for c in reader.call_args_list] == [str(changed)]
+
+    def test_rescan_drops_deleted_files(self, study_dir):
+        """Test deleted files are removed from the index and the metadata index"""
+        directory, study_uid, series_uid = study_dir
+        metadata_index = MetadataIndexModel(database_path=directory.parent,
+                                            database_name="index.db")
+        scan_directory(directory, use_processes=False, metadata_index=metadata_index)
+        os.remove(directory / "other.dcm")
+        index = scan_directory(directory, use_processes=False, metadata_index=metadata_index)
+        assert set(index) == {"P1"}
+        assert str(directory / "other.dcm") not in metadata_index.get_records(directory)
+
+    def test_sort_by_instance_number_without_position(self):
+        """Test instances without a position are sorted by InstanceNumber"""
+        records = [
+            InstanceRecord(f"f{n}", "P", "S", "SE", f"{n}", instance_number=n)
+            for n in [3, 1, 2]
+        ]
+        index = build_series_index(records)
+        assert [r.instance_number for r in index["P"]["S"]["SE"]] == [1, 2, 3]
+
+    def test_sort_along_slice_normal(self):
+        """Test sagittal slices are sorted along x rather than z"""
+        orientation = (0.0, 1.0, 0.0, 0.0, 0.0, 1.0)
+        records = [
+            InstanceRecord(f"f{x}", "P", "S", "SE", f"{x}",
+                           image_position=(x, 0.0, 0.0), image_orientation=orientation)
+            for x in [4.0, -2.0, 1.0]
+        ]
+        index = build_series_index(records)
+        assert [r.image_position[0] for r in index["P"]["S"]["SE"]] == [-2.0, 1.0, 4.0]
+
+
+class TestCompactRecords:
+    """Test class for the slotted InstanceRecord with shared field values"""
+
+    def test_slotted(self):
+        """Test records have no per instance __dict__"""
+        record = InstanceRecord("f", "P", "S", "SE", "1")
+        assert not hasattr(record, "__dict__")
+        with pytest.raises(AttributeError):
+            record.unknown_field = 1
+
+    def test_repeated_values_shared(self):
+        """Test equal strings and tuples of different records are the same object"""
+        first, second = (
+            InstanceRecord(f"f{n}", "".join(["P", "1"]), "S", "SE", str(n),
+                           image_orientation=(1.0, 0.0, 0.0, 0.0, 1.0, 0.0),
+                           modality="".join(["C", "T"]))
+            for n in range(2)
+        )
+        assert first.patient_id is second.patient_id
+        assert first.modality is second.modality
+        assert first.image_orientation is second.image_orientation
+        assert first.sop_instance_uid is not second.sop_instance_uid
+
+    def test_shared_after_pickle(self, tmp_path):
+        """Test records from a scan worker process share their values once unpickled"""
+        series_uid = generate_uid()
+        path = tmp_path / "slice.dcm"
+        create_slice(path, "P1", generate_uid(), series_uid, 0.0, 1)
+        first, second = (
+            pickle.loads(pickle.dumps(dicom_scanner.read_instance_record(str(path))))
+            for _ in range(2)
+        )
+        assert first == second
+        assert first.series_instance_uid == series_uid
+        assert first.series_instance_uid is second.series_instance_uid
+        assert first.study_description is second.study_description
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -1,3 +1,4 @@
+import pandas as pd
 import pytest
 from unittest.mock import MagicMock, patch
 from datetime import datetime
@@ -91,6 +92,95 @@ def test_extract_patient_info_non_uuid_name():
     assert info.birth_date == datetime.strptime("19801001", "%Y%m%d").date()
     assert info.modality == "CT"
 
+def test_patient_info_compact():
+    """PatientInfo is slotted and shares repeated values between instances"""
+    first, second = (
+        dicom_utils.extract_patient_info({"PatientName": "Doe^John", "Modality": "".join("CT")})
+        for _ in range(2)
+    )
+    assert not hasattr(first, "__dict__")
+    assert first.modality is second.modality
+
+def test_shared_values_bounded():
+    """The table of shared values never holds more than MAX_SHARED_VALUES values"""
+    with patch.object(dicom_utils, "MAX_SHARED_VALUES", 4), \
+            patch.object(dicom_utils, "_SHARED_VALUES", {}):
+        first = dicom_utils.share_value((0.5, 0.5))
+        assert dicom_utils.share_value(tuple([0.5, 0.5])) is first
+        for index in range(10):
+            dicom_utils.share_value((float(index), 1.0))
+            assert len(dicom_utils._SHARED_VALUES) <= 4
+        assert dicom_utils.share_value(tuple([0.5, 0.5])) == first
+
+#tests for the batch patient table
+def _patient_dataset(name, birth_date="19800101"):
+    """Dataset with the patient fields that extract_patient_info reads"""
+    ds = Dataset()
+    ds.PatientName = name
+    ds.PatientID = "P123"
+    ds.PatientSex = "F"
+    ds.PatientBirthDate = birth_date
+    ds.Modality = "MR"
+    return ds
+
+def test_extract_patient_table_matches_extract_patient_info():
+    """The table has the same values as extract_patient_info, row by row"""
+    datasets = [
+        _patient_dataset("Smith^Jane"),
+        _patient_dataset("123e4567-e89b-12d3-a456-426614174000"),
+        _patient_dataset("Doe^John^^Dr", birth_date="19801301"),
+        Dataset(),
+    ]
+    table = dicom_utils.extract_patient_table(datasets)
+    assert list(table.columns) == dicom_utils.PATIENT_TABLE_COLUMNS
+    for ds, row in zip(datasets, table.itertuples()):
+        info = dicom_utils.extract_patient_info(ds)
+        assert row.given_name == info.given_name
+        assert row.family_name == info.family_name
+        assert row.patient_id == info.patient_id
+        assert row.sex == info.sex
+        assert row.modality == info.modality
+        if info.birth_date is None:
+            assert row.birth_date is pd.NaT
+        else:
+            assert row.birth_date.date() == info.birth_date
+    assert table["anonymized"].tolist() == [False, True, False, False]
+
+@pytest.mark.parametrize(
+    "name, expected",
+    [
+        ("123e4567-e89b-12d3-a456-426614174000", True),
+        ("{123E4567E89B12D3A456426614174000}", True),
+        ("urn:uuid:123e4567-e89b-12d3-a456-426614174000", True),
+        ("123e4567-e89b-12d3-a456-42661417400", False),
+        ("Doe^John", False),
+    ],
+    ids=["hyphens", "braces", "urn", "too_short", "name"]
+)
+def test_extract_patient_table_uuid_detection(name, expected):
+    """The vectorized UUID check agrees with uuid.UUID"""
+    table = dicom_utils.extract_patient_table([{"PatientName": name}])
+    assert table["anonymized"][0] == expected
+    assert dicom_utils._is_uuid(name) == expected
+
+def test_extract_patient_table_header_dicts():
+    """Header dicts are accepted, with text names split as family^given"""
+    table = dicom_utils.extract_patient_table([
+        {"PatientName": "Doe^John", "PatientBirthDate": "19800101", "Modality": "CT"},
+        {"PatientName": DummyPatient(given_name="Jane", family_name="Smith")},
+    ])
+    assert table["given_name"].tolist() == ["John", "Jane"]
+    assert table["family_name"].tolist() == ["Doe", "Smith"]
+    assert table["birth_date"][0] == pd.Timestamp(1980, 1, 1)
+    assert table["birth_date"].dtype.kind == "M"
+    assert table["modality"].tolist() == ["CT", "Unknown"]
+
+def test_extract_patient_table_empty():
+    """No datasets gives an empty table with every column"""
+    table = dicom_utils.extract_patient_table(iter([]))
+    assert table.empty
+    assert list(table.columns) == dicom_utils.PATIENT_TABLE_COLUMNS
+
 #Anything below is tests for validate_dicom method
 
 @pytest.mark.parametrize(
@@ -0,0 +1,179 @@
+"""Test file for the dicom_volume.py functionality"""
+
+import numpy as np
+import pytest
+from unittest.mock import patch
+from PySide6.QtGui import QImage
+from pydicom.uid import ExplicitVRBigEndian, RLELossless
+from src import dicom_volume
+from src.dicom_cache import DicomCache
+from src.dicom_volume import MultiFrameVolume, SeriesVolume
+from src.inputs_and_outputs import get_normalized_pixel_array, get_qimage_from_dicom_file
+from src.pixel_memmap import read_dicom_file_mapped
+from tests.test_pixel_memmap import create_image_dicom
+
+FRAMES = np.arange(5 * 16 * 12, dtype=np.int16).reshape(5, 16, 12) - 300
+
+
+class TestMultiFrameVolume:
+    """Test class for MultiFrameVolume"""
+
+    @pytest.mark.parametrize(
+        "transfer_syntax", [None, RLELossless, ExplicitVRBigEndian],
+        ids=["memmap", "rle", "big_endian"]
+    )
+    def test_get_frame(self, tmp_path, transfer_syntax):
+        """Test each frame matches the stored pixels whatever the transfer syntax"""
+        path = tmp_path / "multi.dcm"
+        if transfer_syntax is None:
+            create_image_dicom(path, FRAMES)
+        else:
+            create_image_dicom(path, FRAMES, transfer_syntax)
+        volume = MultiFrameVolume(read_dicom_file_mapped(path))
+
+        assert len(volume) == 5
+        assert volume.shape == (5, 16, 12)
+        for index in [3, 0, -1]:
+            assert np.array_equal(volume.get_frame(index), FRAMES[index])
+
+    def test_compressed_frame_decoded_alone(self, tmp_path):
+        """Test only the requested frame of compressed data is decoded"""
+        path = tmp_path / "multi.dcm"
+        create_image_dicom(path, FRAMES, RLELossless)
+        ds = read_dicom_file_mapped(path)
+        volume = MultiFrameVolume(ds)
+
+        with patch("src.dicom_volume.single_frame_dataset",
+                   wraps=dicom_volume.single_frame_dataset) as split:
+            frame = volume.get_frame(2)
+        assert split.call_count == 1
+        assert np.array_equal(frame, FRAMES[2])
+        # the dataset itself was never fully decoded
+        assert getattr(ds, "_pixel_array", None) is None
+
+    def test_memmap_frame_is_view(self, tmp_path):
+        """Test uncompressed frames are views of the file rather than copies"""
+        path = tmp_path / "multi.dcm"
+        create_image_dicom(path, FRAMES)
+        frame = MultiFrameVolume(read_dicom_file_mapped(path)).get_frame(1)
+        assert isinstance(frame, np.memmap)
+        assert not frame.flags.owndata
+
+    def test_single_frame(self, tmp_path):
+        """Test a single frame file is a one frame volume"""
+        path = tmp_path / "single.dcm"
+        create_image_dicom(path, FRAMES[:1], RLELossless)
+        volume = MultiFrameVolume(read_dicom_file_mapped(path))
+        assert volume.shape == (1, 16, 12)
+        assert np.array_equal(volume.get_frame(0), FRAMES[0])
+
+    def test_cached_frames(self, tmp_path):
+        """Test decoded frames are reused from the cache"""
+        path = tmp_path / "multi.dcm"
+        create_image_dicom(path, FRAMES, RLELossless)
+        cache = DicomCache()
+        first = MultiFrameVolume(read_dicom_file_mapped(path), cache=cache).get_frame(4)
+        again = MultiFrameVolume(read_dicom_file_mapped(path), cache=cache).get_frame(4)
+        assert again is first
+        assert cache.stats().hits == 1
+
+    def test_big_endian_frame_read_alone(self, tmp_path):
+        """Test a frame of unmapped data is copied from PixelData without decoding the rest"""
+        path = tmp_path / "multi.dcm"
+        create_image_dicom(path, FRAMES, ExplicitVRBigEndian)
+        ds = read_dicom_file_mapped(path)
+        cache = DicomCache()
+        frame = MultiFrameVolume(ds, cache=cache).get_frame(3)
+        assert np.array_equal(frame, FRAMES[3])
+        assert frame.dtype.isnative
+        assert getattr(ds, "_pixel_array", None) is None
+        assert cache.stats().size_bytes == FRAMES[3].nbytes
+
+    def test_planar_color_frame(self, tmp_path):
+        """Test a planar colour frame held in memory comes back as (rows, columns, samples)"""
+        path = tmp_path / "color.dcm"
+        color = np.arange(2 * 4 * 6 * 3, dtype=np.uint8).reshape(2, 4, 6, 3)
+        ds = create_image_dicom(path, color, planar_configuration=1)
+        assert np.array_equal(MultiFrameVolume(ds).get_frame(1), color[1])
+
+    def test_pixel_array_counted_whole(self, tmp_path):
+        """Test frames only pydicom can convert cache the whole array under one key"""
+        path = tmp_path / "multi.dcm"
+        create_image_dicom(path, FRAMES, ExplicitVRBigEndian)
+        cache = DicomCache()
+        volume = MultiFrameVolume(read_dicom_file_mapped(path), cache=cache)
+        with patch.object(MultiFrameVolume, "_read_uncompressed_frame", return_value=None):
+            assert np.array_equal(volume.get_frame(1), FRAMES[1])
+            assert np.array_equal(volume.get_frame(2), FRAMES[2])
+        assert cache.stats().size_bytes == FRAMES.nbytes
+        assert cache.stats().entries == 1
+
+    def test_frame_out_of_range(self, tmp_path):
+        """Test an IndexError is raised for frames that do not exist"""
+        path = tmp_path / "multi.dcm"
+        create_image_dicom(path, FRAMES)
+        volume = MultiFrameVolume(read_dicom_file_mapped(path))
+        with pytest.raises(IndexError):
+            volume.get_frame(5)
+
+    def test_no_pixel_data(self, tmp_path):
+        """Test a dataset without pixel data is rejected"""
+        path = tmp_path / "multi.dcm"
+        create_image_dicom(path, FRAMES)
+        ds = read_dicom_file_mapped(path)
+        del ds.PixelData
+        with pytest.raises(AttributeError):
+            MultiFrameVolume(ds)
+
+
+class TestSeriesVolume:
+    """Test class for SeriesVolume"""
+
+    def test_series_frames(self, tmp_path):
+        """Test each file of the series is a frame, in the order given"""
+        paths = []
+        for index in range(3):
+            path = tmp_path / f"slice{index}.dcm"
+            create_image_dicom(path, FRAMES[index:index + 1])
+            paths.append(path)
+        volume = SeriesVolume(paths[::-1])
+
+        assert volume.shape == (3, 16, 12)
+        assert np.array_equal(volume.get_frame(0), FRAMES[2])
+        assert np.array_equal(volume.get_frame(2), FRAMES[0])
+
+    def test_unreadable_file(self, tmp_path):
+        """Test a ValueError is raised when a file of the series can not be read"""
+        path = tmp_path / "invalid.dcm"
+        path.write_text("This is not a DICOM file")
+        with pytest.raises(ValueError):
+            SeriesVolume([path]).get_frame(0)
+
+    def test_empty_series(self):
+        """Test a series needs at least one file"""
+        with pytest.raises(ValueError):
+            SeriesVolume([])
+
+
+class TestFrameDisplay:
+    """Test class for showing a single frame through inputs_and_outputs"""
+
+    def test_normalized_frame(self, tmp_path):
+        """Test get_normalized_pixel_array normalizes just the requested frame"""
+        path = tmp_path / "multi.dcm"
+        create_image_dicom(path, FRAMES, RLELossless)
+        pixels = get_normalized_pixel_array(read_dicom_file_mapped(path), frame=4)
+        assert pixels.shape == (16, 12)
+        assert np.allclose(pixels, FRAMES[4] / FRAMES[4].max())
+
+    def test_qimage_from_multi_frame(self, tmp_path):
+        """Test a multi-frame file can be shown, which used to fail as not 2D"""
+        path = tmp_path / "multi.dcm"
+        create_image_dicom(path, FRAMES)
+        image = get_qimage_from_dicom_file(read_dicom_file_mapped(path), frame=2)
+        assert isinstance(image, QImage)
+        assert (image.width(), image.height()) == (12, 16)
+
+
+if __name__ == "__main__":
+    pytest.main()
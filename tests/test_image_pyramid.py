@@ -0,0 +1,68 @@
+"""Test file for the image_pyramid.py functionality"""
+
+import numpy as np
+import pytest
+from src.dicom_cache import DicomCache
+from src.image_pyramid import ImagePyramid, block_mean
+from tests.test_pixel_memmap import create_image_dicom
+
+
+class TestImagePyramid:
+    """Test class for block_mean and ImagePyramid"""
+
+    def test_block_mean(self):
+        """Test each output pixel is the rounded mean of its block"""
+        pixels = np.array([[0, 1, 10, 20],
+                           [2, 4, 30, 40],
+                           [9, 9, 9, 9]], dtype=np.uint16)
+        reduced = block_mean(pixels, 2)
+        assert reduced.dtype == np.uint16
+        # the odd last row does not fill a block and is dropped
+        assert np.array_equal(reduced, [[2, 25]])
+
+    def test_block_mean_signed(self):
+        """Test signed data keeps its dtype and sign"""
+        pixels = np.full((4, 4), -1000, dtype=np.int16)
+        assert np.array_equal(block_mean(pixels, 4), [[-1000]])
+
+    def test_levels(self):
+        """Test each level halves the previous one and is built only when asked for"""
+        pixels = np.random.default_rng(0).integers(0, 4096, (64, 96)).astype(np.uint16)
+        pyramid = ImagePyramid(pixels)
+        assert len(pyramid) == 4
+        assert pyramid.level(0) is pixels
+        assert pyramid.shape(3) == (8, 12)
+        assert 3 not in pyramid._levels  # pylint: disable=protected-access
+        assert pyramid.level(3).shape == (8, 12)
+        assert np.allclose(pyramid.level(1), block_mean(pixels, 2))
+        # block means of block means match a single 8x8 block mean to within rounding
+        assert np.abs(pyramid.level(3).astype(int) - block_mean(pixels, 8)).max() <= 1
+
+    def test_small_frame(self):
+        """Test levels smaller than one pixel are not offered"""
+        pyramid = ImagePyramid(np.zeros((5, 40), dtype=np.uint8))
+        assert len(pyramid) == 3
+
+    @pytest.mark.parametrize(
+        "size, expected",
+        [((2000, 2000), 0), ((1000, 700), 0), ((400, 300), 1), ((250, 190), 2), ((10, 10), 3)],
+    )
+    def test_level_for_size(self, size, expected):
+        """Test the coarsest level with at least a pixel per screen pixel is picked"""
+        pyramid = ImagePyramid(np.zeros((768, 1024), dtype=np.uint16))
+        assert pyramid.level_for_size(*size) == expected
+
+    def test_cached_levels(self, tmp_path):
+        """Test levels are shared through the cache between pyramids of the same frame"""
+        path = tmp_path / "image.dcm"
+        pixels = np.arange(32 * 32, dtype=np.uint16).reshape(1, 32, 32)
+        create_image_dicom(path, pixels)
+        cache = DicomCache()
+        first = ImagePyramid(pixels[0], cache=cache, file_path=str(path)).level(2)
+        again = ImagePyramid(pixels[0], cache=cache, file_path=str(path)).level(2)
+        assert again is first
+        assert cache.stats().hits == 1
+
+
+if __name__ == "__main__":
+    pytest.main()
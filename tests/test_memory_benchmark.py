@@ -0,0 +1,33 @@
+"""Test file for the memory_benchmark.py functionality"""
+
+import pytest
+from src.dicom_scanner import InstanceRecord
+from src.memory_benchmark import DictInstanceRecord, main, measure, synthetic_headers
+
+
+class TestMemoryBenchmark:
+    """Test class for the instance index memory benchmark"""
+
+    def test_headers_build_records(self):
+        """Test the synthetic headers are valid InstanceRecord arguments"""
+        headers = list(synthetic_headers(12, series_size=4))
+        records = [InstanceRecord(**header) for header in headers]
+        assert len({record.series_instance_uid for record in records}) == 3
+        assert records[0].study_instance_uid is records[11].study_instance_uid
+
+    def test_compact_records_smaller(self):
+        """Test shared slotted records take less memory than plain dataclasses"""
+        before = measure(DictInstanceRecord, 2000)
+        after = measure(InstanceRecord, 2000)
+        assert after.bytes_per_instance < before.bytes_per_instance
+
+    def test_main(self, capsys):
+        """Test the command line prints both record types"""
+        assert main(["--instances", "200"]) == 0
+        output = capsys.readouterr().out
+        assert "DictInstanceRecord" in output
+        assert "bytes/instance" in output
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -0,0 +1,211 @@
+""" Test File for the metadata_index_model file """
+import logging
+import sqlite3
+from datetime import date
+from unittest.mock import patch
+import pytest
+from src.dicom_scanner import InstanceRecord
+from src.metadata_index_model import MetadataIndexModel
+
+logger = logging.getLogger(__name__)
+logger.debug("UnitTests: MetadataIndexModel")
+
+
+def make_record(path, **fields):
+    """ Helper to build a record with every column filled in """
+    values = {
+        "patient_id": "P1",
+        "study_instance_uid": "1.2.3",
+        "series_instance_uid": "1.2.3.4",
+        "sop_instance_uid": "1.2.3.4.5",
+        "instance_number": 7,
+        "image_position": (0.0, -1.5, 20.0),
+        "image_orientation": (1.0, 0.0, 0.0, 0.0, 1.0, 0.0),
+        "pixel_spacing": (0.5, 0.5),
+        "slice_thickness": 2.5,
+        "rows": 512,
+        "columns": 512,
+        "given_name": "John",
+        "family_name": "Doe",
+        "sex": "M",
+        "birth_date": date(1980, 1, 1),
+        "modality": "CT",
+        "study_id": "S1",
+        "study_description": "Chest",
+        "is_valid": True,
+        "file_size": 100,
+        "mtime_ns": 5,
+    }
+    values.update(fields)
+    return InstanceRecord(path=path, **values)
+
+
+class TestMetadataIndexModel:
+    """ Test Class for MetadataIndexModel """
+    @pytest.fixture
+    def index(self, tmp_path):
+        """ Fixture to set up and Teardown tests """
+        logging.info('Setting up test metadata index fixture')
+        yield MetadataIndexModel(database_path=tmp_path, database_name="test_db.db")
+        logging.info('Teardown test metadata index fixture')
+
+    def test_create_table(self, index):
+        """ Test Method for create Table method """
+        assert index.create_table()
+
+    def test_record_round_trip(self, tmp_path, index):
+        """ Test a record comes back out of the index unchanged """
+        path = str(tmp_path / "a.dcm")
+        record = make_record(path)
+        assert index.update_records([(path, 100, 5, record)])
+        assert index.get_records(tmp_path) == {path: (100, 5, record)}
+
+    def test_non_dicom_entry(self, tmp_path, index):
+        """ Test non-DICOM files are remembered with no record """
+        path = str(tmp_path / "notes.txt")
+        index.update_records([(path, 10, 1, None)])
+        assert index.get_records(tmp_path) == {path: (10, 1, None)}
+
+    def test_invalid_record(self, tmp_path, index):
+        """ Test the validate_dicom outcome is kept """
+        path = str(tmp_path / "scout.dcm")
+        record = make_record(path, is_valid=False, invalid_reason="Skipping LOCALIZER image.",
+                             birth_date=None, image_position=None)
+        index.update_records([(path, 100, 5, record)])
+        assert index.get_records(tmp_path)[path][2] == record
+
+    def test_get_records_only_under_directory(self, tmp_path, index):
+        """ Test sibling folders sharing a name prefix are not returned """
+        inside = str(tmp_path / "study" / "a.dcm")
+        sibling = str(tmp_path / "study2" / "b.dcm")
+        index.update_records([(inside, 1, 1, None), (sibling, 1, 1, None)])
+        assert list(index.get_records(tmp_path / "study")) == [inside]
+
+    def test_update_replaces_entry(self, tmp_path, index):
+        """ Test a changed file replaces its old entry """
+        path = str(tmp_path / "a.dcm")
+        index.update_records([(path, 100, 5, make_record(path))])
+        index.update_records([(path, 200, 6, make_record(path, modality="MR"))])
+        size, mtime_ns, record = index.get_records(tmp_path)[path]
+        assert (size, mtime_ns, record.modality) == (200, 6, "MR")
+
+    def test_delete_missing(self, tmp_path, index):
+        """ Test entries for deleted files are removed """
+        kept = str(tmp_path / "a.dcm")
+        deleted = str(tmp_path / "b.dcm")
+        index.update_records([(kept, 1, 1, None), (deleted, 1, 1, None)])
+        assert index.delete_missing(tmp_path, [kept])
+        assert list(index.get_records(tmp_path)) == [kept]
+
+
+class TestMetadataIndexQueries:
+    """ Test Class for finding records in the MetadataIndexModel """
+    @pytest.fixture
+    def index(self, tmp_path):
+        """ Fixture of an index holding two studies and a non-DICOM file """
+        index = MetadataIndexModel(database_path=tmp_path, database_name="test_db.db")
+        records = [
+            make_record("/a/1.dcm", sop_instance_uid="1"),
+            make_record("/a/2.dcm", sop_instance_uid="2"),
+            make_record(
+                "/b/1.dcm", patient_id="P2", study_instance_uid="2.2", given_name="Jane",
+                family_name="Roe", sex="F", birth_date=date(1990, 6, 1), modality="MR",
+                study_id="S2", study_description="MR Brain \"Stroke\" 100%",
+                is_valid=False, invalid_reason="Skipping LOCALIZER image.",
+            ),
+        ]
+        index.update_records(
+            [(record.path, 100, 5, record) for record in records] + [("/a/notes.txt", 1, 1, None)]
+        )
+        yield index
+
+    @staticmethod
+    def paths(records):
+        """ Helper to compare results without depending on their order """
+        return sorted(record.path for record in records)
+
+    def test_no_filters(self, index):
+        """ Test every DICOM record is found and non-DICOM files are left out """
+        assert self.paths(index.find_records()) == ["/a/1.dcm", "/a/2.dcm", "/b/1.dcm"]
+
+    def test_modality_and_sex_ignore_case(self, index):
+        """ Test modality and sex match whatever their case """
+        assert self.paths(index.find_records(modality="ct")) == ["/a/1.dcm", "/a/2.dcm"]
+        assert self.paths(index.find_records(sex="f")) == ["/b/1.dcm"]
+
+    def test_birth_date_range(self, index):
+        """ Test both ends of the birth date range are included """
+        assert self.paths(index.find_records(birth_date_from=date(1990, 6, 1))) == ["/b/1.dcm"]
+        assert self.paths(index.find_records(birth_date_to=date(1990, 6, 1))) == [
+            "/a/1.dcm", "/a/2.dcm", "/b/1.dcm"
+        ]
+        assert index.find_records(
+            birth_date_from=date(1981, 1, 1), birth_date_to=date(1989, 1, 1)
+        ) == []
+
+    @pytest.mark.parametrize("description", ["brain", "Br", "\"stroke\"", "100%"])
+    def test_description_substring(self, index, description):
+        """ Test the description matches anywhere, through the index or a scan """
+        assert self.paths(index.find_records(description=description)) == ["/b/1.dcm"]
+        assert self.paths(
+            index.find_records(description=description, birth_date_to=date(2000, 1, 1))
+        ) == ["/b/1.dcm"]
+
+    def test_combined_filters(self, index):
+        """ Test all filters have to match """
+        assert self.paths(index.find_records(modality="CT", study_id="S1")) == [
+            "/a/1.dcm", "/a/2.dcm"
+        ]
+        assert index.find_records(modality="CT", study_id="S2") == []
+        assert self.paths(index.find_records(valid_only=True)) == ["/a/1.dcm", "/a/2.dcm"]
+
+    def test_limit(self, index):
+        """ Test the limit caps the number of records """
+        assert len(index.find_records(modality="CT", limit=1)) == 1
+
+    def test_find_studies(self, index):
+        """ Test one record is returned per study, ordered by patient name """
+        studies = index.find_studies()
+        assert [record.study_instance_uid for record in studies] == ["1.2.3", "2.2"]
+        assert studies[0].path == "/a/1.dcm"
+        assert [record.study_id for record in index.find_studies(description="chest")] == ["S1"]
+
+    def test_replaced_description(self, index):
+        """ Test the description index follows records that are replaced and deleted """
+        index.update_records([("/b/1.dcm", 100, 6, make_record("/b/1.dcm", study_id="S3"))])
+        assert index.find_records(description="brain") == []
+        assert self.paths(index.find_records(description="chest")) == [
+            "/a/1.dcm", "/a/2.dcm", "/b/1.dcm"
+        ]
+        index.delete_missing("/a", [])
+        assert self.paths(index.find_records(description="chest")) == ["/b/1.dcm"]
+
+    def test_existing_database(self, tmp_path, index):
+        """ Test opening a database again keeps the description index """
+        index = MetadataIndexModel(database_path=tmp_path, database_name="test_db.db")
+        assert self.paths(index.find_records(description="brain")) == ["/b/1.dcm"]
+
+    def test_without_full_text_search(self, tmp_path, index):
+        """ Test an SQLite without the trigram tokenizer scans descriptions instead """
+        no_trigram = sqlite3.OperationalError("no such tokenizer: trigram")
+        with patch("src.metadata_index_model._create_description_index", side_effect=no_trigram):
+            index = MetadataIndexModel(database_path=tmp_path, database_name="test_db.db")
+        assert not index.full_text_search
+        # the triggers of the full text index are dropped, so writes still work
+        index.update_records([("/c/1.dcm", 100, 5, make_record("/c/1.dcm", study_id="S4",
+                                                               study_description="Brain MRI"))])
+        index.delete_missing("/a", [])
+        assert self.paths(index.find_records(description="brain")) == ["/b/1.dcm", "/c/1.dcm"]
+        assert [record.study_id for record in index.find_studies(description="brain")] == [
+            "S4", "S2"
+        ]
+
+        # a newer SQLite fills the index in again, with the rows written in the meantime
+        index = MetadataIndexModel(database_path=tmp_path, database_name="test_db.db")
+        assert index.full_text_search
+        assert self.paths(index.find_records(description="brain")) == ["/b/1.dcm", "/c/1.dcm"]
+        assert index.find_records(description="chest") == []
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -0,0 +1,192 @@
+"""Test file for the mpr.py functionality"""
+
+import numpy as np
+import pytest
+from src.compact_volume import CompactVolume
+from src.dicom_scanner import InstanceRecord
+from src.mpr import AXIAL, CORONAL, SAGITTAL, MprVolume, VoxelSpacing, spacing_from_records
+from src.render_target import RenderTarget
+from src.window_level import Rescale, WindowLevel, apply_window
+
+VOLUME = np.random.default_rng(0).integers(0, 4000, (10, 16, 12), dtype=np.uint16)
+SPACING = VoxelSpacing(slices=2.5, rows=0.5, columns=0.5)
+
+
+def record(index, position):
+    """An InstanceRecord of an axial slice at the given height"""
+    return InstanceRecord(
+        path=f"slice{index}.dcm", patient_id="1", study_instance_uid="1.1",
+        series_instance_uid="1.1.1", sop_instance_uid=f"1.1.1.{index}",
+        image_position=(0.0, 0.0, position), image_orientation=(1, 0, 0, 0, 1, 0),
+        pixel_spacing=(0.5, 0.7), slice_thickness=5.0,
+    )
+
+
+class TestMprVolume:
+    """Test class for reformatting and projecting a volume"""
+
+    @pytest.mark.parametrize(
+        "plane, index, expected",
+        [(AXIAL, 3, VOLUME[3]), (CORONAL, 5, VOLUME[::-1, 5, :]),
+         (SAGITTAL, -1, VOLUME[::-1, :, -1])]
+    )
+    def test_slice_is_view(self, plane, index, expected):
+        """Test every plane is a view of the volume buffer rather than a copy"""
+        view = MprVolume(VOLUME, SPACING).get_slice(plane, index)
+        assert np.array_equal(view, expected)
+        assert not view.flags.owndata
+        assert np.shares_memory(view, VOLUME)
+
+    @pytest.mark.parametrize("plane", [CORONAL, SAGITTAL])
+    def test_superior_at_top(self, plane):
+        """Test coronal and sagittal rows show the last (most superior) slice at the top"""
+        # slices sorted by ascending position, brighter towards the head
+        gradient = np.repeat(np.arange(10, dtype=np.uint16) * 100, 16 * 12).reshape(10, 16, 12)
+        mpr = MprVolume(gradient, SPACING)
+        view = mpr.get_slice(plane, 3)
+        assert view[0, 0] == 900 and view[-1, 0] == 0
+        assert np.shares_memory(view, gradient)
+        assert mpr.mip(plane, 0, 4)[0, 0] == 900
+        image = mpr.render(plane, 3, window=WindowLevel(450, 900), target=RenderTarget())
+        # stretched to 50 rows, the top is white and the bottom black
+        assert image.pixelColor(0, 0).value() == 255
+        assert image.pixelColor(0, image.height() - 1).value() == 0
+
+    def test_out_of_range(self):
+        """Test a slice outside the plane raises an IndexError"""
+        with pytest.raises(IndexError):
+            MprVolume(VOLUME).get_slice(SAGITTAL, 12)
+
+    def test_aspect(self):
+        """Test coronal and sagittal pixels are stretched by the slice spacing"""
+        mpr = MprVolume(VOLUME, SPACING)
+        assert mpr.aspect(AXIAL) == 1.0
+        assert mpr.aspect(CORONAL) == 5.0
+        assert mpr.display_shape(CORONAL) == (50, 12)
+        assert mpr.display_shape(SAGITTAL) == (50, 16)
+        assert mpr.display_shape(AXIAL) == (16, 12)
+
+    def test_render_stretched(self):
+        """Test a coronal slice is shown at its display shape"""
+        mpr = MprVolume(VOLUME, SPACING)
+        image = mpr.render(CORONAL, 4, window=WindowLevel(2000, 4000))
+        assert (image.height(), image.width()) == (50, 12)
+
+    def test_render_into_target(self):
+        """Test square pixels go straight through numpy_to_qimage into the target"""
+        target = RenderTarget()
+        window = WindowLevel(2000, 4000)
+        image = MprVolume(VOLUME, SPACING).render(AXIAL, 2, window=window, target=target)
+        assert image is target.image((16, 12))
+        assert np.array_equal(target.buffer((16, 12)), apply_window(VOLUME[2], window, Rescale()))
+
+    @pytest.mark.parametrize("plane, axis", [(AXIAL, 0), (CORONAL, 1), (SAGITTAL, 2)])
+    def test_mip(self, plane, axis):
+        """Test the projection is the maximum over the slab"""
+        projection = MprVolume(VOLUME).mip(plane, 2, 6)
+        expected = np.take(VOLUME, range(2, 6), axis=axis).max(axis=axis)
+        if plane != AXIAL:
+            expected = expected[::-1]
+        assert np.array_equal(projection, expected)
+
+    def test_mip_cached(self):
+        """Test each slab is only projected once"""
+        mpr = MprVolume(VOLUME)
+        first = mpr.mip(AXIAL, 0, 4)
+        assert mpr.mip(AXIAL, 0, 4) is first
+        assert mpr.mip(AXIAL, 1, 5) is not first
+        assert mpr.cache.stats().hits == 1
+
+    def test_shared_cache(self):
+        """Test volumes sharing a cache do not see each other's slabs"""
+        first = MprVolume(VOLUME)
+        second = MprVolume(VOLUME[::-1], cache=first.cache)
+        assert not np.array_equal(first.mip(AXIAL, 0, 2), second.mip(AXIAL, 0, 2))
+
+    def test_render_slab(self):
+        """Test a slab is rendered as its MIP"""
+        target = RenderTarget()
+        window = WindowLevel(2000, 4000)
+        mpr = MprVolume(VOLUME)
+        mpr.render(AXIAL, 5, window=window, target=target, slab=3)
+        assert np.array_equal(
+            target.buffer((16, 12)), apply_window(mpr.mip(AXIAL, 4, 7), window, Rescale())
+        )
+
+    def test_coronal_one_scale(self):
+        """Test rows of a coronal slice from slices with different maxima keep their order"""
+        maxima = [500, 1000, 2000, 4000]
+        volume = CompactVolume(len(maxima), (6, 8), np.int16, rescale=Rescale(1.0, -1024.0))
+        for index, maximum in enumerate(maxima):
+            frame = np.full((6, 8), maximum // 2, dtype=np.int16)
+            frame[0, 0] = maximum
+            volume.set_frame(index, frame)
+        mpr = MprVolume(volume)
+        # the planes are views of the CompactVolume's own array
+        assert mpr.volume is volume.array
+        assert np.shares_memory(mpr.get_slice(CORONAL, 3), volume.array)
+        target = RenderTarget()
+        mpr.render(CORONAL, 3, target=target)
+        # the last slice, with the largest values, is the top row
+        column = target.buffer((4, 8))[:, 4].astype(int)
+        assert np.all(np.diff(column) < 0)
+        # the MIP compares stored values, not values divided by each slice's maximum
+        assert np.array_equal(mpr.mip(AXIAL, 0, 4)[0, :2], [4000, 2000])
+
+    def test_compact_mixed_rescales(self):
+        """Test slices with their own rescale are windowed and projected in modality units"""
+        volume = CompactVolume(2, (4, 4), np.uint16)
+        volume.set_frame(0, np.full((4, 4), 100, dtype=np.uint16), Rescale(2.0, 0.0))
+        volume.set_frame(1, np.full((4, 4), 150, dtype=np.uint16), Rescale(1.0, 0.0))
+        mpr = MprVolume(volume)
+        assert mpr.volume.dtype == np.uint16
+        assert np.all(mpr.mip(AXIAL, 0, 2) == 200.0)
+        assert np.array_equal(mpr.mip(CORONAL, 0, 2), [[150] * 4, [100] * 4])
+
+        window = WindowLevel(175, 50)
+        target = RenderTarget()
+        mpr.render(CORONAL, 1, window=window, target=target)
+        rows = target.buffer((2, 4))
+        # 200 and 150 in modality units, either side of the window centre
+        assert set(rows[0] if rows[0, 0] > rows[1, 0] else rows[1]) == {255}
+        assert rows.min() == 0
+        assert mpr.auto_window() == WindowLevel(175, 50)
+
+    def test_spilled_volume_not_copied(self, tmp_path):
+        """Test a volume over its memory cap is reformatted straight from its scratch file"""
+        volume = CompactVolume(len(VOLUME), VOLUME.shape[1:], np.uint16, max_bytes=1,
+                               scratch_dir=tmp_path)
+        for index, pixels in enumerate(VOLUME):
+            volume.set_frame(index, pixels)
+        mpr = MprVolume(volume)
+        assert isinstance(mpr.volume, np.memmap)
+        assert np.shares_memory(mpr.get_slice(SAGITTAL, 2), volume.array)
+
+    def test_not_3d(self):
+        """Test a single frame is rejected"""
+        with pytest.raises(ValueError):
+            MprVolume(VOLUME[0])
+
+
+class TestSpacing:
+    """Test class for spacing_from_records"""
+
+    def test_from_positions(self):
+        """Test the slice spacing comes from the positions rather than the thickness"""
+        records = [record(index, index * 2.5) for index in range(4)]
+        assert spacing_from_records(records) == VoxelSpacing(slices=2.5, rows=0.5, columns=0.7)
+
+    def test_thickness_fallback(self):
+        """Test SliceThickness is used when slices have no position"""
+        records = [record(0, 0.0), record(1, 0.0)]
+        for item in records:
+            item.image_position = None
+        assert spacing_from_records(records).slices == 5.0
+
+    def test_empty(self):
+        """Test an empty series has 1 mm voxels"""
+        assert spacing_from_records([]) == VoxelSpacing()
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -0,0 +1,82 @@
+"""Test file for the parallel_decode.py functionality"""
+
+import numpy as np
+import pytest
+from pydicom.uid import RLELossless
+from src.parallel_decode import (
+    decode_file, decode_frames, is_compressed, iter_decoded_chunks, stream_decoded_frames
+)
+from src.pixel_memmap import read_dicom_file_mapped
+from src.series_loader import load_series_volume
+from tests.test_pixel_memmap import create_image_dicom
+
+FRAMES = np.arange(9 * 16 * 12, dtype=np.int16).reshape(9, 16, 12) - 500
+
+
+@pytest.fixture
+def rle_dataset(tmp_path):
+    """A nine frame RLE compressed dataset"""
+    path = tmp_path / "multi.dcm"
+    create_image_dicom(path, FRAMES, RLELossless)
+    return read_dicom_file_mapped(path)
+
+
+class TestParallelDecode:
+    """Test class for decoding compressed frames across processes"""
+
+    @pytest.mark.parametrize("max_workers", [1, 2])
+    def test_decode_frames(self, rle_dataset, max_workers):
+        """Test every frame matches the stored pixels, in or out of process"""
+        frames = decode_frames(rle_dataset, max_workers=max_workers)
+        assert frames.dtype == np.int16
+        assert np.array_equal(frames, FRAMES)
+
+    def test_decode_some_frames(self, rle_dataset):
+        """Test only the frames asked for are decoded, in the order asked for"""
+        frames = decode_frames(rle_dataset, indices=[7, 2], max_workers=2)
+        assert np.array_equal(frames, FRAMES[[7, 2]])
+
+    def test_progress(self, rle_dataset):
+        """Test progress counts up to the number of frames in chunks"""
+        progress = [
+            (loaded, total)
+            for _, loaded, total, _
+            in stream_decoded_frames(rle_dataset, max_workers=2, chunk_frames=4)
+        ]
+        assert len(progress) == 3
+        assert progress[-1] == (9, 9)
+
+    def test_uncompressed_rejected(self, tmp_path):
+        """Test uncompressed pixel data is left to the memory map"""
+        path = tmp_path / "plain.dcm"
+        create_image_dicom(path, FRAMES)
+        ds = read_dicom_file_mapped(path)
+        assert not is_compressed(ds)
+        with pytest.raises(ValueError):
+            decode_frames(ds)
+
+    def test_wrong_frame_size(self, tmp_path):
+        """Test a frame of the wrong size raises a ValueError from the worker"""
+        paths = []
+        for index, shape in enumerate([(1, 16, 12), (1, 16, 12), (1, 8, 8)]):
+            path = tmp_path / f"slice{index}.dcm"
+            create_image_dicom(path, np.zeros(shape, dtype=np.uint16), RLELossless)
+            paths.append(str(path))
+        with pytest.raises(ValueError):
+            list(iter_decoded_chunks(decode_file, paths, (16, 12), np.uint16, max_workers=2))
+
+    def test_compressed_series(self, tmp_path):
+        """Test a compressed series is loaded through the process pool and normalized"""
+        slices = np.arange(5 * 16 * 12, dtype=np.uint16).reshape(5, 16, 12) + 1
+        paths = []
+        for index, pixels in enumerate(slices):
+            path = tmp_path / f"slice{index}.dcm"
+            create_image_dicom(path, pixels[np.newaxis], RLELossless)
+            paths.append(path)
+        volume = load_series_volume(paths, max_workers=2)
+        for index, pixels in enumerate(slices):
+            assert np.allclose(volume[index], pixels / pixels.max())
+
+
+if __name__ == "__main__":
+    pytest.main()
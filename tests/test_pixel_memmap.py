@@ -0,0 +1,135 @@
+"""Test file for the pixel_memmap.py functionality"""
+
+import numpy as np
+import pytest
+from pydicom.dataset import Dataset, FileDataset, FileMetaDataset
+from pydicom.uid import (
+    UID, ExplicitVRBigEndian, ExplicitVRLittleEndian, ImplicitVRLittleEndian, RLELossless,
+    generate_uid
+)
+from src.inputs_and_outputs import get_normalized_pixel_array
+from src.pixel_memmap import get_pixel_memmap, read_dicom_file_mapped
+from src.read_dicom_file import read_dicom_file, read_dicom_header, load_pixel_data
+
+
+def create_image_dicom(filename, pixels, transfer_syntax=ExplicitVRLittleEndian,
+                       planar_configuration=0):
+    """Create a DICOM file holding the given (frames, rows, cols[, samples]) pixel array"""
+    file_meta = FileMetaDataset()
+    file_meta.MediaStorageSOPClassUID = UID("1.2.840.10008.5.1.4.1.1.2")
+    file_meta.MediaStorageSOPInstanceUID = generate_uid()
+    file_meta.TransferSyntaxUID = transfer_syntax
+
+    ds = FileDataset(str(filename), {}, file_meta=file_meta, preamble=b"\0" * 128)
+    ds.SOPClassUID = file_meta.MediaStorageSOPClassUID
+    ds.SOPInstanceUID = file_meta.MediaStorageSOPInstanceUID
+    ds.is_little_endian = transfer_syntax != ExplicitVRBigEndian
+    ds.is_implicit_VR = transfer_syntax == ImplicitVRLittleEndian
+
+    color = pixels.ndim == 4
+    ds.NumberOfFrames = pixels.shape[0]
+    ds.Rows, ds.Columns = pixels.shape[1:3]
+    ds.SamplesPerPixel = 3 if color else 1
+    ds.PhotometricInterpretation = "RGB" if color else "MONOCHROME2"
+    if color:
+        ds.PlanarConfiguration = planar_configuration
+        if planar_configuration:
+            pixels = pixels.transpose(0, 3, 1, 2)
+    ds.BitsAllocated = pixels.itemsize * 8
+    ds.BitsStored = ds.BitsAllocated
+    ds.HighBit = ds.BitsStored - 1
+    ds.PixelRepresentation = 1 if pixels.dtype.kind == "i" else 0
+    ds.PixelData = pixels.astype(pixels.dtype.newbyteorder(
+        ">" if transfer_syntax == ExplicitVRBigEndian else "<")).tobytes()
+    if transfer_syntax == RLELossless:
+        ds.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+        ds.compress(RLELossless)
+    ds.save_as(str(filename))
+    return ds
+
+
+class TestPixelMemmap:
+    """Test class for get_pixel_memmap"""
+
+    @pytest.mark.parametrize(
+        "pixels, transfer_syntax, planar_configuration",
+        [
+            (np.arange(3 * 64 * 32, dtype=np.int16).reshape(3, 64, 32) - 1000,
+             ExplicitVRLittleEndian, 0),
+            (np.arange(64 * 32, dtype=np.uint16).reshape(1, 64, 32),
+             ImplicitVRLittleEndian, 0),
+            (np.arange(2 * 16 * 16, dtype=np.uint8).reshape(2, 16, 16),
+             ExplicitVRLittleEndian, 0),
+            (np.arange(16 * 8 * 3, dtype=np.uint8).reshape(1, 16, 8, 3),
+             ExplicitVRLittleEndian, 0),
+            (np.arange(2 * 16 * 8 * 3, dtype=np.uint8).reshape(2, 16, 8, 3),
+             ExplicitVRLittleEndian, 1),
+        ],
+        ids=["signed_multi_frame", "implicit_single_frame", "uint8_multi_frame",
+             "rgb_interleaved", "rgb_planar"]
+    )
+    def test_memmap_matches_pixel_array(self, tmp_path, pixels, transfer_syntax,
+                                        planar_configuration):
+        """Test the memory mapped view has the same dtype, shape and values as pixel_array"""
+        path = tmp_path / "image.dcm"
+        create_image_dicom(path, pixels, transfer_syntax, planar_configuration)
+        ds = read_dicom_file_mapped(path)
+
+        mapped = get_pixel_memmap(ds)
+        expected = read_dicom_file(path).pixel_array
+        assert isinstance(mapped, np.memmap)
+        assert mapped.dtype == expected.dtype
+        assert mapped.shape == expected.shape
+        assert np.array_equal(mapped, expected)
+
+    def test_memmap_after_load_pixel_data(self, tmp_path):
+        """Test pixel data loaded after a header-only read is still memory mapped"""
+        path = tmp_path / "image.dcm"
+        pixels = np.arange(2 * 64 * 64, dtype=np.uint16).reshape(2, 64, 64)
+        create_image_dicom(path, pixels)
+        ds = load_pixel_data(read_dicom_header(path))
+
+        assert np.array_equal(get_pixel_memmap(ds), pixels)
+        # deferred pixel data can still be decoded the normal way
+        assert np.array_equal(ds.pixel_array, pixels)
+
+    @pytest.mark.parametrize(
+        "transfer_syntax", [RLELossless, ExplicitVRBigEndian], ids=["rle", "big_endian"]
+    )
+    def test_unsupported_transfer_syntax(self, tmp_path, transfer_syntax):
+        """Test compressed and big endian pixel data is not memory mapped"""
+        path = tmp_path / "image.dcm"
+        create_image_dicom(path, np.zeros((1, 8, 8), dtype=np.uint16), transfer_syntax)
+        assert get_pixel_memmap(read_dicom_file_mapped(path)) is None
+
+    def test_pixel_data_changed_in_memory(self, tmp_path):
+        """Test pixel data that was replaced in memory is not read from the file"""
+        path = tmp_path / "image.dcm"
+        create_image_dicom(path, np.zeros((1, 8, 8), dtype=np.uint16))
+        ds = read_dicom_file_mapped(path)
+        ds.PixelData = np.ones((8, 8), dtype=np.uint16).tobytes()
+        assert get_pixel_memmap(ds) is None
+
+    def test_no_pixel_data(self, tmp_path):
+        """Test datasets without pixel data or without a file are not memory mapped"""
+        path = tmp_path / "image.dcm"
+        create_image_dicom(path, np.zeros((1, 8, 8), dtype=np.uint16))
+        assert get_pixel_memmap(read_dicom_header(path)) is None
+        assert get_pixel_memmap(Dataset()) is None
+
+    def test_normalized_pixel_array_uses_memmap(self, tmp_path):
+        """Test get_normalized_pixel_array gives the same result through the memmap"""
+        path = tmp_path / "image.dcm"
+        pixels = np.arange(64 * 32, dtype=np.uint16).reshape(1, 64, 32)
+        create_image_dicom(path, pixels)
+        ds = read_dicom_file_mapped(path)
+
+        result = get_normalized_pixel_array(ds)
+        assert result.dtype == np.float32
+        assert np.allclose(result, pixels[0] / pixels.max())
+        # the pixel data was never loaded into the dataset
+        assert not hasattr(ds, "_pixel_array") or ds._pixel_array is None
+
+
+if __name__ == "__main__":
+    pytest.main()
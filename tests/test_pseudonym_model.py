@@ -0,0 +1,40 @@
+""" Test File for the pseudonym_model file """
+import logging
+import pytest
+from src.pseudonym_model import PseudonymModel
+
+logger = logging.getLogger(__name__)
+logger.debug("UnitTests: PseudonymModel")
+
+
+class TestPseudonymModel:
+    """ Test Class for PseudonymModel """
+    @pytest.fixture
+    def model(self, tmp_path):
+        """ Fixture to set up and Teardown tests """
+        logging.info('Setting up test pseudonym model fixture')
+        yield PseudonymModel(database_path=tmp_path, database_name="test_db.db")
+        logging.info('Teardown test pseudonym model fixture')
+
+    def test_create_table(self, model):
+        """ Test Method for create Table method """
+        assert model.create_table()
+
+    def test_namespace_persisted(self, tmp_path, model):
+        """ Test the namespace is created once and kept between connections """
+        namespace = model.get_namespace()
+        assert model.get_namespace() == namespace
+        reopened = PseudonymModel(database_path=tmp_path, database_name="test_db.db")
+        assert reopened.get_namespace() == namespace
+
+    def test_mappings(self, model):
+        """ Test a mapping can be looked up both ways and is not overwritten """
+        assert model.add_mappings([("P1", "uuid-1"), ("P2", "uuid-2")])
+        model.add_mappings([("P1", "uuid-1")])
+        assert model.get_pseudonym("P1") == "uuid-1"
+        assert model.get_patient_id("uuid-2") == "P2"
+        assert model.get_pseudonym("P3") is None
+
+
+if __name__ == "__main__":
+    pytest.main()
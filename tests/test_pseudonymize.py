@@ -0,0 +1,148 @@
+"""Test file for the pseudonymize.py functionality"""
+
+import io
+import json
+import os
+import uuid
+from unittest.mock import patch
+
+import numpy as np
+import pydicom
+import pytest
+from pydicom.uid import (
+    DeflatedExplicitVRLittleEndian, ExplicitVRBigEndian, ExplicitVRLittleEndian,
+    ImplicitVRLittleEndian, RLELossless,
+)
+from src.dicom_utils import extract_patient_info
+from src.pseudonym_model import PseudonymModel
+from src.pseudonymize import (
+    FAILED, PSEUDONYMIZED, main, pseudonym_for, pseudonymize_directory, pseudonymize_file,
+)
+from tests.test_pixel_memmap import create_image_dicom
+
+FRAMES = np.arange(3 * 16 * 12, dtype=np.uint16).reshape(3, 16, 12)
+NAMESPACE = uuid.UUID("12345678-1234-5678-1234-567812345678")
+
+
+def create_patient_dicom(filename, patient_id, transfer_syntax=ExplicitVRLittleEndian):
+    """Create a multi-frame DICOM file with identifying patient details"""
+    create_image_dicom(filename, FRAMES, transfer_syntax)
+    ds = pydicom.dcmread(filename)
+    ds.PatientID = patient_id
+    ds.PatientName = "Doe^John"
+    ds.PatientBirthDate = "19800101"
+    ds.OtherPatientIDs = "MRN-" + patient_id
+    ds.save_as(filename)
+    return ds
+
+
+class TestPseudonymizeFile:
+    """Test class for pseudonymizing a single file"""
+
+    @pytest.mark.parametrize("transfer_syntax", [
+        ExplicitVRLittleEndian, ImplicitVRLittleEndian, ExplicitVRBigEndian, RLELossless,
+        DeflatedExplicitVRLittleEndian,
+    ])
+    def test_identifiers_replaced(self, tmp_path, transfer_syntax):
+        """Test the identifiers are replaced and the pixel data is kept byte for byte"""
+        source, destination = tmp_path / "in.dcm", tmp_path / "out" / "out.dcm"
+        create_patient_dicom(source, "P1", transfer_syntax)
+
+        patient_id, pseudonym = pseudonymize_file(source, destination, NAMESPACE)
+        assert (patient_id, pseudonym) == ("P1", pseudonym_for(NAMESPACE, "P1"))
+
+        original, copy = pydicom.dcmread(source), pydicom.dcmread(destination)
+        assert copy.PatientID == pseudonym
+        assert "OtherPatientIDs" not in copy
+        assert copy.PatientIdentityRemoved == "YES"
+        assert copy.file_meta.TransferSyntaxUID == transfer_syntax
+        assert copy.PixelData == original.PixelData
+        assert np.array_equal(copy.pixel_array, FRAMES)
+        # shown as anonymized by the viewer
+        assert extract_patient_info(copy).given_name == "Anonymous"
+
+    def test_pixels_never_decoded(self, tmp_path):
+        """Test the pixel data is copied without being decoded"""
+        source, destination = tmp_path / "in.dcm", tmp_path / "out.dcm"
+        create_patient_dicom(source, "P1", RLELossless)
+        with patch.object(
+            pydicom.dataset.Dataset, "convert_pixel_data", side_effect=AssertionError
+        ):
+            pseudonymize_file(source, destination, NAMESPACE)
+        assert pydicom.dcmread(destination).PixelData == pydicom.dcmread(source).PixelData
+
+    def test_not_dicom(self, tmp_path):
+        """Test a file that is not DICOM raises and nothing is written"""
+        source = tmp_path / "notes.txt"
+        source.write_text("not a DICOM file")
+        with pytest.raises(Exception):
+            pseudonymize_file(source, tmp_path / "out" / "notes.txt", NAMESPACE)
+        assert not (tmp_path / "out").exists()
+
+
+class TestPseudonymizeDirectory:
+    """Test class for pseudonymizing a folder tree"""
+
+    @pytest.fixture
+    def source(self, tmp_path):
+        """A tree of two patients in nested folders and a file that is not DICOM"""
+        source = tmp_path / "export"
+        (source / "study" / "series").mkdir(parents=True)
+        create_patient_dicom(source / "study" / "series" / "1.dcm", "P1")
+        create_patient_dicom(source / "study" / "series" / "2.dcm", "P1", RLELossless)
+        create_patient_dicom(source / "3.dcm", "P2")
+        (source / "notes.txt").write_text("not a DICOM file")
+        return source
+
+    @pytest.fixture
+    def model(self, tmp_path):
+        """The mapping database"""
+        return PseudonymModel(database_path=tmp_path, database_name="mapping.db")
+
+    def test_directory(self, tmp_path, source, model):
+        """Test every DICOM file is copied with stable pseudonyms and the mapping is kept"""
+        destination = tmp_path / "pseudonymized"
+        report = io.StringIO()
+        summary = pseudonymize_directory(source, destination, model, report, max_workers=2)
+        assert (summary.pseudonymized, summary.failed) == (3, 1)
+        assert summary.bytes_written > 0
+
+        first = pydicom.dcmread(destination / "study" / "series" / "1.dcm")
+        second = pydicom.dcmread(destination / "study" / "series" / "2.dcm")
+        third = pydicom.dcmread(destination / "3.dcm")
+        assert first.PatientID == second.PatientID != third.PatientID
+        assert not (destination / "notes.txt").exists()
+        assert model.get_patient_id(first.PatientID) == "P1"
+        assert model.get_pseudonym("P2") == third.PatientID
+
+        entries = [json.loads(line) for line in report.getvalue().splitlines()]
+        assert sorted(entry["status"] for entry in entries) == [FAILED] + [PSEUDONYMIZED] * 3
+        assert "P1" not in report.getvalue()
+
+    def test_same_pseudonym_next_run(self, tmp_path, source, model):
+        """Test a second run with the same database gives the same pseudonyms"""
+        pseudonymize_directory(source, tmp_path / "first", model, max_workers=1)
+        pseudonymize_directory(source, tmp_path / "second", model, max_workers=1)
+        assert pydicom.dcmread(tmp_path / "first" / "3.dcm").PatientID == (
+            pydicom.dcmread(tmp_path / "second" / "3.dcm").PatientID
+        )
+
+    def test_destination_inside_source(self, source, model):
+        """Test the copies can not be written into the tree being read"""
+        with pytest.raises(ValueError):
+            pseudonymize_directory(source, source / "out", model)
+
+    def test_main(self, tmp_path, source, capsys):
+        """Test the command line reports the failed file through its exit code"""
+        destination = tmp_path / "pseudonymized"
+        database = tmp_path / "cli.db"
+        with patch("src.pseudonymize.configure_logging") as configure_logging:
+            assert main([str(source), str(destination), "--database", str(database),
+                         "--workers", "1"]) == 1
+        configure_logging.assert_called_once_with("src.pseudonymize")
+        assert "3 pseudonymized, 1 failed" in capsys.readouterr().err
+        assert os.path.exists(destination / "3.dcm")
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -5,8 +5,12 @@ import logging
 import os
 import pydicom
 from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.sequence import Sequence
 from pydicom.uid import UID, ExplicitVRLittleEndian
-from src.read_dicom_file import read_dicom_file
+from src.dicom_utils import extract_patient_info, validate_dicom
+from src.read_dicom_file import (
+    read_dicom_file, read_dicom_header, load_pixel_data, requires_tags, tag_union
+)
 
 
 # Information about generating DICOM data can be found here;
@@ -33,6 +37,20 @@ def create_valid_dicom(filename):
     ds.save_as(filename)
 
 
+def create_private_sequence_dicom(filename, items=200):
+    """Create a valid DICOM file ending in a large undefined length private sequence"""
+    create_valid_dicom(filename)
+    ds = pydicom.dcmread(filename)
+    ds.Modality = "CT"
+    ds.StudyID = "1"
+    sequence = []
+    for _ in range(items):
+        item = Dataset()
+        item.add_new(0x00291001, "LO", "PRIVATE" * 8)
+        sequence.append(item)
+    ds.add_new(0x00291010, "SQ", Sequence(sequence))
+    ds[0x00291010].is_undefined_length = True
+    ds.save_as(filename)
 
 def create_headerless_dicom(filename):
     """Create a DICOM file without proper header metadata"""
@@ -129,5 +147,90 @@ class TestReadDicomFile:
         result = read_dicom_file("non_existant_file.dcm")
         assert result is None
 
+    def test_read_header_only(self):
+        """Test that a header-only read stops before the pixel data"""
+        result = read_dicom_header(self.headerless_dcm)
+        assert isinstance(result, Dataset)
+        assert result.PatientID == "67890"
+        assert result.Modality == "CT"
+        assert "PixelData" not in result
+
+    def test_read_specific_tags(self):
+        """Test that only the requested tags are read"""
+        result = read_dicom_file(self.headerless_dcm, specific_tags=["PatientID", "Modality"])
+        assert result.PatientID == "67890"
+        assert result.Modality == "CT"
+        assert "PatientName" not in result
+        assert "PixelData" not in result
+
+    def test_header_only_invalid_file(self):
+        """Test that header-only reads still reject invalid files"""
+        assert read_dicom_header(self.invalid_dcm) is None
+        assert read_dicom_header(self.empty_file) is None
+
+    def test_load_pixel_data(self):
+        """Test that pixel data can be loaded after a header-only read"""
+        header = read_dicom_header(self.headerless_dcm)
+        result = load_pixel_data(header)
+        # the header may be shared through a cache, so it is left as it was
+        assert "PixelData" not in header
+        assert "PixelData" in result
+        assert result.PixelData == b"\x00" * 100
+
+    def test_load_pixel_data_already_loaded(self):
+        """Test that a fully read dataset is returned unchanged"""
+        full = read_dicom_file(self.headerless_dcm)
+        assert load_pixel_data(full) is full
+
+    def test_load_pixel_data_missing_file(self):
+        """Test that load_pixel_data returns None when the file has gone"""
+        assert load_pixel_data(Dataset()) is None
+
+class TestRequiredTags:
+    """Test class for declared tag sets and reads that stop after the last declared tag"""
+
+    def test_declared_tags(self):
+        """Test the dataset consumers declare the tags they read"""
+        assert validate_dicom.required_tags == (
+            "StudyID", "StudyDescription", "ImageType", "Modality"
+        )
+        assert "PatientBirthDate" in extract_patient_info.required_tags
+
+    def test_tag_union(self):
+        """Test the union keeps the first seen order and drops repeats"""
+
+        @requires_tags("PatientID", "Modality")
+        def consumer(ds):
+            return ds
+
+        assert consumer(1) == 1
+        assert tag_union(["Rows", "Modality"], consumer) == ["Rows", "Modality", "PatientID"]
+
+    def test_stops_after_last_tag(self, tmp_path):
+        """Test a private sequence after the requested tags is never parsed"""
+        path = tmp_path / "private.dcm"
+        create_private_sequence_dicom(path)
+        # cut the file off in the middle of the sequence, a full walk would fail on it
+        with open(path, "r+b") as file:
+            file.truncate(os.path.getsize(path) - 500)
+        assert read_dicom_file(path) is None
+
+        result = read_dicom_header(path, specific_tags=["PatientID", "Modality"])
+        assert result.PatientID == "12345"
+        assert result.Modality == "CT"
+        assert "PatientName" not in result
+        assert result.filename == str(path)
+
+    def test_same_as_full_read(self, tmp_path):
+        """Test the early stop reads the same values as a full read"""
+        path = tmp_path / "private.dcm"
+        create_private_sequence_dicom(path)
+        tags = tag_union(extract_patient_info, ["StudyID"])
+        partial = read_dicom_header(path, specific_tags=tags)
+        full = read_dicom_file(path)
+        assert extract_patient_info(partial) == extract_patient_info(full)
+        assert partial.StudyID == full.StudyID
+        assert 0x00291010 not in partial
+
 if __name__ == '__main__':
     pytest.main()
@@ -0,0 +1,79 @@
+"""Test file for the render_target.py functionality"""
+
+import gc
+
+import numpy as np
+import pytest
+from src.dicom_utils import numpy_to_qimage
+from src.render_target import RenderTarget
+
+
+def pixel(image, x, y):
+    """Grey value of a pixel of a Grayscale8 QImage"""
+    return image.pixelColor(x, y).red()
+
+
+class TestRenderTarget:
+    """Test class for RenderTarget"""
+
+    def test_buffer_reused(self):
+        """Test frames of the same size are written into the same buffer and QImage"""
+        target = RenderTarget()
+        first = target.render(np.zeros((4, 6), dtype=np.uint8))
+        buffer = target.buffer((4, 6))
+        again = target.render(np.full((4, 6), 9, dtype=np.uint8))
+        assert again is first
+        assert target.buffer((4, 6)) is buffer
+        assert pixel(again, 5, 3) == 9
+        assert (again.width(), again.height()) == (6, 4)
+
+    def test_normalized_input(self):
+        """Test values in [0, 1] are scaled, clipped and truncated like before"""
+        target = RenderTarget()
+        pixels = np.array([[0.0, 0.5, 1.0, 2.0]], dtype=np.float32)
+        target.render(pixels)
+        expected = (255 * pixels).clip(0, 255).astype(np.uint8)
+        assert np.array_equal(target.buffer((1, 4)), expected)
+
+    def test_image_outlives_input(self):
+        """Test the QImage does not point at the array it was rendered from"""
+        target = RenderTarget()
+        pixels = np.full((3, 3), 200, dtype=np.uint8)
+        image = target.render(pixels)
+        del pixels
+        gc.collect()
+        assert pixel(image, 1, 1) == 200
+
+    def test_sizes_dropped(self):
+        """Test only the most recently used viewport sizes are kept"""
+        target = RenderTarget(max_sizes=2)
+        small = target.buffer((2, 2))
+        target.buffer((3, 3))
+        assert target.buffer((2, 2)) is small
+        target.buffer((4, 4))
+        assert target.buffer((2, 2)) is small
+        assert len(target._buffers) == 2  # pylint: disable=protected-access
+
+
+class TestNumpyToQImage:
+    """Test class for numpy_to_qimage with and without a RenderTarget"""
+
+    def test_without_target_owns_pixels(self):
+        """Test the QImage keeps its own copy when no target is given"""
+        pixels = np.full((2, 2), 0.5, dtype=np.float32)
+        image = numpy_to_qimage(pixels)
+        pixels[:] = 1.0
+        del pixels
+        gc.collect()
+        assert pixel(image, 0, 0) == 127
+
+    def test_with_target(self):
+        """Test the frame is written into the target's buffer"""
+        target = RenderTarget()
+        image = numpy_to_qimage(np.full((2, 5), 42, dtype=np.uint8), target=target)
+        assert image is target.image((2, 5))
+        assert pixel(image, 4, 1) == 42
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -0,0 +1,155 @@
+"""Test file for the series_loader.py functionality"""
+
+import numpy as np
+import pytest
+from unittest.mock import patch
+from pydicom.uid import RLELossless
+from src.series_loader import (
+    load_compact_series_volume, load_series_volume, stream_compact_series_volume,
+    stream_series_volume
+)
+from tests.test_pixel_memmap import create_image_dicom
+
+SLICES = np.arange(4 * 16 * 12, dtype=np.uint16).reshape(4, 16, 12) + 1
+
+
+@pytest.fixture
+def series_paths(tmp_path):
+    """A four slice series, every other slice compressed"""
+    paths = []
+    for index, pixels in enumerate(SLICES):
+        path = tmp_path / f"slice{index}.dcm"
+        if index % 2:
+            create_image_dicom(path, pixels[np.newaxis], RLELossless)
+        else:
+            create_image_dicom(path, pixels[np.newaxis])
+        paths.append(path)
+    return paths
+
+
+class TestSeriesLoader:
+    """Test class for stream_series_volume"""
+
+    def test_stream_progress(self, series_paths):
+        """Test progress is yielded for each slice into the same preallocated volume"""
+        progress = list(stream_series_volume(series_paths, max_workers=2))
+        assert [(loaded, total) for _, loaded, total in progress] == [(1, 4), (2, 4), (3, 4), (4, 4)]
+        volume = progress[0][0]
+        assert all(item[0] is volume for item in progress)
+        assert volume.shape == (4, 16, 12)
+        assert volume.dtype == np.float32
+
+    def test_slices_normalized_in_order(self, series_paths):
+        """Test each slice is normalized into its own place in the volume"""
+        volume = load_series_volume(series_paths)
+        for index, pixels in enumerate(SLICES):
+            assert np.allclose(volume[index], pixels / pixels.max())
+
+    def test_no_stack(self, series_paths):
+        """Test the volume is assembled without np.stack"""
+        with patch("numpy.stack", side_effect=AssertionError("np.stack used")):
+            load_series_volume(series_paths)
+
+    def test_mismatched_slice(self, series_paths, tmp_path):
+        """Test a slice of a different size raises a ValueError"""
+        odd = tmp_path / "odd.dcm"
+        create_image_dicom(odd, np.ones((1, 8, 8), dtype=np.uint16))
+        with pytest.raises(ValueError, match="expected"):
+            load_series_volume([*series_paths, odd])
+
+    def test_unreadable_slice(self, series_paths, tmp_path):
+        """Test a slice that can not be read raises a ValueError"""
+        invalid = tmp_path / "invalid.dcm"
+        invalid.write_text("This is not a DICOM file")
+        with pytest.raises(ValueError, match="Could not read slice"):
+            load_series_volume([*series_paths, invalid])
+
+    def test_empty_series(self):
+        """Test an empty series raises a ValueError"""
+        with pytest.raises(ValueError):
+            next(stream_series_volume([]))
+
+    def test_close_early(self, series_paths):
+        """Test the generator can be stopped before every slice has loaded"""
+        stream = stream_series_volume(series_paths, max_workers=1)
+        _, loaded, total = next(stream)
+        stream.close()
+        assert (loaded, total) == (1, 4)
+
+
+
+class TestCompactSeriesLoader:
+    """Test class for stream_compact_series_volume"""
+
+    def test_stored_values(self, series_paths):
+        """Test slices keep their stored dtype and values instead of being normalized"""
+        progress = list(stream_compact_series_volume(series_paths, max_workers=2))
+        assert [loaded for _, loaded, _ in progress] == [1, 2, 3, 4]
+        volume = progress[-1][0]
+        assert volume.shape == (4, 16, 12)
+        assert volume.dtype == np.uint16
+        for index, pixels in enumerate(SLICES):
+            assert np.array_equal(volume.get_frame(index), pixels)
+
+    def test_rescale_per_slice(self, tmp_path):
+        """Test each slice keeps its own rescale, applied only when asked for"""
+        paths = []
+        for index in range(2):
+            path = tmp_path / f"slice{index}.dcm"
+            ds = create_image_dicom(path, SLICES[index:index + 1])
+            ds.RescaleSlope = index + 1
+            ds.RescaleIntercept = -1024
+            ds.save_as(str(path))
+            paths.append(path)
+        *_, (volume, _, _) = stream_compact_series_volume(paths)
+        assert volume.rescale(1).slope == 2.0
+        assert np.array_equal(volume.get_rescaled_frame(1), SLICES[1] * 2.0 - 1024)
+
+    @pytest.mark.parametrize("max_workers", [1, 2])
+    def test_compressed_rescale_per_slice(self, tmp_path, max_workers):
+        """Test compressed slices decoded in other processes keep their own rescale"""
+        paths = []
+        for index in range(2):
+            path = tmp_path / f"slice{index}.dcm"
+            ds = create_image_dicom(path, SLICES[index:index + 1], RLELossless)
+            ds.RescaleSlope = [0.5, 2.0][index]
+            ds.RescaleIntercept = -1024
+            ds.save_as(str(path))
+            paths.append(path)
+        volume = load_compact_series_volume(paths, max_workers=max_workers)
+        assert volume.slopes.tolist() == [0.5, 2.0]
+        assert np.array_equal(volume.get_rescaled_frame(1), SLICES[1] * 2.0 - 1024)
+
+    def test_memory_cap(self, series_paths, tmp_path):
+        """Test a series over the memory cap is loaded into a scratch file and still readable"""
+        slice_bytes = SLICES[0].nbytes
+        *_, (volume, _, _) = stream_compact_series_volume(
+            series_paths, max_workers=1, max_bytes=2 * slice_bytes, scratch_dir=tmp_path
+        )
+        assert volume.spilled
+        assert volume.nbytes_in_memory == 0
+        for index, pixels in enumerate(SLICES):
+            assert np.array_equal(volume.get_frame(index), pixels)
+
+    def test_load_compact(self, series_paths, tmp_path):
+        """Test the whole series is loaded into one CompactVolume with the memory cap passed on"""
+        volume = load_compact_series_volume(
+            series_paths, max_workers=1, max_bytes=SLICES[0].nbytes, scratch_dir=tmp_path
+        )
+        assert volume.max_bytes == SLICES[0].nbytes
+        for index, pixels in enumerate(SLICES):
+            assert np.array_equal(volume.get_frame(index), pixels)
+
+    def test_compressed_series(self, tmp_path):
+        """Test a compressed series is decoded in processes into the stored dtype"""
+        paths = []
+        for index in range(3):
+            path = tmp_path / f"slice{index}.dcm"
+            create_image_dicom(path, SLICES[index:index + 1], RLELossless)
+            paths.append(path)
+        *_, (volume, _, _) = stream_compact_series_volume(paths, max_workers=2)
+        assert np.array_equal(volume.get_frame(2), SLICES[2])
+
+
+if __name__ == "__main__":
+    pytest.main()
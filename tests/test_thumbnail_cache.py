@@ -0,0 +1,122 @@
+"""Test file for the thumbnail_cache.py functionality"""
+
+import os
+
+import numpy as np
+import pytest
+from unittest.mock import patch
+from src.dicom_scanner import read_instance_record
+from src.pixel_memmap import read_dicom_file_mapped
+from src.thumbnail_cache import ThumbnailCache, make_thumbnail
+from tests.test_pixel_memmap import create_image_dicom
+
+PIXELS = np.arange(512 * 384, dtype=np.uint16).reshape(1, 512, 384)
+
+
+@pytest.fixture
+def dicom_path(tmp_path):
+    """A 512 x 384 grayscale file"""
+    path = tmp_path / "image.dcm"
+    create_image_dicom(path, PIXELS)
+    return path
+
+
+class TestMakeThumbnail:
+    """Test class for make_thumbnail"""
+
+    def test_size(self, dicom_path):
+        """Test the longest side is shrunk to the thumbnail size"""
+        thumbnail = make_thumbnail(read_dicom_file_mapped(dicom_path), size=128)
+        assert thumbnail.dtype == np.uint8
+        assert thumbnail.shape == (128, 96)
+
+    def test_normalized(self, dicom_path):
+        """Test the thumbnail is the normalized frame, averaged over blocks"""
+        thumbnail = make_thumbnail(read_dicom_file_mapped(dicom_path), size=128)
+        normalized = PIXELS[0] / PIXELS.max()
+        assert thumbnail[0, 0] == int(normalized[:4, :4].mean() * 255)
+        assert thumbnail[-1, -1] == int(normalized[-4:, -4:].mean() * 255)
+
+    def test_small_frame_kept(self, tmp_path):
+        """Test frames smaller than the thumbnail are not enlarged"""
+        path = tmp_path / "small.dcm"
+        create_image_dicom(path, np.ones((1, 20, 30), dtype=np.uint8))
+        assert make_thumbnail(read_dicom_file_mapped(path)).shape == (20, 30)
+
+
+class TestThumbnailCache:
+    """Test class for ThumbnailCache"""
+
+    def test_put_get(self, tmp_path):
+        """Test a stored thumbnail is found by UID and mtime only"""
+        cache = ThumbnailCache(tmp_path / "thumbnails")
+        thumbnail = np.full((4, 4), 7, dtype=np.uint8)
+        cache.put("1.2.3", 100, thumbnail)
+        assert np.array_equal(cache.get("1.2.3", 100), thumbnail)
+        assert cache.get("1.2.3", 200) is None
+        assert cache.get("1.2.4", 100) is None
+
+    @pytest.mark.parametrize("uid", ["../../outside", "/tmp/outside", "1.2.*", "x\\..\\y"])
+    def test_uid_stays_in_folder(self, tmp_path, uid):
+        """Test a UID read from a file can not name a path outside the folder"""
+        directory = tmp_path / "a" / "thumbnails"
+        cache = ThumbnailCache(directory)
+        other = ThumbnailCache(tmp_path / "other")
+        other.put("1.2.3", 100, np.zeros((2, 2), dtype=np.uint8))
+        path = cache.path_for(uid, 100)
+        assert path.resolve().parent.parent == directory.resolve()
+        cache.put(uid, 100, np.ones((2, 2), dtype=np.uint8))
+        assert np.array_equal(cache.get(uid, 100), np.ones((2, 2), dtype=np.uint8))
+        assert other.get("1.2.3", 100) is not None
+        assert {path.parent.parent for path in tmp_path.rglob("*.npy")} == {
+            directory, tmp_path / "other"
+        }
+
+    def test_stale_replaced(self, tmp_path):
+        """Test storing a newer version removes the thumbnail of the old one"""
+        cache = ThumbnailCache(tmp_path / "thumbnails")
+        cache.put("1.2.3", 100, np.zeros((2, 2), dtype=np.uint8))
+        cache.put("1.2.3", 200, np.ones((2, 2), dtype=np.uint8))
+        assert cache.get("1.2.3", 100) is None
+        assert len(list((tmp_path / "thumbnails").rglob("*.npy"))) == 1
+
+    def test_record_hit_skips_file(self, tmp_path, dicom_path):
+        """Test a thumbnail is painted from the store without opening the DICOM file again"""
+        cache = ThumbnailCache(tmp_path / "thumbnails")
+        record = read_instance_record(str(dicom_path))
+        first = cache.for_record(record)
+        with patch("src.thumbnail_cache.read_dicom_file_mapped") as read:
+            again = cache.for_record(record)
+        read.assert_not_called()
+        assert np.array_equal(first, again)
+
+    def test_changed_file(self, tmp_path, dicom_path):
+        """Test a file with a new mtime gets a new thumbnail"""
+        cache = ThumbnailCache(tmp_path / "thumbnails")
+        first = cache.get_or_create(dicom_path)
+        create_image_dicom(dicom_path, PIXELS[:, ::-1])
+        stat = os.stat(dicom_path)
+        os.utime(dicom_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        second = cache.get_or_create(dicom_path)
+        assert not np.array_equal(first, second)
+
+    def test_not_an_image(self, tmp_path):
+        """Test files without readable pixel data have no thumbnail"""
+        path = tmp_path / "invalid.dcm"
+        path.write_text("This is not a DICOM file")
+        assert ThumbnailCache(tmp_path / "thumbnails").get_or_create(path) is None
+
+    def test_series(self, tmp_path):
+        """Test a series is shown by its middle instance"""
+        records = []
+        for index in range(3):
+            path = tmp_path / f"slice{index}.dcm"
+            create_image_dicom(path, np.full((1, 8, 8), index, dtype=np.uint8))
+            records.append(read_instance_record(str(path)))
+        cache = ThumbnailCache(tmp_path / "thumbnails")
+        assert np.array_equal(cache.for_series(records), cache.for_record(records[1]))
+        assert cache.for_series([]) is None
+
+
+if __name__ == "__main__":
+    pytest.main()
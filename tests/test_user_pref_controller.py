@@ -6,6 +6,9 @@ from typing import Any, Generator
 import pytest
 from src.user_pref_controller import UserPrefController
 from src.user_pref_model import UserPrefModel
+from src.metadata_index_model import MetadataIndexModel
+from src.thumbnail_cache import ThumbnailCache
+from src.pseudonym_model import PseudonymModel
 
 logger = logging.getLogger(__name__)
 logger.debug("UnitTests: UserPrefModel")
@@ -95,6 +98,41 @@ class TestUserPrefController:
         base_fixture.create_database_connection()
         assert isinstance(base_fixture.database, UserPrefModel)
 
+    def test_create_metadata_index(
+            self,
+            base_fixture: UserPrefController
+    ) -> None:
+        """ Testing the metadata index shares the user preferences database """
+        metadata_index = base_fixture.create_metadata_index()
+        assert isinstance(metadata_index, MetadataIndexModel)
+        assert metadata_index.database_location == (
+            base_fixture.db_location / base_fixture.database_name
+        )
+        assert base_fixture.create_metadata_index() is metadata_index
+
+    def test_create_thumbnail_cache(
+            self,
+            base_fixture: UserPrefController
+    ) -> None:
+        """ Testing the thumbnail store is kept inside the .onko directory """
+        thumbnail_cache = base_fixture.create_thumbnail_cache()
+        assert isinstance(thumbnail_cache, ThumbnailCache)
+        assert thumbnail_cache.directory == base_fixture.db_location / "thumbnails"
+        assert thumbnail_cache.directory.is_dir()
+        assert base_fixture.create_thumbnail_cache() is thumbnail_cache
+
+    def test_create_pseudonym_model(
+            self,
+            base_fixture: UserPrefController
+    ) -> None:
+        """ Testing the pseudonym mapping shares the user preferences database """
+        pseudonym_model = base_fixture.create_pseudonym_model()
+        assert isinstance(pseudonym_model, PseudonymModel)
+        assert pseudonym_model.database_location == (
+            base_fixture.db_location / base_fixture.database_name
+        )
+        assert base_fixture.create_pseudonym_model() is pseudonym_model
+
     def test_set_default_directory(
             self,
             tmp_path,
@@ -0,0 +1,268 @@
+"""Test file for the window_level.py functionality"""
+
+import tracemalloc
+
+import numpy as np
+import pytest
+from pydicom.dataset import Dataset
+from src.dicom_utils import numpy_to_qimage
+from src.dicom_cache import DicomCache
+from src.dicom_volume import SeriesVolume
+from src.window_level import (
+    PixelHistogram, Rescale, WindowedFrame, WindowLevel, apply_window, auto_window,
+    default_window, drag_window, frame_histogram, get_lut, get_windowed_pixel_array,
+    pixel_histogram, rescale_from_dataset, volume_histogram, window_from_dataset, window_values,
+)
+from src.pixel_memmap import read_dicom_file_mapped
+from tests.test_pixel_memmap import create_image_dicom
+
+CT_RESCALE = Rescale(slope=1.0, intercept=-1024.0)
+SOFT_TISSUE = WindowLevel(center=40.0, width=400.0)
+
+
+class TestWindowLevel:
+    """Test class for the lookup table window/level engine"""
+
+    @pytest.mark.parametrize("dtype", [np.uint8, np.uint16, np.int16])
+    def test_lut_matches_arithmetic(self, dtype):
+        """Test the table gather gives the same bytes as windowing the values directly"""
+        info = np.iinfo(dtype)
+        pixels = np.linspace(info.min, info.max, 64 * 64).astype(dtype).reshape(64, 64)
+        rescale = Rescale(slope=2.0, intercept=-1024.0)
+        expected = window_values(pixels * rescale.slope + rescale.intercept, SOFT_TISSUE)
+
+        result = apply_window(pixels, SOFT_TISSUE, rescale)
+        assert result.dtype == np.uint8
+        assert np.array_equal(result, expected)
+
+    def test_lut_allocation(self):
+        """Test windowing into a buffer only allocates a block of indices, not one per pixel"""
+        pixels = np.arange(1024 * 1024, dtype=np.uint32).astype(np.int16).reshape(1024, 1024)
+        out = np.empty(pixels.shape, dtype=np.uint8)
+        expected = window_values(pixels * CT_RESCALE.slope + CT_RESCALE.intercept, SOFT_TISSUE)
+        apply_window(pixels, SOFT_TISSUE, CT_RESCALE, out=out)  # builds the cached table
+
+        tracemalloc.start()
+        try:
+            result = apply_window(pixels, SOFT_TISSUE, CT_RESCALE, out=out)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        assert result is out
+        assert np.array_equal(out, expected)
+        # an intp copy of every index would be 8 MB
+        assert peak < 1024 * 1024
+
+    def test_window_edges(self):
+        """Test values below the window are black and above it are white"""
+        stored = np.array([[0, 1024 + 40, 4000]], dtype=np.uint16)
+        result = apply_window(stored, SOFT_TISSUE, CT_RESCALE)
+        assert result[0, 0] == 0
+        assert 120 <= result[0, 1] <= 135
+        assert result[0, 2] == 255
+
+    def test_lut_cached(self):
+        """Test the table is built once per dtype, window and rescale"""
+        get_lut.cache_clear()
+        first = get_lut(np.dtype(np.int16), SOFT_TISSUE, CT_RESCALE)
+        again = get_lut(np.dtype(np.int16), WindowLevel(40.0, 400.0), Rescale(1.0, -1024.0))
+        assert again is first
+        assert get_lut.cache_info().hits == 1
+        assert not first.flags.writeable
+        assert get_lut(np.dtype(np.int16), WindowLevel(50.0, 400.0), CT_RESCALE) is not first
+
+    def test_invert(self):
+        """Test MONOCHROME1 data is inverted"""
+        pixels = np.arange(16, dtype=np.uint16).reshape(4, 4) * 100
+        window = WindowLevel(750.0, 1500.0)
+        assert np.array_equal(
+            apply_window(pixels, window, invert=True), 255 - apply_window(pixels, window)
+        )
+
+    def test_float_fallback(self):
+        """Test data without a table is windowed arithmetically"""
+        pixels = np.array([[-2000.0, 40.0, 2000.0]], dtype=np.float32)
+        result = apply_window(pixels, SOFT_TISSUE)
+        assert result.dtype == np.uint8
+        assert (result[0, 0], result[0, 2]) == (0, 255)
+
+    def test_out(self):
+        """Test the result can be written into an existing buffer"""
+        pixels = np.arange(12, dtype=np.uint16).reshape(3, 4)
+        out = np.empty((3, 4), dtype=np.uint8)
+        assert apply_window(pixels, WindowLevel(6.0, 12.0), out=out) is out
+
+    def test_window_from_dataset(self):
+        """Test the first of several stored windows is used"""
+        ds = Dataset()
+        assert window_from_dataset(ds) is None
+        ds.WindowCenter = [40, 400]
+        ds.WindowWidth = [400, 1500]
+        assert window_from_dataset(ds) == WindowLevel(40.0, 400.0)
+        ds.WindowCenter = 50
+        ds.WindowWidth = 350
+        assert window_from_dataset(ds) == WindowLevel(50.0, 350.0)
+
+    def test_rescale_from_dataset(self):
+        """Test the rescale defaults to the identity"""
+        ds = Dataset()
+        assert rescale_from_dataset(ds) == Rescale()
+        ds.RescaleSlope = 1
+        ds.RescaleIntercept = -1024
+        assert rescale_from_dataset(ds) == CT_RESCALE
+
+    def test_default_window(self):
+        """Test the default window covers the modality range of the frame"""
+        pixels = np.array([[1000, 1100]], dtype=np.uint16)
+        assert default_window(pixels, CT_RESCALE) == WindowLevel(center=26.0, width=100.0)
+
+    def test_windowed_file(self, tmp_path):
+        """Test a stored window and rescale are applied to a frame of a file"""
+        path = tmp_path / "ct.dcm"
+        frames = np.array([[[0, 1064, 4000]]], dtype=np.uint16)
+        ds = create_image_dicom(path, frames)
+        ds.RescaleSlope = 1
+        ds.RescaleIntercept = -1024
+        ds.WindowCenter = 40
+        ds.WindowWidth = 400
+        ds.save_as(str(path))
+
+        result = get_windowed_pixel_array(read_dicom_file_mapped(path))
+        assert np.array_equal(result, apply_window(frames[0], SOFT_TISSUE, CT_RESCALE))
+
+    def test_qimage_from_uint8(self):
+        """Test display bytes are passed to the QImage unscaled"""
+        pixels = np.array([[0, 128], [200, 255]], dtype=np.uint8)
+        image = numpy_to_qimage(pixels)
+        assert image.pixelColor(1, 0).red() == 128
+        assert image.pixelColor(0, 1).red() == 200
+
+
+class TestWindowedFrame:
+    """Test class for re-windowing a decoded frame"""
+
+    def test_render_reuses_buffer(self):
+        """Test a new window is applied to the same pixels in the same buffer"""
+        pixels = np.arange(64, dtype=np.int16).reshape(8, 8) * 50
+        frame = WindowedFrame(pixels, CT_RESCALE)
+        first = frame.render()
+        assert np.array_equal(first, apply_window(pixels, frame.default_window, CT_RESCALE))
+
+        again = frame.render(SOFT_TISSUE)
+        assert again is first
+        assert frame.window == SOFT_TISSUE
+        assert np.array_equal(again, apply_window(pixels, SOFT_TISSUE, CT_RESCALE))
+
+    def test_render_level(self):
+        """Test large frames are rendered from the pyramid level matching the display size"""
+        pixels = np.arange(3000 * 4000, dtype=np.uint32).reshape(3000, 4000).astype(np.uint16)
+        frame = WindowedFrame(pixels, window=SOFT_TISSUE)
+        level = frame.level_for_size(1000, 700)
+        assert level == 2
+        rendered = frame.render(level=level)
+        assert rendered.shape == (750, 1000)
+        assert np.array_equal(rendered, apply_window(frame.pyramid.level(2), SOFT_TISSUE))
+        assert frame.level_for_size(8000, 8000) == 0
+
+    def test_from_dataset(self, tmp_path):
+        """Test the stored window of the file is the default"""
+        path = tmp_path / "ct.dcm"
+        ds = create_image_dicom(path, np.zeros((2, 4, 4), dtype=np.uint16))
+        ds.WindowCenter = 40
+        ds.WindowWidth = 400
+        ds.PhotometricInterpretation = "MONOCHROME1"
+        ds.save_as(str(path))
+        frame = WindowedFrame.from_dataset(read_dicom_file_mapped(path), frame=1)
+        assert frame.default_window == SOFT_TISSUE
+        assert frame.invert
+
+    def test_drag_window(self):
+        """Test dragging right widens the window and dragging down raises the level"""
+        dragged = drag_window(SOFT_TISSUE, 256, -128)
+        assert dragged.width == 800.0
+        assert dragged.center == -160.0
+        assert drag_window(SOFT_TISSUE, -10000, 0).width == 1.0
+
+
+class TestAutoWindow:
+    """Test class for the histogram based auto window"""
+
+    def test_hot_pixel_ignored(self):
+        """Test a single very bright pixel does not wash out the window like min/max does"""
+        pixels = np.tile(np.arange(1000, 1100, dtype=np.uint16), (100, 1))
+        pixels[0, 0] = 60000
+        window = auto_window(pixel_histogram(pixels))
+        assert 1000 <= window.center - window.width / 2 <= 1001
+        assert 1098 <= window.center + window.width / 2 <= 1099
+        assert default_window(pixels).width > 50000
+
+    def test_signed_pixels(self):
+        """Test negative stored values are counted at their own value"""
+        pixels = np.array([[-1000, -1000, 0, 500]], dtype=np.int16)
+        histogram = pixel_histogram(pixels)
+        assert histogram.offset == -1000
+        assert len(histogram.counts) == 1501
+        assert histogram.percentile(0) == -1000
+        assert histogram.percentile(50) == -1000
+        assert histogram.percentile(100) == 500
+
+    def test_rescale(self):
+        """Test the window is in rescaled values"""
+        histogram = pixel_histogram(np.array([[1024, 1424]], dtype=np.uint16))
+        window = auto_window(histogram, CT_RESCALE, percentiles=(0, 100))
+        assert window == WindowLevel(center=200.0, width=400.0)
+
+    def test_sampled(self):
+        """Test large frames are counted on a grid instead of pixel by pixel"""
+        pixels = np.zeros((1000, 1000), dtype=np.uint8)
+        histogram = pixel_histogram(pixels, sample_pixels=10000)
+        assert histogram.total == 100 * 100
+
+    def test_float_pixels_rejected(self):
+        """Test only integer stored values have a histogram"""
+        with pytest.raises(TypeError):
+            pixel_histogram(np.zeros((2, 2), dtype=np.float32))
+        frame = WindowedFrame(np.array([[0.0, 2.0]], dtype=np.float32))
+        assert frame.histogram() is None
+        assert frame.auto_window() == WindowLevel(center=1.0, width=2.0)
+
+    def test_histogram_cached(self, tmp_path):
+        """Test the histogram of a frame is computed once per file and frame"""
+        path = tmp_path / "ct.dcm"
+        create_image_dicom(path, np.zeros((2, 4, 4), dtype=np.uint16))
+        cache = DicomCache()
+        pixels = np.arange(16, dtype=np.uint16).reshape(4, 4)
+        first = frame_histogram(pixels, cache, str(path), 1)
+        assert frame_histogram(pixels, cache, str(path), 1) is first
+        assert frame_histogram(pixels, cache, str(path), 0) is not first
+
+    def test_histograms_added(self):
+        """Test histograms with different ranges add up value by value"""
+        total = PixelHistogram(np.array([1, 2]), 10) + PixelHistogram(np.array([3, 0, 4]), 11)
+        assert total.offset == 10
+        assert total.counts.tolist() == [1, 5, 0, 4]
+
+    def test_series_window(self, tmp_path):
+        """Test one window covers the range of every slice of a series"""
+        paths = []
+        for index in range(3):
+            path = tmp_path / f"slice{index}.dcm"
+            create_image_dicom(path, np.full((1, 8, 8), 100 * index, dtype=np.uint16))
+            paths.append(path)
+        cache = DicomCache()
+        histogram = volume_histogram(SeriesVolume(paths, cache=cache), cache)
+        assert histogram.total == 3 * 64
+        window = auto_window(histogram, percentiles=(0, 100))
+        assert window == WindowLevel(center=100.0, width=200.0)
+
+    def test_frame_default(self):
+        """Test frames without a stored window start at the auto window"""
+        pixels = np.zeros((20, 20), dtype=np.uint16)
+        pixels[10:] = 200
+        pixels[0, 0] = 4095
+        frame = WindowedFrame(pixels)
+        assert frame.default_window == WindowLevel(center=100.0, width=200.0)
+
+
+if __name__ == "__main__":
+    pytest.main()